@@ -1,16 +1,10 @@
 # RAG Chatbot API Package
 import logging
-import os
 
-# Configure logging once for the entire app
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('app.log') if os.getenv('LOG_TO_FILE', 'false').lower() == 'true' else logging.NullHandler()
-    ]
-)
+from .logging_setup import configure_logging
+
+# Configure logging once for the entire app (queued; written by a background thread)
+configure_logging()
 
 # Create logger for the app
 logger = logging.getLogger(__name__)
@@ -0,0 +1,250 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+# Global /chat concurrency: requests running, requests allowed to wait, and
+# how long one may wait for a slot before being shed with 503
+CHAT_MAX_IN_FLIGHT = int(os.getenv("CHAT_MAX_IN_FLIGHT", "16"))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "32"))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "5"))
+# Slots only priority requests (suggested questions) may use
+CHAT_PRIORITY_SLOTS = int(os.getenv("CHAT_PRIORITY_SLOTS", "2"))
+
+# /chat/batch generations in flight across all batches, kept well below the
+# provider caps so offline batches can't crowd out live /chat; generations
+# wait up to BATCH_QUEUE_TIMEOUT for a slot, then fail for that question
+BATCH_MAX_IN_FLIGHT = int(os.getenv("BATCH_MAX_IN_FLIGHT", "2"))
+BATCH_MAX_QUEUE = int(os.getenv("BATCH_MAX_QUEUE", "256"))
+BATCH_QUEUE_TIMEOUT = float(os.getenv("BATCH_QUEUE_TIMEOUT", "120"))
+
+# Token buckets: sustained requests per minute and burst size, per session and per IP
+RATE_LIMIT_SESSION_PER_MINUTE = float(os.getenv("RATE_LIMIT_SESSION_PER_MINUTE", "12"))
+RATE_LIMIT_SESSION_BURST = int(os.getenv("RATE_LIMIT_SESSION_BURST", "5"))
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "60"))
+RATE_LIMIT_IP_BURST = int(os.getenv("RATE_LIMIT_IP_BURST", "20"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens per second."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def wait(self) -> float:
+        """Seconds until a token is available (0 if one is now), without taking it."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+    def take(self) -> Tuple[bool, float]:
+        """Take one token; returns (allowed, seconds until a token is available)."""
+        retry_after = self.wait()
+        if retry_after:
+            return False, retry_after
+        self.tokens -= 1
+        return True, 0.0
+
+
+class RateLimiter:
+    """Token buckets keyed by client, with the least recently seen keys dropped."""
+
+    def __init__(self, per_minute: float, burst: int, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def bucket(self, key: str) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def take(self, key: str) -> Tuple[bool, float]:
+        return self.bucket(key).take()
+
+
+class ConcurrencyLimiter:
+    """
+    Bounded in-flight counter with a bounded FIFO wait queue.
+
+    Normal requests may use `limit - reserved` slots; priority requests
+    may use all of them and are woken ahead of normal waiters. Requests
+    that find the queue full, or wait longer than the timeout, are
+    rejected instead of piling up.
+    """
+
+    def __init__(self, limit: int, max_queue: int, timeout: float, reserved: int = 0):
+        self.limit = max(limit, 1)
+        self.reserved = min(max(reserved, 0), self.limit - 1)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.in_flight = 0
+        self._waiters: deque = deque()  # (priority, future)
+        self.stats = {"admitted": 0, "shed_queue_full": 0, "shed_timeout": 0}
+        self.waits: deque = deque(maxlen=1000)
+
+    def _cap(self, priority: bool) -> int:
+        return self.limit if priority else self.limit - self.reserved
+
+    def _has_waiters(self, priority: bool) -> bool:
+        # Priority requests only queue behind other priority requests
+        return any(p for p, _ in self._waiters) if priority else bool(self._waiters)
+
+    async def acquire(self, priority: bool = False) -> float:
+        """
+        Take a slot, waiting in the queue if necessary.
+
+        Returns:
+            Seconds spent waiting
+
+        Raises:
+            HTTPException: 503 with Retry-After when the queue is full or the wait times out
+        """
+        if self.in_flight < self._cap(priority) and not self._has_waiters(priority):
+            self.in_flight += 1
+            self._admitted(0.0)
+            return 0.0
+        if len(self._waiters) >= self.max_queue:
+            self.stats["shed_queue_full"] += 1
+            raise self._overloaded("Server busy, please retry shortly")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, future)
+        if priority:
+            # Ahead of every normal waiter, behind earlier priority waiters
+            index = sum(1 for p, _ in self._waiters if p)
+            self._waiters.insert(index, entry)
+        else:
+            self._waiters.append(entry)
+
+        started = time.perf_counter()
+        try:
+            await asyncio.wait({future}, timeout=self.timeout)
+        except asyncio.CancelledError:
+            # Caller went away: give back a slot that was already handed over
+            if future.done():
+                self.release()
+            else:
+                future.cancel()
+                self._waiters.remove(entry)
+            raise
+        if not future.done():
+            future.cancel()
+            self._waiters.remove(entry)
+            self.stats["shed_timeout"] += 1
+            raise self._overloaded("Timed out waiting for capacity")
+        waited = time.perf_counter() - started
+        self._admitted(waited)
+        return waited
+
+    def release(self) -> None:
+        """Return a slot, handing it straight to the next eligible waiter."""
+        self.in_flight -= 1
+        for i, (priority, future) in enumerate(self._waiters):
+            if self.in_flight >= self._cap(priority):
+                continue
+            del self._waiters[i]
+            self.in_flight += 1
+            future.set_result(None)
+            return
+
+    def _admitted(self, waited: float) -> None:
+        self.stats["admitted"] += 1
+        self.waits.append(waited)
+
+    def _overloaded(self, detail: str) -> HTTPException:
+        # Rough estimate: one queue timeout is how long the backlog takes to move
+        return HTTPException(
+            status_code=503,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(self.timeout)))}
+        )
+
+    @asynccontextmanager
+    async def slot(self, priority: bool = False):
+        """Hold a slot for the duration of a block."""
+        waited = await self.acquire(priority)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+        pick = lambda q: round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 1) if waits else None
+        return {
+            "in_flight": self.in_flight,
+            "limit": self.limit,
+            "priority_slots": self.reserved,
+            "queued": len(self._waiters),
+            "max_queue": self.max_queue,
+            **self.stats,
+            "queue_wait_p50_ms": pick(0.50),
+            "queue_wait_p95_ms": pick(0.95),
+            "queue_wait_max_ms": round(waits[-1] * 1000, 1) if waits else None,
+        }
+
+
+class AdmissionController:
+    """Rate limits and concurrency limits in front of /chat (and a separate budget for /chat/batch)."""
+
+    def __init__(self):
+        self.chat = ConcurrencyLimiter(CHAT_MAX_IN_FLIGHT, CHAT_MAX_QUEUE, CHAT_QUEUE_TIMEOUT, CHAT_PRIORITY_SLOTS)
+        self.batch = ConcurrencyLimiter(BATCH_MAX_IN_FLIGHT, BATCH_MAX_QUEUE, BATCH_QUEUE_TIMEOUT)
+        self.session_limiter = RateLimiter(RATE_LIMIT_SESSION_PER_MINUTE, RATE_LIMIT_SESSION_BURST)
+        self.ip_limiter = RateLimiter(RATE_LIMIT_IP_PER_MINUTE, RATE_LIMIT_IP_BURST)
+        self.stats = {"rate_limited_session": 0, "rate_limited_ip": 0, "cache_hits": 0}
+
+    def check_rate(self, client_ip: Optional[str], session_id: Optional[str]) -> None:
+        """
+        Charge one request to the caller's buckets.
+
+        Every bucket is checked before any is charged, so a request refused
+        by one limit doesn't use up the caller's budget in the other.
+
+        Raises:
+            HTTPException: 429 with Retry-After when a bucket is empty
+        """
+        checks = []
+        if session_id:
+            checks.append(("rate_limited_session", self.session_limiter.bucket(f"s:{session_id}")))
+        if client_ip:
+            checks.append(("rate_limited_ip", self.ip_limiter.bucket(f"ip:{client_ip}")))
+        for stat, bucket in checks:
+            retry_after = bucket.wait()
+            if retry_after:
+                self.stats[stat] += 1
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many requests, please slow down",
+                    headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+                )
+        for _, bucket in checks:
+            bucket.take()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"chat": self.chat.snapshot(), "batch": self.batch.snapshot(), **self.stats}
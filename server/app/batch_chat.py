@@ -0,0 +1,103 @@
+"""
+Send a file of questions through /chat/batch and write the answers as JSONL.
+
+Input is JSONL (one object per line, e.g. {"id": "q1", "message": "..."};
+files shaped like requests.jsonl work too) or plain text with one
+question per line. Results are written as they complete, one JSON
+object per line, followed by a summary line. The endpoint needs the admin
+token (--admin-token, default: $ADMIN_TOKEN).
+
+    python -m app.batch_chat questions.jsonl > answers.jsonl
+    python -m app.batch_chat questions.txt --tenant acme --concurrency 8 --out answers.jsonl
+"""
+import os
+import sys
+import json
+import argparse
+from typing import Any, Dict, Iterable, List
+
+import httpx
+
+# Fields tried, in order, for the question text and the item id of a JSONL record
+MESSAGE_FIELDS = ("message", "question", "title", "body")
+ID_FIELDS = ("id", "request_id", "question_id")
+
+
+def parse_questions(lines: Iterable[str]) -> List[Dict[str, str]]:
+    """
+    Parse JSONL or plain-text lines into [{"id", "message"}].
+
+    Records without an id are numbered by line; blank lines are skipped.
+
+    Raises:
+        ValueError: If a JSON record has no question field
+    """
+    questions = []
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            record = json.loads(line)
+            message = next((record[f] for f in MESSAGE_FIELDS if record.get(f)), None)
+            if message is None:
+                raise ValueError(f"Line {number}: no question field ({', '.join(MESSAGE_FIELDS)})")
+            item_id = next((record[f] for f in ID_FIELDS if record.get(f)), number)
+        else:
+            message, item_id = line, number
+        questions.append({"id": str(item_id), "message": str(message)})
+    return questions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a file of questions through /chat/batch")
+    parser.add_argument("input", help="JSONL or text file of questions ('-' for stdin)")
+    parser.add_argument("--url", default="http://localhost:8000", help="API base URL")
+    parser.add_argument("--tenant", help="Tenant id (X-Tenant-ID)")
+    parser.add_argument("--admin-token", default=os.getenv("ADMIN_TOKEN", ""), help="Admin token (default: $ADMIN_TOKEN)")
+    parser.add_argument("--concurrency", type=int, help="Concurrent LLM generations (server default if omitted)")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore cached answers")
+    parser.add_argument("--out", help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    with source:
+        questions = parse_questions(source)
+    if not questions:
+        sys.exit("No questions found")
+
+    payload: Dict[str, Any] = {"questions": questions, "use_cache": not args.no_cache}
+    if args.concurrency:
+        payload["concurrency"] = args.concurrency
+    headers = {"X-Admin-Token": args.admin_token}
+    if args.tenant:
+        headers["X-Tenant-ID"] = args.tenant
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    done = 0
+    try:
+        with httpx.stream("POST", f"{args.url.rstrip('/')}/chat/batch", json=payload,
+                          headers=headers, timeout=None) as response:
+            if response.status_code != 200:
+                response.read()
+                sys.exit(f"HTTP {response.status_code}: {response.text}")
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                out.write(line + "\n")
+                out.flush()
+                result = json.loads(line)
+                if "summary" in result:
+                    print(json.dumps(result["summary"]), file=sys.stderr)
+                    continue
+                done += 1
+                status = "error: " + result["error"] if "error" in result else \
+                    f"{result['timing']['elapsed_ms']:.0f} ms"
+                print(f"[{done}/{len(questions)}] {result['id']}: {status}", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Benchmark retrieval filters applied inside the vector search versus after it.
+
+For each filter, the same query vectors are searched with the filter as a
+Chroma where-clause ("pre", RETRIEVAL_FILTER_MODE=pre) and unfiltered with
+--overfetch times k results that are filtered afterwards ("post xN").
+Each is compared with the exact top-k among the matching chunks (brute
+force over their stored embeddings): latency, recall@k and the share of
+queries that came back with fewer results than exist.
+
+Without --filter, three filters are picked from the collection: its most
+common file type, its most common source tag and one mid-sized source.
+
+    python -m app.bench_filters --sample 100 -k 8
+    python -m app.bench_filters --filter '{"file_type": "pdf"}' --filter '{"source_tag": "pricing"}' --json
+"""
+import sys
+import json
+import argparse
+from collections import Counter
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from .rag import ChromaSearch, current_embeddings, get_vectorstore, collection_name_for, source_store
+from .filters import SearchFilter, normalize_filters, compile_filters
+from .bench_search import _sample_queries, _measure
+from .tenants import use_tenant
+
+
+def _pick_filters(collection, batch_size: int) -> List[Dict[str, Any]]:
+    """A broad, a tag and a narrow filter, by chunk counts of the collection's sources."""
+    chunks_per_source: Counter = Counter()
+    offset = 0
+    while True:
+        metadatas = collection.get(include=["metadatas"], limit=batch_size, offset=offset)["metadatas"]
+        if not metadatas:
+            break
+        chunks_per_source.update(m["source_id"] for m in metadatas if m and "source_id" in m)
+        offset += len(metadatas)
+    rows = source_store.get_many(chunks_per_source)
+    by_type, by_tag, by_path = Counter(), Counter(), Counter()
+    for source_id, count in chunks_per_source.items():
+        row = rows.get(source_id, {})
+        if row.get("file_type"):
+            by_type[row["file_type"]] += count
+        if row.get("source_tag"):
+            by_tag[row["source_tag"]] += count
+        by_path[row.get("source")] += count
+    filters = []
+    if by_type:
+        filters.append({"file_type": by_type.most_common(1)[0][0]})
+    if by_tag:
+        filters.append({"source_tag": by_tag.most_common(1)[0][0]})
+    paths = [path for path, _ in by_path.most_common() if path]
+    if paths:
+        filters.append({"source": paths[len(paths) // 2]})
+    return filters
+
+
+def _matching(collection, search_filter: SearchFilter, batch_size: int) -> Dict[str, np.ndarray]:
+    """Stored embeddings of every chunk the filter matches, by id."""
+    where = None if search_filter.residual else search_filter.where
+    matched, offset = {}, 0
+    while True:
+        batch = collection.get(where=where, include=["embeddings", "metadatas"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        for chunk_id, embedding, metadata in zip(batch["ids"], batch["embeddings"], batch["metadatas"]):
+            if search_filter.matches(metadata or {}):
+                matched[chunk_id] = np.asarray(embedding, dtype=np.float32)
+        offset += len(batch["ids"])
+    return matched
+
+
+def _exact_topk(vectors: List[List[float]], matched: Dict[str, np.ndarray], k: int, space: str) -> List[List[str]]:
+    ids = list(matched)
+    if not ids:
+        return [[] for _ in vectors]
+    matrix = np.stack([matched[i] for i in ids])
+    results = []
+    for vector in vectors:
+        query = np.asarray(vector, dtype=np.float32)
+        if space == "l2":
+            distances = ((matrix - query) ** 2).sum(axis=1)
+        elif space == "cosine":
+            norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+            distances = 1 - matrix @ query / np.maximum(norms, 1e-12)
+        else:
+            distances = 1 - matrix @ query
+        order = np.argsort(distances, kind="stable")[:k]
+        results.append([ids[i] for i in order])
+    return results
+
+
+def _counting(search: Callable[[List[float]], List[str]], expected: int, short: List[int]):
+    """Wrap a search to count queries that returned fewer than `expected` results."""
+    def run(vector: List[float]) -> List[str]:
+        ids = search(vector)
+        short[0] += len(ids) < expected
+        return ids
+    return run
+
+
+def run(filters: List[Dict[str, Any]], queries: List[str], k: int, overfetch: List[int], repeat: int,
+        batch_size: int) -> Dict[str, Any]:
+    collection = get_vectorstore()._collection
+    total = collection.count()
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+    vectors = current_embeddings().embed_documents(queries)
+    chroma = ChromaSearch()
+
+    report = {"collection": collection.name, "chunks": total, "queries": len(vectors), "k": k, "filters": []}
+    for raw in filters:
+        normalized = normalize_filters(raw)
+        search_filter = compile_filters(normalized, source_store, collection_name_for())
+        if search_filter.empty:
+            report["filters"].append({"filter": normalized, "matching_chunks": 0, "selectivity": 0.0,
+                                      "source_ids": 0, "pushed_down": True, "variants": {}})
+            continue
+        matched = _matching(collection, search_filter, batch_size)
+        reference = _exact_topk(vectors, matched, k, space)
+        expected = min(k, len(matched))
+        entry = {"filter": normalized, "matching_chunks": len(matched),
+                 "selectivity": round(len(matched) / max(total, 1), 4),
+                 "source_ids": len(search_filter.source_ids) if search_filter.source_ids is not None else None,
+                 "pushed_down": not search_filter.residual, "variants": {}}
+
+        def pre(vector: List[float]) -> List[str]:
+            fetch = k * max(overfetch) if search_filter.residual else k
+            hits = chroma.search_by_vector(vector, fetch, where=search_filter.where)
+            return [hit.id for hit in hits if search_filter.matches(hit.metadata)][:k]
+
+        def post(factor: int) -> Callable[[List[float]], List[str]]:
+            def search(vector: List[float]) -> List[str]:
+                hits = chroma.search_by_vector(vector, k * factor)
+                return [hit.id for hit in hits if search_filter.matches(hit.metadata)][:k]
+            return search
+
+        variants = [("pre", pre)] + [(f"post x{factor}", post(factor)) for factor in overfetch]
+        for name, search in variants:
+            short = [0]
+            stats = _measure(_counting(search, expected, short), vectors, reference, repeat)
+            stats["short_results"] = round(short[0] / (len(vectors) * repeat), 3)
+            entry["variants"][name] = stats
+        report["filters"].append(entry)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare filtering in the vector search with filtering after it")
+    parser.add_argument("--tenant", default=None, help="Tenant whose collection to search")
+    parser.add_argument("--filter", action="append", type=json.loads, default=None,
+                        help="Retrieval filter as JSON (repeatable; default: picked from the collection)")
+    parser.add_argument("--queries", default=None, help="File with one question per line (default: sampled chunks)")
+    parser.add_argument("--sample", type=int, default=100, help="Sampled queries when --queries is not given")
+    parser.add_argument("-k", type=int, default=8, help="Results per query")
+    parser.add_argument("--overfetch", default="1,4,16", help="Post-filter fetch factors (comma-separated)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per query")
+    parser.add_argument("--batch-size", type=int, default=500, help="Records read per page")
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report")
+    args = parser.parse_args()
+
+    with use_tenant(args.tenant or ""):
+        collection = get_vectorstore()._collection
+        if not collection.count():
+            sys.exit("The collection is empty")
+        filters = args.filter or _pick_filters(collection, args.batch_size)
+        if not filters:
+            sys.exit("No compact-metadata sources to filter on (run the metadata migration first)")
+        if args.queries:
+            with open(args.queries, "r", encoding="utf-8") as f:
+                queries = [line.strip() for line in f if line.strip()]
+        else:
+            queries = _sample_queries(collection, args.sample)
+        overfetch = [int(factor) for factor in args.overfetch.split(",")]
+        report = run(filters, queries, args.k, overfetch, args.repeat, args.batch_size)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['collection']}: {report['chunks']} chunks, {report['queries']} queries, k={report['k']}")
+    for entry in report["filters"]:
+        print(f"\n{json.dumps(entry['filter'])}: {entry['matching_chunks']} chunks "
+              f"({entry['selectivity'] * 100:.2f}%), pushed down: {entry['pushed_down']}")
+        print(f"{'variant':<12}{'p50 ms':>9}{'p95 ms':>9}{'recall@k':>10}{'short':>8}")
+        for name, stats in entry["variants"].items():
+            print(f"{name:<12}{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['recall_at_k']:>10}"
+                  f"{stats['short_results']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Benchmark embedder/reranker throughput and latency per thread configuration.
+
+For every (torch threads, pool workers) pair, simulates concurrent /chat
+retrievals (one query embedding plus a rerank of `--candidates` passages)
+at each concurrency level and reports requests/s and latency
+percentiles; then measures bulk throughput (texts/s) per batch size, as
+used by ingestion and batch chat.
+
+    python -m app.bench_inference --threads 1,2,4,8 --workers 1,2,4 --concurrency 1,4,16
+    python -m app.bench_inference --batch-sizes 16,32,64 --rerank-max-length 256 --json
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+from pathlib import Path
+from typing import Any, Dict, List
+
+from .rag import _embedder, embeddings, reranker, get_vectorstore
+from .bench_search import _sample_queries
+from .inference import embed_pool, rerank_pool, set_embed_max_length, available_cpus, TORCH_INTEROP_THREADS
+from .tenants import use_tenant
+
+
+def _ints(value: str) -> List[int]:
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def _percentiles(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def _retrieval_load(texts: List[str], concurrency: int, requests: int, candidates: int,
+                    rerank_max_length: int) -> Dict[str, Any]:
+    """`concurrency` client threads each issuing query-embed + rerank requests."""
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def client(offset: int) -> None:
+        for i in range(offset, requests, concurrency):
+            query = texts[i % len(texts)][:120]
+            passages = [texts[(i + j + 1) % len(texts)] for j in range(candidates)]
+            started = time.perf_counter()
+            embeddings.embed_query(query)
+            rerank_pool.run(reranker.compute_score, [(query, p) for p in passages],
+                            max_length=rerank_max_length, items=len(passages))
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(offset,)) for offset in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return {"concurrency": concurrency, "requests_per_s": round(len(latencies) / wall, 2), **_percentiles(latencies)}
+
+
+def _bulk_throughput(texts: List[str], batch_size: int, rerank_max_length: int) -> Dict[str, Any]:
+    """Texts/s embedding and pairs/s reranking all texts at one batch size."""
+    _embedder.encode_kwargs["batch_size"] = batch_size
+    started = time.perf_counter()
+    embeddings.embed_documents(texts)
+    embed_s = time.perf_counter() - started
+
+    pairs = [(texts[i - 1][:120], text) for i, text in enumerate(texts)]
+    started = time.perf_counter()
+    rerank_pool.run(reranker.compute_score, pairs, batch_size=batch_size, max_length=rerank_max_length,
+                    items=len(pairs))
+    rerank_s = time.perf_counter() - started
+    return {
+        "batch_size": batch_size,
+        "embed_texts_per_s": round(len(texts) / embed_s, 1),
+        "rerank_pairs_per_s": round(len(pairs) / rerank_s, 1),
+    }
+
+
+def run(texts: List[str], threads: List[int], workers: List[int], concurrency: List[int], requests: int,
+        candidates: int, batch_sizes: List[int], embed_max_length: int, rerank_max_length: int) -> Dict[str, Any]:
+    import torch
+
+    set_embed_max_length(_embedder, embed_max_length)
+    # Warm both models (first calls allocate and load kernels)
+    embeddings.embed_documents(texts[:8])
+    reranker.compute_score([(texts[0], text) for text in texts[:8]], max_length=rerank_max_length)
+
+    configurations = []
+    for num_threads in threads:
+        for pool_workers in workers:
+            # Pool threads read the intra-op setting when they first run torch,
+            # so the pools are recreated after changing it
+            torch.set_num_threads(num_threads)
+            embed_pool.resize(pool_workers)
+            rerank_pool.resize(pool_workers)
+            levels = [_retrieval_load(texts, level, requests, candidates, rerank_max_length) for level in concurrency]
+            configurations.append({
+                "torch_threads": num_threads,
+                "workers": pool_workers,
+                "cores_used": num_threads * pool_workers * 2,
+                "levels": levels,
+            })
+
+    bulk = [_bulk_throughput(texts, batch_size, rerank_max_length) for batch_size in batch_sizes]
+    return {
+        "available_cpus": len(available_cpus()),
+        "interop_threads": TORCH_INTEROP_THREADS,
+        "texts": len(texts),
+        "requests": requests,
+        "candidates": candidates,
+        "embed_max_length": embed_max_length,
+        "rerank_max_length": rerank_max_length,
+        "configurations": configurations,
+        "bulk": bulk,
+    }
+
+
+def main() -> None:
+    cpus = len(available_cpus())
+    parser = argparse.ArgumentParser(description="Benchmark embedder/reranker thread configurations")
+    parser.add_argument("--tenant", default=None, help="Tenant whose chunks are used as sample texts")
+    parser.add_argument("--texts", type=Path, help="File with one text per line (default: sample chunks)")
+    parser.add_argument("--sample", type=int, default=256, help="Texts sampled from the collection")
+    parser.add_argument("--threads", type=_ints, default=sorted({1, 2, 4, max(cpus // 4, 1)}),
+                        help="Torch intra-op thread counts, comma-separated")
+    parser.add_argument("--workers", type=_ints, default=[1, 2, 4], help="Workers per model pool")
+    parser.add_argument("--concurrency", type=_ints, default=[1, 4, 16], help="Concurrent simulated requests")
+    parser.add_argument("--requests", type=int, default=64, help="Requests per concurrency level")
+    parser.add_argument("--candidates", type=int, default=5, help="Passages reranked per request")
+    parser.add_argument("--batch-sizes", type=_ints, default=[8, 32, 128], help="Bulk batch sizes")
+    parser.add_argument("--embed-max-length", type=int, default=512)
+    parser.add_argument("--rerank-max-length", type=int, default=512)
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report")
+    args = parser.parse_args()
+
+    if args.texts:
+        texts = [line.strip() for line in args.texts.read_text(encoding="utf-8").splitlines() if line.strip()]
+    else:
+        with use_tenant(args.tenant or ""):
+            texts = _sample_queries(get_vectorstore()._collection, args.sample)
+    if len(texts) < 2:
+        sys.exit("Not enough texts: the collection is empty and no --texts file was given")
+
+    report = run(texts, args.threads, args.workers, args.concurrency, args.requests, args.candidates,
+                 args.batch_sizes, args.embed_max_length, args.rerank_max_length)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['available_cpus']} CPUs, {report['texts']} texts, {report['candidates']} candidates/request, "
+          f"max_length embed={report['embed_max_length']} rerank={report['rerank_max_length']}")
+    print(f"{'threads':>8}{'workers':>8}{'cores':>7}{'conc':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for config in report["configurations"]:
+        for level in config["levels"]:
+            print(f"{config['torch_threads']:>8}{config['workers']:>8}{config['cores_used']:>7}"
+                  f"{level['concurrency']:>6}{level['requests_per_s']:>9}{level['p50_ms']:>9}"
+                  f"{level['p95_ms']:>9}{level['p99_ms']:>9}")
+    print(f"\n{'batch':>8}{'embed texts/s':>16}{'rerank pairs/s':>16}")
+    for row in report["bulk"]:
+        print(f"{row['batch_size']:>8}{row['embed_texts_per_s']:>16}{row['rerank_pairs_per_s']:>16}")
+
+
+if __name__ == "__main__":
+    main()
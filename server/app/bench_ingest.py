@@ -0,0 +1,296 @@
+"""
+Benchmark ingestion end to end, with a breakdown by stage.
+
+Generates a synthetic corpus (PDF, markdown, text and Word files of
+--paragraphs paragraphs each, deterministic per --seed) or uses --corpus,
+runs ingest_folder into a scratch tenant collection and reports wall
+time, docs/s, chunks/s, embeddings/s, time per stage (loading per file
+type, chunking, embedding, Chroma upsert), peak RSS and on-disk index
+growth. Loading runs on INGEST_WORKERS threads, so its stage time is
+summed over them and can exceed the wall time. The scratch collection is
+dropped afterwards unless --keep-collection is given.
+
+    python -m app.bench_ingest --docs 200 --types pdf,md,txt,docx --paragraphs 40
+    python -m app.bench_ingest --corpus ./data --out ingest.json
+    python -m app.bench_ingest --docs 1000 --out after.json --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import textwrap
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from docx import Document as DocxDocument
+
+from . import rag
+from .rag import CHROMA_DIR, EMBED_MODEL_NAME, collection_name_for, get_vectorstore, maintenance_lock, source_store
+from .ingest import ingest_folder, LOADERS, DEFAULT_CHUNKER, INGEST_WORKERS
+from .inference import EMBED_WORKERS, EMBED_BATCH_SIZE, TORCH_NUM_THREADS
+from .logging_setup import request_context
+from .tenants import use_tenant
+
+BENCH_TENANT = "bench-ingest"
+
+_WORDS = (
+    "account access agent answer api archive audit backup balance billing browser cache capacity change "
+    "client cluster config contract customer dashboard data database deploy device discount document domain "
+    "email endpoint error export feature field file filter firewall format gateway guide history hosting "
+    "import incident index install integration invoice key label latency license limit log login metric "
+    "migration mobile monitor network notice order owner package partner password payment plan platform "
+    "policy portal price privacy profile project quota record refund region release report request "
+    "retention role schedule search security server service session setting storage subscription support "
+    "team template tenant ticket token traffic trial upgrade upload usage user version webhook workflow"
+).split()
+
+_TYPES = {"pdf": ".pdf", "md": ".md", "txt": ".txt", "docx": ".docx"}
+
+
+def _paragraph(rng: random.Random) -> str:
+    sentences = []
+    for _ in range(rng.randint(3, 7)):
+        words = [rng.choice(_WORDS) for _ in range(rng.randint(8, 20))]
+        sentences.append(" ".join(words).capitalize() + ".")
+    return " ".join(sentences)
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _pdf_bytes(pages: List[List[str]]) -> bytes:
+    """A minimal PDF with one Helvetica text line per entry of each page."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        ("<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages))).encode("ascii"),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, lines in enumerate(pages):
+        stream = ("BT /F1 10 Tf 12 TL 50 800 Td " +
+                  " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET").encode("latin-1")
+        objects.append((f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                        f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>").encode("ascii"))
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _write_document(path: Path, title: str, paragraphs: List[str]) -> None:
+    suffix = path.suffix
+    if suffix == ".pdf":
+        lines = [title, ""]
+        for paragraph in paragraphs:
+            lines.extend(textwrap.wrap(paragraph, 95) + [""])
+        path.write_bytes(_pdf_bytes([lines[i:i + 60] for i in range(0, len(lines), 60)]))
+    elif suffix == ".docx":
+        docx = DocxDocument()
+        docx.add_heading(title, level=1)
+        for i, paragraph in enumerate(paragraphs):
+            if i % 5 == 0:
+                docx.add_heading(f"Section {i // 5 + 1}", level=2)
+            docx.add_paragraph(paragraph)
+        docx.save(str(path))
+    else:
+        parts = [f"# {title}" if suffix == ".md" else title]
+        for i, paragraph in enumerate(paragraphs):
+            if i % 5 == 0:
+                parts.append(f"## Section {i // 5 + 1}" if suffix == ".md" else f"Section {i // 5 + 1}")
+            parts.append(paragraph)
+        path.write_text("\n\n".join(parts) + "\n", encoding="utf-8")
+
+
+def generate_corpus(directory: Path, docs: int, types: List[str], paragraphs: int, seed: int) -> Dict[str, Any]:
+    """Write `docs` synthetic documents, cycling through `types`."""
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    counts: Dict[str, int] = {}
+    for i in range(docs):
+        kind = types[i % len(types)]
+        title = " ".join(rng.choice(_WORDS) for _ in range(4)).title()
+        _write_document(directory / f"doc-{i:05d}{_TYPES[kind]}", title,
+                        [_paragraph(rng) for _ in range(paragraphs)])
+        counts[kind] = counts.get(kind, 0) + 1
+    return counts
+
+
+def _corpus_files(directory: Path) -> Dict[str, Any]:
+    files = [f for f in directory.rglob("*") if f.is_file() and f.suffix.lower() in LOADERS]
+    by_type: Dict[str, int] = {}
+    for f in files:
+        by_type[f.suffix.lower().lstrip(".")] = by_type.get(f.suffix.lower().lstrip("."), 0) + 1
+    return {"files": len(files), "bytes": sum(f.stat().st_size for f in files), "by_type": by_type}
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the kernel's peak RSS mark for this process (Linux), so the peak covers the ingest only."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _rss_mb(field: str) -> Optional[float]:
+    """VmRSS / VmHWM from /proc, or (for VmHWM) the process-lifetime peak from getrusage."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if field == "VmHWM":
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    return None
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def _drop_collection(tenant: str) -> None:
+    """Delete the scratch collection and its source rows."""
+    name = collection_name_for(tenant)
+    with maintenance_lock:
+        rag._client.delete_collection(name)
+        source_store.delete_collection(name)
+        rag._forget_vectorstore(tenant)
+
+
+def run(corpus: Path, tenant: str, keep_collection: bool) -> Dict[str, Any]:
+    files = _corpus_files(corpus)
+    with use_tenant(tenant):
+        if get_vectorstore()._collection.count():
+            raise RuntimeError(f"Collection of tenant {tenant} is not empty; pick another --tenant")
+        disk_before = rag._dir_size(Path(CHROMA_DIR))
+        rss_before = _rss_mb("VmRSS")
+        peak_scope = "ingest" if _reset_peak_rss() else "process"
+        try:
+            with request_context("bench-ingest") as timings:
+                started = time.perf_counter()
+                chunks = ingest_folder(str(corpus), source_tag="bench")
+                wall = time.perf_counter() - started
+            peak_rss = _rss_mb("VmHWM")
+            disk_growth = rag._dir_size(Path(CHROMA_DIR)) - disk_before
+            stored = get_vectorstore()._collection.count()
+        finally:
+            if not keep_collection:
+                _drop_collection(tenant)
+
+    embed_s = timings.get("embed", 0) / 1000
+    return {
+        "at": datetime.now().isoformat(),
+        "commit": _commit(),
+        "config": {
+            "ingest_workers": INGEST_WORKERS, "embed_workers": EMBED_WORKERS, "embed_batch_size": EMBED_BATCH_SIZE,
+            "torch_threads": TORCH_NUM_THREADS, "chunker": DEFAULT_CHUNKER, "embed_model": EMBED_MODEL_NAME,
+        },
+        "corpus": {"path": str(corpus), **files},
+        "chunks": chunks,
+        "stored_chunks": stored,
+        "wall_s": round(wall, 3),
+        "docs_per_s": round(files["files"] / wall, 2) if wall else None,
+        "chunks_per_s": round(chunks / wall, 1) if wall else None,
+        "embeddings_per_s": round(chunks / embed_s, 1) if embed_s else None,
+        "stages_ms": dict(sorted(timings.items())),
+        "stage_share": {name: round(ms / (wall * 1000), 3) for name, ms in sorted(timings.items())} if wall else {},
+        "rss_before_mb": rss_before,
+        "peak_rss_mb": peak_rss,
+        "peak_rss_scope": peak_scope,
+        "index_growth_bytes": disk_growth,
+        "index_bytes_per_chunk": round(disk_growth / chunks, 1) if chunks else None,
+    }
+
+
+_COMPARED = ("wall_s", "docs_per_s", "chunks_per_s", "embeddings_per_s", "peak_rss_mb", "index_bytes_per_chunk")
+
+
+def _print_report(report: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> None:
+    corpus = report["corpus"]
+    print(f"{corpus['files']} files ({corpus['bytes'] / 1e6:.1f} MB, {corpus['by_type']}) -> "
+          f"{report['chunks']} chunks in {report['wall_s']}s")
+    print(f"{'metric':<24}{'value':>12}" + (f"{'previous':>12}{'change':>9}" if previous else ""))
+    for key in _COMPARED:
+        value, line = report.get(key), f"{key:<24}{str(report.get(key)):>12}"
+        if previous:
+            old = previous.get(key)
+            change = f"{(value / old - 1) * 100:+.1f}%" if value and old else "-"
+            line += f"{str(old):>12}{change:>9}"
+        print(line)
+    print(f"\n{'stage':<24}{'ms':>12}{'share':>9}")
+    for name, ms in report["stages_ms"].items():
+        print(f"{name:<24}{ms:>12}{report['stage_share'].get(name, 0) * 100:>8.1f}%")
+    print(f"\nindex growth: {report['index_growth_bytes'] / 1e6:.2f} MB, "
+          f"peak RSS: {report['peak_rss_mb']} MB ({report['peak_rss_scope']})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark ingestion throughput per stage")
+    parser.add_argument("--corpus", default=None, help="Existing folder to ingest (default: generate one)")
+    parser.add_argument("--docs", type=int, default=200, help="Generated documents")
+    parser.add_argument("--types", default="pdf,md,txt,docx", help="Generated file types (cycled)")
+    parser.add_argument("--paragraphs", type=int, default=40, help="Paragraphs per generated document")
+    parser.add_argument("--seed", type=int, default=7, help="Seed of the generated text")
+    parser.add_argument("--keep-corpus", default=None, help="Write the generated corpus here and keep it")
+    parser.add_argument("--tenant", default=BENCH_TENANT, help="Scratch tenant to ingest into (must be empty)")
+    parser.add_argument("--keep-collection", action="store_true", help="Keep the ingested collection")
+    parser.add_argument("--out", default=None, help="Write the JSON report to this file")
+    parser.add_argument("--compare", default=None, help="Earlier JSON report to compare against")
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report")
+    args = parser.parse_args()
+
+    types = [t.strip().lower().lstrip(".") for t in args.types.split(",") if t.strip()]
+    unknown = set(types) - set(_TYPES)
+    if unknown:
+        sys.exit(f"Unknown types: {', '.join(sorted(unknown))} (use {', '.join(_TYPES)})")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.corpus:
+            corpus = Path(args.corpus)
+        else:
+            corpus = Path(args.keep_corpus or os.path.join(tmp, "corpus"))
+            generate_corpus(corpus, args.docs, types, args.paragraphs, args.seed)
+        try:
+            report = run(corpus, args.tenant, args.keep_collection)
+        except RuntimeError as e:
+            sys.exit(str(e))
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+    _print_report(report, previous)
+
+
+if __name__ == "__main__":
+    main()
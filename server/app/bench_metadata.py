@@ -0,0 +1,162 @@
+"""
+Measure what the compact chunk metadata schema saves.
+
+Copies the tenant's chunks (with their stored embeddings) into two
+scratch Chroma stores, one with full per-chunk metadata as ingestion used
+to write it and one with compact metadata plus a sources table, then
+reports on-disk size, metadata per chunk and query latency of each
+(for the compact store, also the source join for the returned chunks).
+
+    python -m app.bench_metadata --sample 200 -k 8
+    python -m app.bench_metadata --tenant acme --json
+"""
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import chromadb
+from chromadb.config import Settings as ChromaSettings
+
+from .rag import get_vectorstore, source_store, _iter_records, _dir_size
+from .sources import SourceRegistry, SourceStore, SOURCES_DB, expand_metadata
+from .tenants import use_tenant
+
+
+def _legacy_form(metadatas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Full per-chunk metadata, re-expanding chunks that are already compact."""
+    sources = source_store.get_many(m["source_id"] for m in metadatas if m and "source_id" in m)
+    return [expand_metadata(m or {}, sources) for m in metadatas]
+
+
+def _copy(source_collection, directory: Path, transform: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]],
+          batch_size: int):
+    client = chromadb.PersistentClient(path=str(directory), settings=ChromaSettings(anonymized_telemetry=False))
+    target = client.create_collection("bench", metadata=source_collection.metadata or None)
+    for batch in _iter_records(source_collection, batch_size):
+        target.add(ids=batch["ids"], embeddings=batch["embeddings"], documents=batch["documents"],
+                   metadatas=transform(batch["metadatas"]))
+    return client, target
+
+
+def _profile(collection, batch_size: int) -> Dict[str, Any]:
+    """Mean metadata keys and JSON bytes per chunk."""
+    keys = size = count = 0
+    offset = 0
+    while True:
+        metadatas = collection.get(include=["metadatas"], limit=batch_size, offset=offset)["metadatas"]
+        if not metadatas:
+            break
+        for metadata in metadatas:
+            metadata = metadata or {}
+            keys += len(metadata)
+            size += len(json.dumps(metadata, ensure_ascii=False))
+            count += 1
+        offset += len(metadatas)
+    return {"keys_per_chunk": round(keys / max(count, 1), 2), "metadata_bytes_per_chunk": round(size / max(count, 1), 1)}
+
+
+def _timings(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 3)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95)}
+
+
+def _measure(collection, vectors: List[List[float]], k: int, repeat: int,
+             store: Optional[SourceStore] = None) -> Dict[str, Any]:
+    """Query latency (documents, metadata, distances) and, with a store, the source join after it."""
+    query_latencies, join_latencies = [], []
+    for vector in vectors:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results = collection.query(query_embeddings=[vector], n_results=k,
+                                       include=["documents", "metadatas", "distances"])
+            query_latencies.append(time.perf_counter() - started)
+            if store is not None:
+                started = time.perf_counter()
+                metadatas = results["metadatas"][0]
+                sources = store.get_many(m["source_id"] for m in metadatas if "source_id" in m)
+                for metadata in metadatas:
+                    expand_metadata(metadata, sources)
+                join_latencies.append(time.perf_counter() - started)
+    report = {"query": _timings(query_latencies)}
+    if join_latencies:
+        report["join"] = _timings(join_latencies)
+        report["query_and_join"] = _timings([q + j for q, j in zip(query_latencies, join_latencies)])
+    return report
+
+
+def run(sample: int, k: int, repeat: int, batch_size: int) -> Dict[str, Any]:
+    collection = get_vectorstore()._collection
+    total = collection.count()
+    step = max(total // max(sample, 1), 1)
+    vectors = []
+    for offset in range(0, total, step):
+        embeddings = collection.get(limit=1, offset=offset, include=["embeddings"])["embeddings"]
+        if embeddings is not None and len(embeddings):
+            vectors.append(list(embeddings[0]))
+        if len(vectors) >= sample:
+            break
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_dir, compact_dir = Path(tmp) / "legacy", Path(tmp) / "compact"
+        _, legacy = _copy(collection, legacy_dir, _legacy_form, batch_size)
+
+        registry = SourceRegistry()
+        _, compact = _copy(collection, compact_dir,
+                           lambda metadatas: [registry.compact(m) for m in _legacy_form(metadatas)], batch_size)
+        store = SourceStore(compact_dir / SOURCES_DB)
+        store.add("bench", registry.rows)
+
+        report = {
+            "collection": collection.name,
+            "chunks": total,
+            "sources": len(registry.rows),
+            "queries": len(vectors),
+            "k": k,
+            "legacy": {"size_bytes": _dir_size(legacy_dir), **_profile(legacy, batch_size),
+                       **_measure(legacy, vectors, k, repeat)},
+            "compact": {"size_bytes": _dir_size(compact_dir), **_profile(compact, batch_size),
+                        **_measure(compact, vectors, k, repeat, store)},
+        }
+    legacy_size, compact_size = report["legacy"]["size_bytes"], report["compact"]["size_bytes"]
+    report["size_saved_pct"] = round((1 - compact_size / legacy_size) * 100, 1) if legacy_size else None
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure the compact chunk metadata schema")
+    parser.add_argument("--tenant", default=None, help="Tenant whose collection to use")
+    parser.add_argument("--sample", type=int, default=200, help="Stored vectors used as queries")
+    parser.add_argument("-k", type=int, default=8, help="Results per query")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per query")
+    parser.add_argument("--batch-size", type=int, default=500, help="Records copied per page")
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report")
+    args = parser.parse_args()
+
+    with use_tenant(args.tenant or ""):
+        if not get_vectorstore()._collection.count():
+            sys.exit("The collection is empty")
+        report = run(args.sample, args.k, args.repeat, args.batch_size)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['collection']}: {report['chunks']} chunks from {report['sources']} sources, "
+          f"{report['queries']} queries, k={report['k']}")
+    print(f"{'schema':<10}{'size MB':>10}{'keys/chunk':>12}{'bytes/chunk':>13}{'query p50':>11}{'p95':>8}"
+          f"{'+join p50':>11}{'p95':>8}")
+    for name in ("legacy", "compact"):
+        stats = report[name]
+        joined = stats.get("query_and_join", stats["query"])
+        print(f"{name:<10}{stats['size_bytes'] / 1e6:>10.2f}{stats['keys_per_chunk']:>12}"
+              f"{stats['metadata_bytes_per_chunk']:>13}{stats['query']['p50_ms']:>11}{stats['query']['p95_ms']:>8}"
+              f"{joined['p50_ms']:>11}{joined['p95_ms']:>8}")
+    print(f"size saved: {report['size_saved_pct']}%")
+
+
+if __name__ == "__main__":
+    main()
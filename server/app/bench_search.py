@@ -0,0 +1,193 @@
+"""
+Benchmark the vector search backends against the current Chroma path.
+
+Builds temporary mmap indexes (float16/int8, exact and HNSW) from the
+tenant's collection, runs the same query vectors through each backend
+and reports latency and how often the top-k matches Chroma's. Indexes
+with a coarse stage (PCA/truncation, int8/binary codes, rescored at each
+--rescore-factors) are added for every --coarse spec, with the bytes per
+vector every query scans: the recall-vs-memory trade-off for
+VECTOR_COARSE, VECTOR_REDUCE and VECTOR_RESCORE_FACTOR.
+
+    python -m app.bench_search --sample 200 -k 8
+    python -m app.bench_search --queries questions.txt --tenant acme --json
+    python -m app.bench_search --coarse int8:pca128,binary,binary:pca256 --rescore-factors 4,8,16
+"""
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .rag import ChromaSearch, current_embeddings, get_vectorstore, _iter_records
+from .tenants import use_tenant
+from .vector_index import MmapVectorIndex, build_index, hnswlib, VECTOR_REDUCED_DIM, VECTOR_RESCORE_FACTOR
+
+
+def _sample_queries(collection, sample: int) -> List[str]:
+    """Use the opening of evenly spaced chunks as stand-in questions."""
+    total = collection.count()
+    step = max(total // max(sample, 1), 1)
+    queries = []
+    for offset in range(0, total, step):
+        documents = collection.get(limit=1, offset=offset, include=["documents"])["documents"]
+        if documents:
+            queries.append(documents[0][:160])
+        if len(queries) >= sample:
+            break
+    return queries
+
+
+def _measure(search: Callable[[List[float]], Any], vectors: List[List[float]],
+             reference: Optional[List[List[str]]], repeat: int) -> Dict[str, Any]:
+    """
+    Latency percentiles and, when a reference is given, agreement with its top-k.
+
+    With a reference, `search` must return the ids of its hits in rank order.
+    """
+    latencies, identical, overlap = [], 0, 0.0
+    for i, vector in enumerate(vectors):
+        for _ in range(repeat):
+            started = time.perf_counter()
+            ids = search(vector)
+            latencies.append(time.perf_counter() - started)
+        if reference is not None:
+            expected = reference[i]
+            identical += ids == expected
+            overlap += len(set(ids) & set(expected)) / max(len(expected), 1)
+    latencies.sort()
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 3)
+    return {
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "identical_topk": round(identical / len(vectors), 3) if reference is not None else None,
+        "recall_at_k": round(overlap / len(vectors), 3) if reference is not None else None,
+    }
+
+
+def _coarse_spec(value: str) -> Tuple[str, str, int]:
+    """Parse "int8:pca128" / "binary" / "float16:truncate256" into (coarse, reduce, dims)."""
+    coarse, _, projection = value.partition(":")
+    match = re.fullmatch(r"(pca|truncate)(\d+)", projection)
+    if projection and not match:
+        raise argparse.ArgumentTypeError(f"Invalid projection: {projection}")
+    return (coarse, match.group(1), int(match.group(2))) if match else (coarse, "none", 0)
+
+
+def run(queries: List[str], k: int, repeat: int, batch_size: int,
+        coarse_specs: Optional[List[Tuple[str, str, int]]] = None,
+        rescore_factors: Optional[List[int]] = None) -> Dict[str, Any]:
+    collection = get_vectorstore()._collection
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+    model = current_embeddings()
+    vectors = [model.embed_query(q) for q in queries]
+
+    # Reference: Chroma's own top-k ids for each query
+    reference = collection.query(query_embeddings=vectors, n_results=k, include=[])["ids"]
+
+    chroma = ChromaSearch()
+    results = {
+        # The ChromaSearch backend: query with documents, metadata and distances
+        "chroma": _measure(lambda v: [hit.id for hit in chroma.search_by_vector(v, k)], vectors, reference, repeat),
+        # The bare collection query, without documents or metadata
+        "chroma_ids_only": _measure(
+            lambda v: collection.query(query_embeddings=[v], n_results=k, include=[])["ids"][0],
+            vectors, reference, repeat
+        ),
+    }
+
+    variants = [("float16", "exact"), ("int8", "exact")]
+    if hnswlib is not None:
+        variants += [("float16", "hnsw"), ("int8", "hnsw")]
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype, search in variants:
+            directory = Path(tmp) / f"{dtype}_{search}"
+            manifest = build_index(
+                directory,
+                _iter_records(collection, batch_size),
+                space=space,
+                dtype=dtype,
+                exact_search_max=0 if search == "hnsw" else sys.maxsize,
+                coarse="none",
+                reduce="none"
+            )
+            index = MmapVectorIndex(directory)
+            stats = _measure(lambda v: [index.ids[row] for row, _ in index.search(v, k)],
+                             vectors, reference, repeat)
+            stats.update(build_ms=manifest["build_ms"], size_bytes=index.info()["size_bytes"],
+                         search_bytes_per_vector=index.info()["search_bytes_per_vector"])
+            results[f"mmap_{dtype}_{search}"] = stats
+
+        for coarse, reduce, dims in coarse_specs or []:
+            name = f"{coarse}" + (f"_{reduce}{dims}" if reduce != "none" else "")
+            directory = Path(tmp) / f"coarse_{name}"
+            manifest = build_index(directory, _iter_records(collection, batch_size), space=space,
+                                   coarse=coarse, reduce=reduce, reduced_dim=dims or VECTOR_REDUCED_DIM,
+                                   exact_search_max=sys.maxsize)
+            index = MmapVectorIndex(directory)
+            for factor in rescore_factors or [VECTOR_RESCORE_FACTOR]:
+                index.rescore_factor = factor
+                stats = _measure(lambda v: [index.ids[row] for row, _ in index.search(v, k)],
+                                 vectors, reference, repeat)
+                info = index.info()
+                stats.update(build_ms=manifest["build_ms"], size_bytes=info["size_bytes"],
+                             search_bytes_per_vector=info["search_bytes_per_vector"],
+                             explained_variance=(manifest["coarse"] or {}).get("explained_variance"))
+                results[f"coarse_{name}_x{factor}"] = stats
+
+    return {
+        "collection": collection.name,
+        "vectors": collection.count(),
+        "queries": len(queries),
+        "k": k,
+        "repeat": repeat,
+        "hnswlib_installed": hnswlib is not None,
+        "backends": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark vector search backends")
+    parser.add_argument("--tenant", default=None, help="Tenant whose collection to use")
+    parser.add_argument("--queries", type=Path, help="File with one query per line (default: sample chunks)")
+    parser.add_argument("--sample", type=int, default=200, help="Queries sampled from the collection")
+    parser.add_argument("-k", type=int, default=8, help="Results per query")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per query")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Records read per page when building")
+    parser.add_argument("--coarse", type=lambda v: [_coarse_spec(part) for part in v.split(",") if part.strip()],
+                        default=[], help="Coarse stages to compare, e.g. int8:pca128,binary,binary:pca256")
+    parser.add_argument("--rescore-factors", type=lambda v: [int(part) for part in v.split(",") if part.strip()],
+                        default=None, help="Shortlist sizes (× k) rescored at full precision")
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report")
+    args = parser.parse_args()
+
+    with use_tenant(args.tenant or ""):
+        collection = get_vectorstore()._collection
+        if args.queries:
+            queries = [line.strip() for line in args.queries.read_text(encoding="utf-8").splitlines() if line.strip()]
+        else:
+            queries = _sample_queries(collection, args.sample)
+        if not queries:
+            sys.exit("No queries: the collection is empty and no --queries file was given")
+        report = run(queries, args.k, args.repeat, args.batch_size, args.coarse, args.rescore_factors)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['collection']}: {report['vectors']} vectors, {report['queries']} queries, k={report['k']}")
+    print(f"{'backend':<28}{'p50 ms':>10}{'p95 ms':>10}{'identical':>11}{'recall@k':>10}{'size MB':>10}"
+          f"{'scan B/vec':>12}")
+    for name, stats in report["backends"].items():
+        size = f"{stats['size_bytes'] / 1e6:.1f}" if "size_bytes" in stats else "-"
+        scanned = stats.get("search_bytes_per_vector") or "-"
+        agreement = [stats[key] if stats[key] is not None else "-" for key in ("identical_topk", "recall_at_k")]
+        print(f"{name:<28}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+              f"{agreement[0]:>11}{agreement[1]:>10}{size:>10}{scanned:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Used for the small hot-path caches (answers, embeddings, retrieval
+    results); a ttl of 0 disables expiry, a max_size of 0 disables the cache.
+    """
+
+    def __init__(self, max_size: int, ttl: float = 0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Number of set() calls, so snapshots can tell whether anything changed
+        self.writes = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (self.ttl and time.time() - entry[1] > self.ttl):
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            self.writes += 1
+
+    def dump(self) -> List[Tuple[Hashable, Any, float]]:
+        """Unexpired entries as (key, value, stored_at), least recently used first."""
+        now = time.time()
+        with self._lock:
+            return [(key, value, stored_at) for key, (value, stored_at) in self._data.items()
+                    if not (self.ttl and now - stored_at > self.ttl)]
+
+    def restore(self, entries: Iterable[Tuple[Hashable, Any, float]]) -> int:
+        """
+        Add dumped entries, keeping their age (so the ttl still applies) and
+        never replacing an entry set since. Returns the number added.
+        """
+        if self.max_size <= 0:
+            return 0
+        now, added = time.time(), 0
+        with self._lock:
+            # Newest first, each moved in front of the previous one: dumped order is kept
+            for key, value, stored_at in reversed(list(entries)):
+                if key in self._data or (self.ttl and now - stored_at > self.ttl):
+                    continue
+                self._data[key] = (value, stored_at)
+                # Restored entries rank below anything used since startup
+                self._data.move_to_end(key, last=False)
+                added += 1
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return added
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def snapshot(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
@@ -0,0 +1,114 @@
+import os
+import re
+import hashlib
+import logging
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+# Diversity stage between vector search and the cross-encoder ("false" disables)
+RETRIEVAL_DIVERSITY = os.getenv("RETRIEVAL_DIVERSITY", "true").lower() == "true"
+# MMR trade-off: 1.0 = pure relevance, 0.0 = pure novelty
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Candidates searched per query variant, as a multiple of k, for MMR to choose from
+MMR_FETCH_FACTOR = int(os.getenv("MMR_FETCH_FACTOR", "3"))
+# Candidates this similar (cosine) to an already selected one are dropped
+NEAR_DUPLICATE_SIMILARITY = float(os.getenv("NEAR_DUPLICATE_SIMILARITY", "0.97"))
+# SimHash fingerprints this many bits apart (of 64) or fewer count as duplicates
+SIMHASH_MAX_DISTANCE = int(os.getenv("SIMHASH_MAX_DISTANCE", "3"))
+
+_TOKEN_RE = re.compile(r"\w+")
+SHINGLE_SIZE = 3
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word 3-gram shingles."""
+    words = _TOKEN_RE.findall(text.lower())
+    shingles = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))]
+    weights = [0] * 64
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def drop_near_duplicates(hits: Sequence, max_distance: int = SIMHASH_MAX_DISTANCE) -> List:
+    """
+    Drop hits whose text is a near-copy of a closer hit.
+
+    Catches overlapping chunk windows and re-ingested copies of a document,
+    whose text differs only by a few words. Hits must be ordered closest
+    first and have a `.text`.
+    """
+    kept, fingerprints = [], []
+    for hit in hits:
+        fingerprint = simhash(hit.text)
+        if any(hamming(fingerprint, other) <= max_distance for other in fingerprints):
+            continue
+        kept.append(hit)
+        fingerprints.append(fingerprint)
+    return kept
+
+
+def mmr_select(query_vectors: Sequence[Sequence[float]], hits: Sequence, limit: int,
+               lambda_mult: float = MMR_LAMBDA, duplicate_similarity: float = NEAR_DUPLICATE_SIMILARITY) -> List:
+    """
+    Maximal marginal relevance over the hits' stored embeddings.
+
+    Greedily picks the hit maximizing
+    lambda * sim(query, hit) - (1 - lambda) * max sim(hit, picked),
+    skipping hits nearly identical to one already picked. With several
+    query vectors (a query and its rewrites) a hit's relevance is its
+    similarity to the closest of them. Hits without an `.embedding` are
+    returned unchanged (up to `limit`).
+    """
+    if not hits or any(getattr(hit, "embedding", None) is None for hit in hits):
+        return list(hits[:limit])
+    matrix = np.asarray([hit.embedding for hit in hits], dtype=np.float32)
+    relevance = (matrix @ np.asarray(query_vectors, dtype=np.float32).T).max(axis=1)
+    pairwise = matrix @ matrix.T
+
+    selected: List[int] = []
+    remaining = list(range(len(hits)))
+    redundancy = np.full(len(hits), -1.0, dtype=np.float32)
+    while remaining and len(selected) < limit:
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * np.maximum(redundancy[remaining], 0)
+        best = remaining.pop(int(np.argmax(scores)))
+        if redundancy[best] >= duplicate_similarity:
+            continue
+        selected.append(best)
+        redundancy = np.maximum(redundancy, pairwise[best])
+    return [hits[i] for i in selected]
+
+
+def diversify(query_vectors: Optional[Sequence[Sequence[float]]], hits: Sequence, limit: int) -> List:
+    """
+    Near-duplicate filtering then MMR, so the cross-encoder only scores distinct passages.
+
+    With RETRIEVAL_DIVERSITY off, the closest `limit` hits are kept, so the
+    reranker gets the same number of candidates either way.
+
+    Args:
+        query_vectors: Embeddings of the query and its rewrites
+        hits: Candidates, closest first
+        limit: Maximum candidates to keep
+    """
+    if not RETRIEVAL_DIVERSITY:
+        return list(hits[:limit])
+    distinct = drop_near_duplicates(hits)
+    if not query_vectors:
+        return distinct[:limit]
+    return mmr_select(query_vectors, distinct, limit)
+
+
+def fetch_size(k: int) -> int:
+    """Candidates to search per query variant when `k` per variant go on to reranking."""
+    return k * MMR_FETCH_FACTOR if RETRIEVAL_DIVERSITY else k
@@ -0,0 +1,121 @@
+import os
+import json
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+from .sources import FILTER_COLUMNS, SourceStore
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+# "pre": filters become a where-clause of the vector search; "post": the
+# search over-fetches unfiltered and non-matching hits are dropped after it
+RETRIEVAL_FILTER_MODE = os.getenv("RETRIEVAL_FILTER_MODE", "pre").lower()
+# Hits fetched per requested result when filtering after the search
+FILTER_OVERFETCH = int(os.getenv("FILTER_OVERFETCH", "4"))
+# Largest source id list pushed into a where-clause; broader filters are applied after the search
+FILTER_MAX_SOURCE_IDS = int(os.getenv("FILTER_MAX_SOURCE_IDS", "2000"))
+
+FILTER_KEYS = FILTER_COLUMNS + ("source_prefix", "page_min", "page_max")
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Validate a retrieval filter and bring it to canonical form (None if empty).
+
+    Source-level keys (source, source_tag, file_type, ingest_batch) take a
+    value or a list of values, any of which may match; source_prefix
+    matches source paths; page_min/page_max bound the chunk's page number.
+
+    Raises:
+        ValueError: on unknown keys or invalid values
+    """
+    if not filters:
+        return None
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown filter keys: {', '.join(sorted(unknown))}")
+    normalized: Dict[str, Any] = {}
+    for key in FILTER_COLUMNS:
+        value = filters.get(key)
+        if value is None:
+            continue
+        values = [value] if isinstance(value, str) else list(value)
+        if not values or not all(isinstance(v, str) and v for v in values):
+            raise ValueError(f"Filter {key} needs one or more non-empty strings")
+        if key == "file_type":
+            values = [v.lower().lstrip(".") for v in values]
+        normalized[key] = sorted(set(values))
+    if filters.get("source_prefix"):
+        normalized["source_prefix"] = str(filters["source_prefix"])
+    for key in ("page_min", "page_max"):
+        if filters.get(key) is not None:
+            if isinstance(filters[key], bool) or not isinstance(filters[key], int) or filters[key] < 1:
+                raise ValueError(f"Filter {key} must be a positive integer")
+            normalized[key] = filters[key]
+    if normalized.get("page_min", 1) > normalized.get("page_max", normalized.get("page_min", 1)):
+        raise ValueError("page_min is greater than page_max")
+    return normalized or None
+
+
+def filter_key(filters: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Stable string form of a normalized filter (for cache keys)."""
+    return json.dumps(filters, sort_keys=True) if filters else None
+
+
+class SearchFilter:
+    """
+    A retrieval filter resolved against one collection.
+
+    Source-level conditions are resolved to source ids through the indexed
+    sources table, so the vector search only needs a where-clause on the
+    chunks' source_id and page fields. `where` is what can be pushed into
+    the search; `matches` checks a hit against the whole filter (chunks
+    still carrying legacy full metadata have no source_id and only match
+    page-only filters).
+    """
+
+    def __init__(self, source_ids: Optional[Set[str]], page_min: Optional[int], page_max: Optional[int]):
+        self.source_ids = source_ids
+        self.page_min = page_min
+        self.page_max = page_max
+        # Too many ids for a where-clause: sources are checked after the search
+        self.residual = source_ids is not None and len(source_ids) > FILTER_MAX_SOURCE_IDS
+
+    @property
+    def empty(self) -> bool:
+        """True when no source matches, so no search is needed."""
+        return self.source_ids is not None and not self.source_ids
+
+    @property
+    def where(self) -> Optional[Dict[str, Any]]:
+        conditions: List[Dict[str, Any]] = []
+        if self.source_ids is not None and not self.residual:
+            conditions.append({"source_id": {"$in": sorted(self.source_ids)}})
+        if self.page_min is not None:
+            conditions.append({"page": {"$gte": self.page_min}})
+        if self.page_max is not None:
+            conditions.append({"page": {"$lte": self.page_max}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    def matches(self, metadata: Dict[str, Any]) -> bool:
+        if self.source_ids is not None and metadata.get("source_id") not in self.source_ids:
+            return False
+        page = metadata.get("page")
+        if self.page_min is not None and (page is None or page < self.page_min):
+            return False
+        if self.page_max is not None and (page is None or page > self.page_max):
+            return False
+        return True
+
+
+def compile_filters(filters: Optional[Dict[str, Any]], store: SourceStore, collection: str) -> Optional[SearchFilter]:
+    """Resolve a normalized filter against a collection's sources (None without a filter)."""
+    if not filters:
+        return None
+    source_ids = None
+    if any(key in filters for key in FILTER_COLUMNS + ("source_prefix",)):
+        source_ids = set(store.match(collection, filters, filters.get("source_prefix")))
+    return SearchFilter(source_ids, filters.get("page_min"), filters.get("page_max"))
@@ -0,0 +1,373 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+# Hedging: fire the alternate provider once the primary runs past
+# HEDGE_MULTIPLIER x its recent p95 latency (clamped to the bounds below)
+HEDGE_MULTIPLIER = float(os.getenv("HEDGE_MULTIPLIER", "1.0"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "1.5"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "10"))
+# Delay used until a provider has enough samples for a meaningful p95
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "4"))
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", "200"))
+LATENCY_MIN_SAMPLES = 20
+
+# Circuit breaker: open after N consecutive failures, probe again after a cooldown
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# Per-provider in-flight caps, e.g. "openai:32,ollama:2" (unlisted = unlimited)
+PROVIDER_MAX_IN_FLIGHT = os.getenv("PROVIDER_MAX_IN_FLIGHT", "openai:32,ollama:4")
+
+# Ollama: how long a model stays loaded after a request ("30m", "-1" = never
+# unload), whether to load it at startup, and the context window bounds
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "true").lower() == "true"
+OLLAMA_NUM_CTX_MIN = int(os.getenv("OLLAMA_NUM_CTX_MIN", "2048"))
+OLLAMA_NUM_CTX_MAX = int(os.getenv("OLLAMA_NUM_CTX_MAX", "8192"))
+OLLAMA_NUM_CTX_STEP = 512
+# Ollama reports load_duration on every call; longer than this means the model was (re)loaded
+OLLAMA_RELOAD_THRESHOLD_MS = 100
+
+ProviderCall = Callable[[str, float, int], Awaitable[Any]]
+
+
+class Completion(NamedTuple):
+    """Generated text and the provider's token usage (prompt/completion/cached tokens)."""
+    text: str
+    usage: Dict[str, Any]
+
+
+def parse_provider_limits(spec: str) -> Dict[str, int]:
+    """Parse "provider:limit,..." into a dict."""
+    limits = {}
+    for pair in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, limit = pair.partition(":")
+        if limit.strip().isdigit():
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed → open after BREAKER_FAILURE_THRESHOLD failures in a row;
+    open → half-open after BREAKER_RESET_SECONDS, letting one probe call
+    through; the probe's outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Whether a call may be sent to the provider now."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"Circuit opened after {self.consecutive_failures} consecutive failures")
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """Forget an in-flight probe that was cancelled before it finished."""
+        self.probe_in_flight = False
+
+
+class ProviderStats:
+    """Rolling latency window and outcome counters for one provider."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.latencies: deque = deque(maxlen=window)
+        self.successes = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.failovers = 0
+        self.saturated = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record_usage(self, usage: Dict[str, Any]) -> None:
+        self.prompt_tokens += usage.get("prompt_tokens") or 0
+        self.cached_tokens += usage.get("cached_tokens") or 0
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.50), self.percentile(0.95)
+        return {
+            "samples": len(self.latencies),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "successes": self.successes,
+            "failures": self.failures,
+            "cancelled": self.cancelled,
+            "hedges_fired": self.hedges_fired,
+            "hedges_won": self.hedges_won,
+            "failovers": self.failovers,
+            "saturated": self.saturated,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_token_ratio": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else None,
+        }
+
+
+class GenerationRouter:
+    """
+    Route generation calls across LLM providers with hedging and failover.
+
+    The primary provider gets every request first. If it hasn't answered
+    by its hedge deadline (recent p95 latency x HEDGE_MULTIPLIER), the same
+    prompt is sent to the fallback provider and whichever answers first
+    wins; the other call is cancelled. A provider that fails outright is
+    failed over immediately, and one whose circuit is open or whose
+    in-flight cap is reached is skipped.
+    """
+
+    def __init__(self, providers: Dict[str, ProviderCall], primary: str, fallback: Optional[str] = None,
+                 max_in_flight: Optional[Dict[str, int]] = None):
+        if primary not in providers:
+            raise ValueError(f"Unknown model provider: {primary}")
+        if fallback and fallback not in providers:
+            raise ValueError(f"Unknown fallback provider: {fallback}")
+        self.providers = providers
+        self.order = [primary] + ([fallback] if fallback and fallback != primary else [])
+        self.stats = {name: ProviderStats() for name in self.order}
+        self.breakers = {name: CircuitBreaker() for name in self.order}
+        self.max_in_flight = max_in_flight if max_in_flight is not None else parse_provider_limits(PROVIDER_MAX_IN_FLIGHT)
+        self.in_flight = {name: 0 for name in self.order}
+
+    def hedge_delay(self, provider: str) -> float:
+        """Seconds to wait on a provider before hedging to the next one."""
+        stats = self.stats[provider]
+        if len(stats.latencies) < LATENCY_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        p95 = stats.percentile(0.95)
+        return min(max(p95 * HEDGE_MULTIPLIER, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+    async def _call(self, provider: str, prompt: str, temperature: float, max_tokens: int) -> Any:
+        """Call one provider, recording latency and outcome."""
+        stats, breaker = self.stats[provider], self.breakers[provider]
+        started = time.perf_counter()
+        try:
+            result = await self.providers[provider](prompt, temperature, max_tokens)
+        except asyncio.CancelledError:
+            stats.cancelled += 1
+            breaker.release()
+            raise
+        except Exception:
+            stats.failures += 1
+            breaker.record_failure()
+            raise
+        finally:
+            self.in_flight[provider] -= 1
+        stats.latencies.append(time.perf_counter() - started)
+        stats.successes += 1
+        if isinstance(result, Completion):
+            stats.record_usage(result.usage)
+        breaker.record_success()
+        return result
+
+    async def generate(self, prompt: str, temperature: float = 0.2, max_tokens: int = 140) -> Tuple[Any, str]:
+        """
+        Generate a completion.
+
+        Returns:
+            Tuple of (provider result, provider name)
+
+        Raises:
+            HTTPException: 503 if every provider's circuit is open, otherwise
+                the last provider error
+        """
+        tasks: Dict[asyncio.Task, str] = {}
+        remaining: List[str] = list(self.order)
+        saturated: List[str] = []
+
+        def launch_next() -> Optional[str]:
+            """Start the next provider that has capacity and a closed circuit."""
+            while remaining:
+                name = remaining.pop(0)
+                limit = self.max_in_flight.get(name)
+                if limit is not None and self.in_flight[name] >= limit:
+                    self.stats[name].saturated += 1
+                    saturated.append(name)
+                    continue
+                if self.breakers[name].allow():
+                    self.in_flight[name] += 1
+                    task = asyncio.create_task(self._call(name, prompt, temperature, max_tokens))
+                    tasks[task] = name
+                    return name
+            return None
+
+        first = launch_next()
+        if first is None:
+            if saturated:
+                raise HTTPException(status_code=503, detail="Model providers at capacity",
+                                    headers={"Retry-After": "2"})
+            raise HTTPException(status_code=503, detail="All model providers are unavailable",
+                                headers={"Retry-After": str(int(BREAKER_RESET_SECONDS))})
+
+        last_error: Optional[BaseException] = None
+        hedged = False
+        try:
+            while tasks:
+                # Hedge only while the first call is the only one running
+                timeout = self.hedge_delay(first) if remaining and len(tasks) == 1 else None
+                done, _ = await asyncio.wait(set(tasks), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    hedge = launch_next()
+                    if hedge is not None:
+                        hedged = True
+                        self.stats[first].hedges_fired += 1
+                        logger.info(f"Hedging generation to {hedge} after {timeout:.2f}s on {first}")
+                    continue
+
+                for task in done:
+                    name = tasks.pop(task)
+                    if task.exception() is None:
+                        if name != first and hedged:
+                            self.stats[name].hedges_won += 1
+                        return task.result(), name
+                    last_error = task.exception()
+                    logger.warning(f"Generation via {name} failed: {last_error}")
+
+                # A call failed: fail over right away if nothing else is running
+                if not tasks and launch_next() is not None:
+                    self.stats[first].failovers += 1
+
+            raise last_error if last_error else HTTPException(status_code=503, detail="Generation failed")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Per-provider latency, hedging and breaker state."""
+        return {
+            "order": self.order,
+            "providers": {
+                name: {
+                    **self.stats[name].snapshot(),
+                    "hedge_delay_s": round(self.hedge_delay(name), 3),
+                    "in_flight": self.in_flight[name],
+                    "max_in_flight": self.max_in_flight.get(name),
+                    "circuit": self.breakers[name].state,
+                }
+                for name in self.order
+            },
+        }
+
+
+class OllamaModel:
+    """
+    Keeps an Ollama model loaded, with a context window sized to the prompts.
+
+    Every request passes keep_alive, and preload() loads the model (and
+    evaluates the static prompt prefix) at startup, so the first chat
+    after a deploy or an idle spell doesn't pay for loading it. Ollama
+    reloads the model whenever num_ctx changes, so the window only grows:
+    it starts at OLLAMA_NUM_CTX_MIN and steps up when a prompt plus its
+    answer budget would not fit, up to OLLAMA_NUM_CTX_MAX.
+    """
+
+    def __init__(self, base_url: str, model: str, keep_alive: str = OLLAMA_KEEP_ALIVE,
+                 min_ctx: int = OLLAMA_NUM_CTX_MIN, max_ctx: int = OLLAMA_NUM_CTX_MAX):
+        self.base_url = base_url
+        self.model = model
+        self.keep_alive = keep_alive
+        self.num_ctx = min_ctx
+        self.max_ctx = max_ctx
+        self.loads = 0
+        self.last_load_ms: Optional[float] = None
+        self.truncated = 0
+
+    def num_ctx_for(self, prompt_tokens: int, max_tokens: int) -> int:
+        """Context window for a request, growing the current one if it would not fit."""
+        needed = prompt_tokens + max_tokens + 64
+        if needed > self.num_ctx:
+            if self.num_ctx >= self.max_ctx:
+                self.truncated += 1
+            else:
+                grown = min(math.ceil(needed / OLLAMA_NUM_CTX_STEP) * OLLAMA_NUM_CTX_STEP, self.max_ctx)
+                logger.info(f"Growing Ollama num_ctx {self.num_ctx} -> {grown} (prompt ~{prompt_tokens} tokens)")
+                self.num_ctx = grown
+        return self.num_ctx
+
+    def record(self, data: Dict[str, Any]) -> None:
+        """Note a model load from a response's load_duration (nanoseconds)."""
+        load_ms = (data.get("load_duration") or 0) / 1e6
+        if load_ms > OLLAMA_RELOAD_THRESHOLD_MS:
+            self.loads += 1
+            self.last_load_ms = round(load_ms, 1)
+            logger.info(f"Ollama loaded {self.model} in {load_ms:.0f} ms")
+
+    async def preload(self, prefix_messages: List[Dict[str, str]]) -> None:
+        """Load the model with the current num_ctx and evaluate the prompt prefix."""
+        payload = {
+            "model": self.model,
+            "messages": prefix_messages,
+            "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": {"num_ctx": self.num_ctx, "num_predict": 1},
+        }
+        try:
+            async with httpx.AsyncClient(timeout=300) as client:
+                response = await client.post(f"{self.base_url}/api/chat", json=payload)
+                response.raise_for_status()
+                self.record(response.json())
+        except Exception as e:
+            logger.warning(f"Could not preload Ollama model {self.model}: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "keep_alive": self.keep_alive,
+            "num_ctx": self.num_ctx,
+            "num_ctx_max": self.max_ctx,
+            "loads": self.loads,
+            "last_load_ms": self.last_load_ms,
+            "over_max_ctx": self.truncated,
+        }
@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+# Cache-Control for content-addressed (versioned) URLs
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def content_hash(data: bytes, length: int = 16) -> str:
+    """Short, stable content hash used for versions and ETags."""
+    return hashlib.sha256(data).hexdigest()[:length]
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+def cached_response(request: Request, body: bytes, media_type: str, etag: str, cache_control: str,
+                    vary: Optional[str] = None) -> Response:
+    """
+    Build a response with validators, answering 304 on a matching If-None-Match.
+
+    Args:
+        request: Incoming request (for conditional headers)
+        body: Response body
+        media_type: Content type
+        etag: Quoted entity tag for the body
+        cache_control: Cache-Control header value
+        vary: Optional Vary header value
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if vary:
+        headers["Vary"] = vary
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+def file_response(request: Request, path: Path, media_type: str, cache_control: str,
+                  etag: Optional[str] = None) -> Response:
+    """
+    Serve a file from disk with validators, answering 304 on a matching If-None-Match.
+
+    Without an ETag, one is derived from the file's size and mtime.
+    """
+    if etag is None:
+        stat = path.stat()
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+class StaticAsset:
+    """
+    A widget file served from memory with a content-hash version.
+
+    The file is re-read only when its mtime changes, so edits show up
+    without a restart while normal requests never touch the disk.
+    """
+
+    def __init__(self, path: Path, media_type: str, substitutions: Optional[Dict[str, "StaticAsset"]] = None):
+        self.path = path
+        self.media_type = media_type
+        # placeholder -> asset whose version replaces it in this file's body
+        self.substitutions = substitutions or {}
+        self._lock = threading.Lock()
+        self._loaded: Optional[Tuple[tuple, bytes, str]] = None
+
+    def _stamp(self) -> tuple:
+        stamp = [self.path.stat().st_mtime_ns]
+        for asset in self.substitutions.values():
+            stamp.extend(asset._stamp())
+        return tuple(stamp)
+
+    def load(self) -> Tuple[bytes, str]:
+        """Return (body, version), reloading if the file (or a dependency) changed."""
+        stamp = self._stamp()
+        loaded = self._loaded
+        if loaded is not None and loaded[0] == stamp:
+            return loaded[1], loaded[2]
+        with self._lock:
+            body = self.path.read_bytes()
+            for placeholder, asset in self.substitutions.items():
+                body = body.replace(placeholder.encode(), asset.version.encode())
+            version = content_hash(body, 12)
+            self._loaded = (stamp, body, version)
+            logger.info(f"Loaded widget asset {self.path.name} (version {version})")
+            return body, version
+
+    @property
+    def version(self) -> str:
+        return self.load()[1]
@@ -0,0 +1,192 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Set
+
+from langchain_core.embeddings import Embeddings
+
+from .profiling import inference_stats
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+
+def parse_cpuset(spec: str) -> Set[int]:
+    """Parse a CPU list like "0-7,12,14-15" (the taskset/cgroup syntax)."""
+    cpus: Set[int] = set()
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def available_cpus() -> Set[int]:
+    """CPUs this process may run on (its affinity mask, or all CPUs)."""
+    if hasattr(os, "sched_getaffinity"):
+        return set(os.sched_getaffinity(0))
+    return set(range(os.cpu_count() or 1))
+
+
+# Concurrent forward passes per model; each pass gets TORCH_NUM_THREADS cores
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "2"))
+# Optional CPU sets the embedder/reranker workers are pinned to (e.g. "0-7")
+EMBED_CPUSET = os.getenv("EMBED_CPUSET", "")
+RERANK_CPUSET = os.getenv("RERANK_CPUSET", "")
+# Server processes sharing this machine (uvicorn/gunicorn --workers)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Torch intra-op threads per forward pass. Default: the cores left for each
+# concurrent pass, so workers x processes x threads never exceeds the CPUs
+TORCH_NUM_THREADS = int(
+    os.getenv("TORCH_NUM_THREADS")
+    or max(1, len(available_cpus()) // max(1, (EMBED_WORKERS + RERANK_WORKERS) * WEB_CONCURRENCY))
+)
+TORCH_INTEROP_THREADS = int(os.getenv("TORCH_INTEROP_THREADS", "1"))
+
+# Batch sizes and max sequence lengths (tokens) of the two models
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_MAX_LENGTH = int(os.getenv("EMBED_MAX_LENGTH", "512"))
+# Query/passage pairs scored per cross-encoder forward pass
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "128"))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+
+
+def configure_torch(num_threads: int = TORCH_NUM_THREADS, interop_threads: int = TORCH_INTEROP_THREADS) -> None:
+    """
+    Cap torch's thread pools before the models run.
+
+    By default torch sizes its intra-op pool to every core, in every process
+    and for every concurrent call, so parallel requests oversubscribe the
+    CPU. The inter-op pool can only be sized before its first use.
+    """
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        # Already used (e.g. configured twice): keep the current size
+        pass
+    logger.info(f"Torch threads: intra-op {torch.get_num_threads()}, inter-op {torch.get_num_interop_threads()}")
+
+
+class InferencePool:
+    """
+    A small, optionally CPU-pinned thread pool that runs one model's forward passes.
+
+    Bounding concurrent passes (instead of letting every request thread call
+    the model) is what keeps workers x torch threads within the core budget;
+    excess calls queue here, and the queue wait is reported separately from
+    compute time.
+    """
+
+    def __init__(self, name: str, workers: int, cpuset: str = ""):
+        self.name = name
+        self.workers = max(1, workers)
+        self.cpus = parse_cpuset(cpuset) if cpuset else None
+        if self.cpus is not None:
+            unknown = self.cpus - available_cpus()
+            if unknown:
+                logger.warning(f"{name} cpuset includes unavailable CPUs {sorted(unknown)}; ignoring them")
+                self.cpus -= unknown
+            if not self.cpus or not hasattr(os, "sched_setaffinity"):
+                logger.warning(f"CPU pinning unavailable for {name}; running unpinned")
+                self.cpus = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix=f"infer-{name}", initializer=self._init_worker
+        )
+        self._lock = threading.Lock()
+        self._waits: List[float] = []
+        self.queued = 0
+
+    def _init_worker(self) -> None:
+        # Threads torch starts from this one inherit its affinity
+        if self.cpus is not None:
+            os.sched_setaffinity(0, self.cpus)
+
+    def run(self, fn: Callable[..., Any], *args: Any, items: int = 1, **kwargs: Any) -> Any:
+        """Run fn(*args, **kwargs) on the pool and wait for its result (in the caller's context)."""
+        submitted = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+
+        def task():
+            waited = time.perf_counter() - submitted
+            with self._lock:
+                self.queued -= 1
+                self._waits.append(waited)
+                del self._waits[:-500]
+            with inference_stats.timed(self.name, items):
+                return fn(*args, **kwargs)
+
+        return self._executor.submit(contextvars.copy_context().run, task).result()
+
+    def resize(self, workers: int) -> None:
+        """Replace the executor (for benchmarks; in-flight calls finish on the old one)."""
+        old = self._executor
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix=f"infer-{self.name}", initializer=self._init_worker
+        )
+        old.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._waits)
+            queued = self.queued
+        pick = lambda q: round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 1) if waits else None
+        return {
+            "workers": self.workers,
+            "cpus": sorted(self.cpus) if self.cpus is not None else None,
+            "queued": queued,
+            "wait_p50_ms": pick(0.50),
+            "wait_p95_ms": pick(0.95),
+        }
+
+
+class PooledEmbeddings(Embeddings):
+    """Embeddings wrapper that runs every call on an InferencePool."""
+
+    def __init__(self, inner: Embeddings, pool: InferencePool):
+        self.inner = inner
+        self.pool = pool
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.pool.run(self.inner.embed_documents, texts, items=len(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.pool.run(self.inner.embed_query, text)
+
+
+def set_embed_max_length(model: Any, max_length: int) -> None:
+    """Set the sentence-transformers max_seq_length behind a HuggingFaceEmbeddings."""
+    client = getattr(model, "_client", None) or getattr(model, "client", None)
+    if client is not None and hasattr(client, "max_seq_length"):
+        client.max_seq_length = max_length
+
+
+embed_pool = InferencePool("embedder", EMBED_WORKERS, EMBED_CPUSET)
+rerank_pool = InferencePool("reranker", RERANK_WORKERS, RERANK_CPUSET)
+
+
+def inference_info() -> Dict[str, Any]:
+    """Thread, pool and model-length settings, for /admin/profile/runtime."""
+    return {
+        "available_cpus": len(available_cpus()),
+        "torch_num_threads": TORCH_NUM_THREADS,
+        "torch_interop_threads": TORCH_INTEROP_THREADS,
+        "web_concurrency": WEB_CONCURRENCY,
+        "embedder": {**embed_pool.stats(), "batch_size": EMBED_BATCH_SIZE, "max_length": EMBED_MAX_LENGTH},
+        "reranker": {**rerank_pool.stats(), "batch_size": RERANK_BATCH_SIZE, "max_length": RERANK_MAX_LENGTH},
+    }
@@ -1,13 +1,25 @@
+import io
 import os
+import re
+import uuid
 import logging
+import contextvars
 from pathlib import Path
-from typing import Iterable, List
+from typing import Iterable, List, Dict, Any, Optional, BinaryIO
 from datetime import datetime
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredMarkdownLoader
+from pypdf import PdfReader
 from docx import Document as DocxDocument
+from docx.table import Table as DocxTable
+from docx.text.paragraph import Paragraph as DocxParagraph
 from langchain.docstore.document import Document
-from .rag import vectorstore
+from .rag import get_vectorstore, maintenance_lock, notify_collection_changed, source_store, collection_name_for
+from .sources import SourceRegistry
+from .logging_setup import stage
 
 # Get logger from package
 logger = logging.getLogger(__name__)
@@ -16,6 +28,169 @@ logger = logging.getLogger(__name__)
 DEFAULT_CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "600"))
 DEFAULT_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "80"))
 
+# Structure-aware chunking (token budgets; bge-small truncates at 512 tokens)
+DEFAULT_CHUNKER = os.getenv("CHUNKER", "structured")  # "structured" or "character"
+DEFAULT_CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "180"))
+DEFAULT_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "24"))
+
+# Rough token estimate: words and standalone punctuation marks
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# Blocks (paragraphs, headings) are separated by one or more blank lines
+_BLOCK_RE = re.compile(r"\S.*?(?=\n[ \t]*\n|\Z)", re.DOTALL)
+# A sentence ends at terminal punctuation followed by whitespace (so "3.5" and
+# hard-wrapped PDF lines stay intact) or at the end of its block
+_SENTENCE_RE = re.compile(r".*?(?:[.!?]+[\"')\]]*(?=\s)|$)", re.DOTALL)
+_ATX_HEADING_RE = re.compile(r"^#{1,6}[ \t]+(.+?)[ \t#]*$")
+_NUMBERED_HEADING_RE = re.compile(r"^(?:\d+(?:\.\d+)*\.?|[IVX]+\.)[ \t]+\S")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the model token count of text without loading a tokenizer."""
+    return sum(1 for _ in _TOKEN_RE.finditer(text))
+
+
+def _heading_title(line: str) -> Optional[str]:
+    """
+    Return the heading text if a line looks like a section heading.
+    
+    Recognizes markdown ATX headings ("## Pricing") and short lines without
+    terminal punctuation (numbered, ALL CAPS or Title Case), which is how
+    PDF and DOCX headings usually come through.
+    """
+    line = line.strip()
+    match = _ATX_HEADING_RE.match(line)
+    if match:
+        return match.group(1).strip()
+    if len(line) > 80 or line[-1] in ".!?,;:" or len(line.split()) > 12:
+        return None
+    if _NUMBERED_HEADING_RE.match(line) or (line.isupper() and len(line) > 3):
+        return line
+    words = [w for w in line.split() if w[0].isalpha()]
+    if words and len(words) <= 8 and all(w[0].isupper() for w in words):
+        return line
+    return None
+
+
+def _sentence_spans(text: str, start: int, end: int, max_tokens: int) -> Iterable[tuple]:
+    """
+    Yield (start, end, tokens) spans for the sentences of text[start:end].
+    
+    Sentences longer than max_tokens (tables, run-on lists) are hard-split
+    on word boundaries so no single unit exceeds the chunk budget.
+    """
+    for match in _SENTENCE_RE.finditer(text, start, end):
+        s, e = match.span()
+        # Trim surrounding whitespace without copying the sentence
+        while s < e and text[s].isspace():
+            s += 1
+        while e > s and text[e - 1].isspace():
+            e -= 1
+        if s == e:
+            continue
+        tokens = list(_TOKEN_RE.finditer(text, s, e))
+        if not tokens:
+            continue
+        if len(tokens) <= max_tokens:
+            yield s, e, len(tokens)
+            continue
+        for i in range(0, len(tokens), max_tokens):
+            window = tokens[i:i + max_tokens]
+            yield window[0].start(), window[-1].end(), len(window)
+
+
+def structured_chunks(text: str, max_tokens: int = DEFAULT_CHUNK_TOKENS,
+                      overlap_tokens: int = DEFAULT_OVERLAP_TOKENS) -> Iterable[Dict[str, Any]]:
+    """
+    Split text on headings, paragraphs and sentences, packed to a token budget.
+    
+    Single pass over the text: blocks and sentences are located with regex
+    scans and every chunk is one slice of the original string, so the cost
+    is linear in the document size. Chunks never cross a heading, and a
+    trailing fragment under a quarter of the budget is folded into the
+    previous chunk of its section instead of becoming its own vector.
+    
+    Args:
+        text: Input text to chunk
+        max_tokens: Target (maximum) estimated tokens per chunk
+        overlap_tokens: Tokens of trailing sentences repeated in the next chunk
+        
+    Yields:
+        Dicts with: {text, section_title, start, end, tokens}
+    """
+    max_tokens = max(max_tokens, 16)
+    overlap_tokens = min(max(overlap_tokens, 0), max_tokens // 2)
+    min_tokens = max_tokens // 4
+
+    section_title = ""
+    units: List[tuple] = []  # (start, end, tokens) sentences of the open chunk
+    unit_tokens = 0
+    pending: Optional[Dict[str, Any]] = None  # held back so a tiny tail can merge
+
+    def make_chunk() -> Dict[str, Any]:
+        start, end = units[0][0], units[-1][1]
+        return {
+            "text": text[start:end],
+            "section_title": section_title,
+            "start": start,
+            "end": end,
+            "tokens": unit_tokens,
+        }
+
+    def flush_section() -> List[Dict[str, Any]]:
+        """Close the current section, returning the chunks left to emit."""
+        nonlocal pending, units, unit_tokens
+        out = []
+        new_units = [u for u in units if pending is None or u[0] >= pending["end"]]
+        if pending is not None and new_units and sum(u[2] for u in new_units) < min_tokens:
+            pending["end"] = new_units[-1][1]
+            pending["text"] = text[pending["start"]:pending["end"]]
+            pending["tokens"] += sum(u[2] for u in new_units)
+            out.append(pending)
+        else:
+            if pending is not None:
+                out.append(pending)
+            if new_units:
+                out.append(make_chunk())
+        pending, units, unit_tokens = None, [], 0
+        return out
+
+    for block in _BLOCK_RE.finditer(text):
+        start, end = block.span()
+        line_end = text.find("\n", start, end)
+        if line_end == -1:
+            title = _heading_title(block.group())
+            if title is not None:
+                yield from flush_section()
+                section_title = title
+                continue
+        else:
+            # Only a markdown heading directly followed by its text ("## FAQ\nDo you...")
+            # opens a section mid-block; list items and table rows would match the looser
+            # rules. The heading line stays in the chunk text.
+            match = _ATX_HEADING_RE.match(text[start:line_end].strip())
+            if match:
+                yield from flush_section()
+                section_title = match.group(1).strip()
+
+        for span in _sentence_spans(text, start, end, max_tokens):
+            if units and unit_tokens + span[2] > max_tokens:
+                if pending is not None:
+                    yield pending
+                pending = make_chunk()
+                # Carry trailing sentences forward as overlap, as long as the
+                # overlap plus the next sentence still fits the budget
+                kept, kept_tokens = [], 0
+                for unit in reversed(units):
+                    if kept_tokens + unit[2] > overlap_tokens or kept_tokens + unit[2] + span[2] > max_tokens:
+                        break
+                    kept.append(unit)
+                    kept_tokens += unit[2]
+                units, unit_tokens = kept[::-1], kept_tokens
+            units.append(span)
+            unit_tokens += span[2]
+
+    yield from flush_section()
+
 
 def character_chunks(text: str, max_chars: int = DEFAULT_CHUNK_SIZE, overlap: int = DEFAULT_OVERLAP) -> Iterable[str]:
     """
@@ -50,10 +225,129 @@ def character_chunks(text: str, max_chars: int = DEFAULT_CHUNK_SIZE, overlap: in
             yield text[i:i + max_chars]
 
 
+def _load_pdf(file_path: Path) -> List[Document]:
+    """Load a PDF page by page."""
+    pages = PyPDFLoader(str(file_path)).load()
+    for i, page in enumerate(pages):
+        # Add page number to metadata
+        page.metadata["page_number"] = i + 1
+        page.metadata["total_pages"] = len(pages)
+    return pages
+
+
+def _load_text(file_path: Path) -> List[Document]:
+    """Load a plain text file."""
+    return TextLoader(str(file_path), autodetect_encoding=True).load()
+
+
+def _load_markdown(file_path: Path) -> List[Document]:
+    """Load a markdown file."""
+    return UnstructuredMarkdownLoader(str(file_path)).load()
+
+
+def _docx_blocks(docx) -> Iterable[str]:
+    """
+    Yield the text blocks of a Word document in body order.
+    
+    Paragraphs and tables are interleaved as they appear in the document.
+    Headings are emitted as markdown headings so the structured chunker can
+    pick them up as section titles; table rows become "cell | cell" lines.
+    """
+    body = docx.element.body
+    for child in body.iterchildren():
+        tag = child.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            paragraph = DocxParagraph(child, docx)
+            text = paragraph.text.strip()
+            if not text:
+                continue
+            style = paragraph.style.name if paragraph.style is not None else ""
+            if style == "Title":
+                yield f"# {text}"
+            elif style.startswith("Heading"):
+                level = style.rsplit(" ", 1)[-1]
+                yield f"{'#' * min(int(level), 6) if level.isdigit() else '#'} {text}"
+            else:
+                yield text
+        elif tag == "tbl":
+            rows = []
+            for row in DocxTable(child, docx).rows:
+                cells, seen = [], set()
+                for cell in row.cells:
+                    # Merged cells are repeated by python-docx (same element); keep one copy
+                    if cell._tc in seen:
+                        continue
+                    seen.add(cell._tc)
+                    text = " ".join(cell.text.split())
+                    if text:
+                        cells.append(text)
+                if cells:
+                    rows.append(" | ".join(cells))
+            if rows:
+                yield "\n".join(rows)
+
+
+def _load_docx(file_path: Path) -> List[Document]:
+    """
+    Load a Word (.docx) document, including tables.
+    
+    Blocks are collected in a list and joined once (no quadratic string
+    building). The start offset of every block is kept in the
+    "paragraph_offsets" metadata so chunks can cite the paragraph they
+    start in; ingestion pops it before chunks are stored.
+    """
+    return [_docx_to_document(DocxDocument(str(file_path)), str(file_path))]
+
+
+def _docx_to_document(docx, source: str) -> Document:
+    """Join the blocks of an opened Word document into a single Document."""
+    parts: List[str] = []
+    offsets: List[int] = []
+    position = 0
+    for block in _docx_blocks(docx):
+        offsets.append(position)
+        parts.append(block)
+        position += len(block) + 2  # "\n\n" separator
+    return Document(
+        page_content="\n\n".join(parts),
+        metadata={"source": source, "paragraph_offsets": offsets}
+    )
+
+
+# Loader dispatch by file extension (legacy binary .doc is not readable by python-docx)
+LOADERS = {
+    ".pdf": _load_pdf,
+    ".txt": _load_text,
+    ".md": _load_markdown,
+    ".markdown": _load_markdown,
+    ".docx": _load_docx,
+}
+
+# Files parsed concurrently during ingestion
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Chunks per Chroma add call (Chroma rejects batches above its max batch size)
+ADD_BATCH_SIZE = 1000
+
+
+def _load_file(file_path: Path) -> List[Document]:
+    """Load one file with the loader registered for its extension."""
+    try:
+        logger.info(f"Processing file: {file_path}")
+        suffix = file_path.suffix.lower()
+        with stage(f"load{suffix}"):
+            return LOADERS[suffix](file_path)
+    except Exception as e:
+        logger.error(f"Error processing {file_path}: {str(e)}")
+        return []
+
+
 def load_docs(input_dir: str) -> Iterable[Document]:
     """
     Load documents from various file formats.
     
+    Files are parsed on a thread pool (INGEST_WORKERS) with a bounded number
+    of files in flight, and documents are yielded in directory order.
+    
     Args:
         input_dir: Directory containing documents
         
@@ -66,120 +360,201 @@ def load_docs(input_dir: str) -> Iterable[Document]:
         logger.error(f"Input directory does not exist: {input_dir}")
         return
     
-    # Supported file extensions
-    supported_extensions = {".pdf", ".txt", ".md", ".markdown"}
+    files = (
+        file_path for file_path in sorted(input_path.rglob("*"))
+        if file_path.is_file() and file_path.suffix.lower() in LOADERS
+    )
+    
+    if INGEST_WORKERS <= 1:
+        for file_path in files:
+            yield from _load_file(file_path)
+        return
+    
+    with ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest-load") as executor:
+        in_flight = deque()
+        for file_path in files:
+            # In the caller's context, so loads count towards its stage timings
+            in_flight.append(executor.submit(contextvars.copy_context().run, _load_file, file_path))
+            if len(in_flight) >= INGEST_WORKERS * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def chunk_document(doc: Document, chunker: str = DEFAULT_CHUNKER, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   overlap: int = DEFAULT_OVERLAP, chunk_tokens: int = DEFAULT_CHUNK_TOKENS,
+                   overlap_tokens: int = DEFAULT_OVERLAP_TOKENS) -> Iterable[Dict[str, Any]]:
+    """
+    Chunk a loaded document with the selected chunking engine.
+    
+    Yields:
+        Dicts with at least {text, section_title}
+    """
+    if chunker == "character":
+        for chunk_text in character_chunks(doc.page_content, chunk_size, overlap):
+            yield {"text": chunk_text, "section_title": "", "start": None}
+    else:
+        yield from structured_chunks(doc.page_content, chunk_tokens, overlap_tokens)
+
+
+def new_ingest_batch() -> str:
+    """Generate an id for one ingestion run."""
+    return uuid.uuid4().hex[:12]
+
+
+def chunk_documents(documents: Iterable[Document], source_tag: Optional[str], chunk_size: int, overlap: int,
+                    chunker: str, chunk_tokens: int, overlap_tokens: int, ingest_batch: str, ingested_at: str,
+                    sources: SourceRegistry) -> List[Document]:
+    """
+    Chunk loaded documents into compact-metadata chunk Documents.
+    
+    Document-level fields (source path, source tag, loader metadata,
+    chunker settings, ingest_batch and ingested_at) go to the source rows of
+    `sources`; the chunks keep source_id, page, offset, section and paragraph.
+    """
+    docs = []
+    for doc in documents:
+        # Block offsets are for citation lookup only; Chroma metadata must be scalar
+        paragraph_offsets = doc.metadata.pop("paragraph_offsets", None)
+        with stage("chunk"):
+            # Create chunks from document content
+            for chunk in chunk_document(doc, chunker, chunk_size, overlap, chunk_tokens, overlap_tokens):
+                metadata = {
+                    **(doc.metadata or {}),
+                    "source": doc.metadata.get("source") or source_tag,
+                    "source_tag": source_tag,
+                    "chunker": chunker,
+                    "ingested_at": ingested_at,
+                    "ingest_batch": ingest_batch,
+                }
+                if chunker == "character":
+                    metadata["chunk_size"] = chunk_size
+                    metadata["overlap"] = overlap
+                else:
+                    metadata["offset"] = chunk["start"]
+                if chunk["section_title"]:
+                    metadata["section_title"] = chunk["section_title"]
+                if paragraph_offsets and chunk["start"] is not None:
+                    metadata["paragraph_number"] = bisect_right(paragraph_offsets, chunk["start"])
+                docs.append(Document(page_content=chunk["text"], metadata=sources.compact(metadata)))
+    return docs
+
+
+def _index_documents(documents: Iterable[Document], source_tag: str, chunk_size: int, overlap: int,
+                     chunker: str, chunk_tokens: int, overlap_tokens: int, label: str,
+                     ingest_batch: Optional[str] = None) -> int:
+    """
+    Chunk loaded documents, embed the chunks and upsert them into Chroma.
+    
+    Shared by folder, single-file and upload ingestion. Chunks carry only
+    compact metadata (source_id, page, offset, section, paragraph); the
+    document-level fields (source path, loader metadata, chunker settings,
+    ingest_batch, so a whole run can be deleted later) are stored once
+    per document in the sources table.
+    
+    Returns:
+        Number of chunks created
+    """
+    if chunker == "character":
+        logger.info(f"Chunker: character, chunk size: {chunk_size}, overlap: {overlap}")
+    else:
+        logger.info(f"Chunker: structured, chunk tokens: {chunk_tokens}, overlap tokens: {overlap_tokens}")
+    
+    ingest_batch = ingest_batch or new_ingest_batch()
+    sources = SourceRegistry()
+    docs = chunk_documents(documents, source_tag, chunk_size, overlap, chunker, chunk_tokens, overlap_tokens,
+                           ingest_batch, datetime.now().isoformat(), sources)
+    total_chunks = len(docs)
     
-    for file_path in input_path.rglob("*"):
-        if file_path.is_file() and file_path.suffix.lower() in supported_extensions:
+    if docs:
+        logger.info(f"Adding {len(docs)} chunks to vector store (batch {ingest_batch})...")
+        texts = [doc.page_content for doc in docs]
+        # Embedded before taking the lock, which then only covers the writes
+        model = get_vectorstore().embeddings
+        with stage("embed"):
+            vectors = model.embed_documents(texts)
+        with maintenance_lock, stage("upsert"):
+            store = get_vectorstore()
+            if store.embeddings is not model:
+                # A version built with another model was swapped in meanwhile
+                vectors = store.embeddings.embed_documents(texts)
+            # Sources first, so no search ever returns a chunk without its source row
+            collection = collection_name_for()
+            source_store.add(collection, sources.rows)
+            added: List[str] = []
             try:
-                logger.info(f"Processing file: {file_path}")
-                
-                if file_path.suffix.lower() == ".pdf":
-                    # Handle PDF files
-                    loader = PyPDFLoader(str(file_path))
-                    pages = loader.load()
-                    for i, page in enumerate(pages):
-                        # Add page number to metadata
-                        page.metadata["page_number"] = i + 1
-                        page.metadata["total_pages"] = len(pages)
-                        yield page
-                        
-                elif file_path.suffix.lower() in [".txt", ".md", ".markdown"]:
-                    # Handle text and markdown files
-                    if file_path.suffix.lower() in [".md", ".markdown"]:
-                        loader = UnstructuredMarkdownLoader(str(file_path))
-                    else:
-                        loader = TextLoader(str(file_path), autodetect_encoding=True)
-                    
-                    docs = loader.load()
-                    for doc in docs:
-                        yield doc
-                        
-                elif file_path.suffix.lower() in [".docx", ".doc"]:
-                    # Handle Word documents
-                    try:
-                        docx = DocxDocument(str(file_path))
-                        text = ""
-                        for paragraph in docx.paragraphs:
-                            if paragraph.text.strip():
-                                text += paragraph.text.strip() + "\n\n"
-                        
-                        # Create a document object
-                        yield Document(
-                            page_content=text,
-                            metadata={"source": str(file_path)}
-                        )
-                    except Exception as e:
-                        logger.error(f"Error processing DOCX file {file_path}: {str(e)}")
-                        continue
-                        
-            except Exception as e:
-                logger.error(f"Error processing {file_path}: {str(e)}")
-                continue
+                for start in range(0, len(docs), ADD_BATCH_SIZE):
+                    batch = slice(start, start + ADD_BATCH_SIZE)
+                    ids = [str(uuid.uuid4()) for _ in docs[batch]]
+                    store._collection.add(
+                        ids=ids, documents=texts[batch],
+                        metadatas=[doc.metadata for doc in docs[batch]], embeddings=vectors[batch]
+                    )
+                    added.extend(ids)
+            except Exception:
+                # Remove the batches already written, then their source rows, so no chunk is orphaned
+                for start in range(0, len(added), ADD_BATCH_SIZE):
+                    store._collection.delete(ids=added[start:start + ADD_BATCH_SIZE])
+                source_store.delete([row["source_id"] for row in sources.rows])
+                raise
+            notify_collection_changed()
+        # Chroma automatically persists, no need to call persist()
+        logger.info(f"Successfully ingested {total_chunks} chunks from {label}")
+    else:
+        logger.warning(f"No documents found in {label}")
+    
+    return total_chunks
 
 
-def ingest_folder(input_dir: str, source_tag: str = "local", chunk_size: int = DEFAULT_CHUNK_SIZE, overlap: int = DEFAULT_OVERLAP) -> int:
+def ingest_folder(input_dir: str, source_tag: str = "local", chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  overlap: int = DEFAULT_OVERLAP, chunker: str = DEFAULT_CHUNKER,
+                  chunk_tokens: int = DEFAULT_CHUNK_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                  ingest_batch: Optional[str] = None) -> int:
     """
     Load documents → chunk → upsert into Chroma.
     
     Args:
         input_dir: Directory containing documents
         source_tag: Source identifier for documents
-        chunk_size: Maximum characters per chunk
-        overlap: Overlapping characters between chunks
+        chunk_size: Maximum characters per chunk (character chunker)
+        overlap: Overlapping characters between chunks (character chunker)
+        chunker: "structured" (headings/paragraphs/sentences) or "character"
+        chunk_tokens: Target tokens per chunk (structured chunker)
+        overlap_tokens: Overlapping tokens between chunks (structured chunker)
+        ingest_batch: Batch id stored on every chunk (generated if omitted)
         
     Returns:
         Number of chunks created
     """
     try:
         logger.info(f"Starting ingestion from: {input_dir}")
-        logger.info(f"Chunk size: {chunk_size}, Overlap: {overlap}")
-        
-        docs = []
-        total_chunks = 0
-        
-        for doc in load_docs(input_dir):
-            # Create chunks from document content
-            for chunk_text in character_chunks(doc.page_content, chunk_size, overlap):
-                # Create new document for each chunk
-                chunk_doc = Document(
-                    page_content=chunk_text,
-                    metadata={
-                        **(doc.metadata or {}),
-                        "source": doc.metadata.get("source", str(doc.metadata.get("source", "")) or source_tag),
-                        "chunk_size": chunk_size,
-                        "overlap": overlap,
-                        "ingested_at": datetime.now().isoformat(),
-                        "original_file": doc.metadata.get("source", "unknown"),
-                    }
-                )
-                docs.append(chunk_doc)
-                total_chunks += 1
-        
-        if docs:
-            logger.info(f"Adding {len(docs)} chunks to vector store...")
-            vectorstore.add_documents(docs)
-            # Chroma automatically persists, no need to call persist()
-            logger.info(f"Successfully ingested {total_chunks} chunks from {input_dir}")
-        else:
-            logger.warning(f"No documents found in {input_dir}")
-            
-        return total_chunks
+        return _index_documents(load_docs(input_dir), source_tag, chunk_size, overlap,
+                                chunker, chunk_tokens, overlap_tokens, input_dir, ingest_batch)
         
     except Exception as e:
         logger.error(f"Error during ingestion: {str(e)}")
         return 0
 
 
-def ingest_single_file(file_path: str, source_tag: str = "local", chunk_size: int = DEFAULT_CHUNK_SIZE, overlap: int = DEFAULT_OVERLAP) -> int:
+def ingest_single_file(file_path: str, source_tag: str = "local", chunk_size: int = DEFAULT_CHUNK_SIZE,
+                       overlap: int = DEFAULT_OVERLAP, chunker: str = DEFAULT_CHUNKER,
+                       chunk_tokens: int = DEFAULT_CHUNK_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                       ingest_batch: Optional[str] = None) -> int:
     """
     Ingest a single file into the vector store.
     
+    The file is parsed in place with the same loader dispatch as load_docs,
+    without copying it anywhere first.
+    
     Args:
         file_path: Path to the file
         source_tag: Source identifier
-        chunk_size: Maximum characters per chunk
-        overlap: Overlapping characters between chunks
+        chunk_size: Maximum characters per chunk (character chunker)
+        overlap: Overlapping characters between chunks (character chunker)
+        chunker: "structured" or "character"
+        chunk_tokens: Target tokens per chunk (structured chunker)
+        overlap_tokens: Overlapping tokens between chunks (structured chunker)
+        ingest_batch: Batch id stored on every chunk (generated if omitted)
         
     Returns:
         Number of chunks created
@@ -189,40 +564,151 @@ def ingest_single_file(file_path: str, source_tag: str = "local", chunk_size: in
         if not file_path.exists():
             logger.error(f"File does not exist: {file_path}")
             return 0
-            
-        # Create temporary directory structure
-        temp_dir = Path("./temp_ingest")
-        temp_dir.mkdir(exist_ok=True)
-        
-        # Copy file to temp directory
-        import shutil
-        temp_file = temp_dir / file_path.name
-        shutil.copy2(file_path, temp_file)
-        
-        # Ingest from temp directory
-        result = ingest_folder(str(temp_dir), source_tag, chunk_size, overlap)
-        
-        # Clean up
-        shutil.rmtree(temp_dir)
+        if file_path.suffix.lower() not in LOADERS:
+            logger.error(f"Unsupported file type: {file_path}")
+            return 0
         
-        return result
+        return _index_documents(_load_file(file_path), source_tag, chunk_size, overlap,
+                                chunker, chunk_tokens, overlap_tokens, str(file_path), ingest_batch)
         
     except Exception as e:
         logger.error(f"Error ingesting single file: {str(e)}")
         return 0
 
 
+# Read size used when consuming upload streams
+UPLOAD_READ_SIZE = 1024 * 1024
+
+
+def _read_pdf_stream(stream: BinaryIO, filename: str) -> List[Document]:
+    """Parse a PDF from a binary stream, page by page."""
+    reader = PdfReader(stream)
+    total_pages = len(reader.pages)
+    return [
+        Document(
+            page_content=page.extract_text() or "",
+            metadata={"source": filename, "page": i, "page_number": i + 1, "total_pages": total_pages}
+        )
+        for i, page in enumerate(reader.pages)
+    ]
+
+
+def _read_docx_stream(stream: BinaryIO, filename: str) -> List[Document]:
+    """Parse a Word document from a binary stream."""
+    return [_docx_to_document(DocxDocument(stream), filename)]
+
+
+def _read_text_stream(stream: BinaryIO, filename: str) -> List[Document]:
+    """
+    Decode a text or markdown stream incrementally.
+    
+    Markdown is kept as raw text so the structured chunker sees its "#" headings.
+    """
+    reader = io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline="")
+    try:
+        parts = iter(lambda: reader.read(UPLOAD_READ_SIZE), "")
+        return [Document(page_content="".join(parts), metadata={"source": filename})]
+    finally:
+        # Don't let the wrapper close the caller's stream
+        reader.detach()
+
+
+# Stream parsers for uploads, by file extension
+STREAM_LOADERS = {
+    ".pdf": _read_pdf_stream,
+    ".txt": _read_text_stream,
+    ".md": _read_text_stream,
+    ".markdown": _read_text_stream,
+    ".docx": _read_docx_stream,
+}
+
+def ingest_stream(stream: BinaryIO, filename: str, source_tag: str = "upload", chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  overlap: int = DEFAULT_OVERLAP, chunker: str = DEFAULT_CHUNKER,
+                  chunk_tokens: int = DEFAULT_CHUNK_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                  ingest_batch: Optional[str] = None) -> int:
+    """
+    Ingest a document directly from a binary stream (e.g. an HTTP upload).
+    
+    The stream is handed to the parser as-is, which reads it incrementally;
+    nothing is copied to a temp directory first.
+    
+    Args:
+        stream: Seekable binary stream positioned at the start of the file
+        filename: Original file name (used for type detection and as source)
+        ingest_batch: Batch id stored on every chunk (generated if omitted)
+        
+    Returns:
+        Number of chunks created
+    """
+    suffix = Path(filename).suffix.lower()
+    if suffix not in STREAM_LOADERS:
+        raise ValueError(f"Unsupported file type: {suffix or filename}")
+    
+    logger.info(f"Processing upload: {filename}")
+    documents = STREAM_LOADERS[suffix](stream, filename)
+    return _index_documents(documents, source_tag, chunk_size, overlap,
+                            chunker, chunk_tokens, overlap_tokens, filename, ingest_batch)
+
+
+def _chunk_length_distribution(collection, batch_size: int = 1000, max_chunks: int = 50000) -> Dict[str, Any]:
+    """
+    Summarize chunk lengths (characters and estimated tokens) in the collection.
+    
+    Pages through stored documents in batches and stops after max_chunks so
+    the stats endpoint stays cheap on very large collections.
+    """
+    char_lengths: List[int] = []
+    token_lengths: List[int] = []
+    offset = 0
+    while offset < max_chunks:
+        batch = collection.get(include=["documents"], limit=min(batch_size, max_chunks - offset), offset=offset)
+        documents = batch.get("documents") or []
+        if not documents:
+            break
+        for text in documents:
+            text = text or ""
+            char_lengths.append(len(text))
+            token_lengths.append(estimate_tokens(text))
+        offset += len(documents)
+
+    def summarize(values: List[int]) -> Dict[str, Any]:
+        if not values:
+            return {}
+        values = sorted(values)
+        pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+        return {
+            "min": values[0],
+            "p10": pick(0.10),
+            "p50": pick(0.50),
+            "p90": pick(0.90),
+            "max": values[-1],
+            "mean": round(sum(values) / len(values), 1),
+        }
+
+    small_threshold = DEFAULT_CHUNK_TOKENS // 4
+    return {
+        "sampled_chunks": len(char_lengths),
+        "chars": summarize(char_lengths),
+        "tokens": summarize(token_lengths),
+        "small_chunks": sum(1 for t in token_lengths if t < small_threshold),
+        "small_chunk_threshold_tokens": small_threshold,
+    }
+
+
 def get_ingestion_stats() -> dict:
     """Get statistics about the current vector store."""
     try:
-        collection = vectorstore._collection
+        collection = get_vectorstore()._collection
         if collection:
             count = collection.count()
             return {
                 "total_chunks": count,
                 "chunk_size": DEFAULT_CHUNK_SIZE,
                 "overlap": DEFAULT_OVERLAP,
-                "chunking_method": "character-based"
+                "chunk_tokens": DEFAULT_CHUNK_TOKENS,
+                "overlap_tokens": DEFAULT_OVERLAP_TOKENS,
+                "chunking_method": "character-based" if DEFAULT_CHUNKER == "character" else "structure-aware",
+                "chunk_length_distribution": _chunk_length_distribution(collection)
             }
         return {"error": "Collection not initialized"}
     except Exception as e:
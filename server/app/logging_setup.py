@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional
+
+from .tenants import current_tenant
+
+# "text" (the classic one-line format) or "json" (one object per line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_TO_FILE = os.getenv("LOG_TO_FILE", "false").lower() == "true"
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+# Records buffered for the writer thread; beyond this, new records are dropped, never waited on
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Share of high-volume INFO events (marked sample=True) that are kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Per-request context stamped onto every record
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+_stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+# Stages may be recorded from worker threads running in a copy of the request's context
+_stage_lock = threading.Lock()
+
+_listener: Optional[logging.handlers.QueueListener] = None
+dropped_records = 0
+
+
+class ContextFilter(logging.Filter):
+    """Attach request id and tenant to records (runs in the caller's thread, before queueing)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.tenant = current_tenant()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep LOG_SAMPLE_RATE of INFO/DEBUG records logged with extra={"sample": True}."""
+
+    def __init__(self, rate: float = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sample", False) and record.levelno < logging.WARNING:
+            return random.random() < self.rate
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking."""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        global dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with request context and structured fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in ("request_id", "tenant"):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic text format, with structured fields appended as key=value."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if getattr(record, "request_id", None):
+            line += f" [{record.request_id}]"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def configure_logging() -> None:
+    """
+    Route all logging through a bounded queue to a background writer thread.
+
+    Callers only pay for building the record and a put_nowait(); formatting
+    and the blocking stream/file writes happen on the listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else TextFormatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if LOG_TO_FILE:
+        handlers.append(logging.FileHandler(LOG_FILE))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+@contextmanager
+def request_context(request_id: str) -> Iterator[Dict[str, float]]:
+    """Bind a request id and a fresh stage-timing dict for the duration of a request."""
+    id_token = request_id_var.set(request_id)
+    timings: Dict[str, float] = {}
+    timings_token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_timings.reset(timings_token)
+        request_id_var.reset(id_token)
+
+
+def record_stage(name: str, ms: float) -> None:
+    """Add time spent in a stage to the current request's timings (no-op outside a request)."""
+    timings = _stage_timings.get()
+    if timings is not None:
+        with _stage_lock:
+            timings[name] = round(timings.get(name, 0) + ms, 1)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block as a stage of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, (time.perf_counter() - started) * 1000)
+
+
+def logging_stats() -> Dict[str, Any]:
+    """Queue depth and records dropped because the queue was full."""
+    root = logging.getLogger()
+    handler = next((h for h in root.handlers if isinstance(h, NonBlockingQueueHandler)), None)
+    return {
+        "format": LOG_FORMAT,
+        "queued": handler.queue.qsize() if handler is not None else None,
+        "queue_size": LOG_QUEUE_SIZE,
+        "dropped": dropped_records,
+        "sample_rate": LOG_SAMPLE_RATE,
+    }
@@ -1,24 +1,67 @@
 import os
+import json
+import time
+import uuid
+import secrets
+import tempfile
+import asyncio
 import logging
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Union, AsyncIterator
 from datetime import datetime
 from dotenv import load_dotenv
 from pathlib import Path
 
-from fastapi import FastAPI, Body, HTTPException, Depends, UploadFile, File, Form
+from fastapi import FastAPI, Body, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
-from pydantic import BaseModel, Field
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, ValidationError
 import httpx
-import shutil
 
-from .rag import retrieve, get_collection_info, clear_collection
-from .ingest import ingest_folder, ingest_single_file, get_ingestion_stats
+from .rag import (
+    retrieve, retrieve_batch, get_collection_info, clear_collection, delete_by_source, delete_by_ingest_batch,
+    compact_collection, migrate_metadata, snapshot_collection, list_snapshots, restore_snapshot, list_tenant_collections,
+    collection_name_for, retrieval_signature, write_stamps
+)
+from .warm_cache import warm_caches, WARM_CACHE
+from .watcher import folder_watcher
+from .filters import normalize_filters, filter_key
+from .reindex import start_reindex, reindex_status, swap as swap_reindexed, discard as discard_reindexed, rollback
+from .ingest import (
+    ingest_folder, ingest_single_file, ingest_stream, get_ingestion_stats, STREAM_LOADERS, new_ingest_batch,
+    DEFAULT_CHUNKER, DEFAULT_CHUNK_TOKENS, DEFAULT_OVERLAP_TOKENS, estimate_tokens
+)
+from .tenants import (
+    TENANT_HEADER, WIDGET_KEY_HEADER, WIDGET_KEY_PARAM,
+    resolve_tenant, set_current_tenant, reset_current_tenant, current_tenant
+)
 from .settings_store import (
-    load_settings, save_settings, update_settings, 
+    load_settings, load_settings_versioned, save_settings, update_settings, 
     reset_settings, export_settings, import_settings
 )
+from .generation import GenerationRouter, Completion, OllamaModel, OLLAMA_PRELOAD
+from .prompts import PREFIX_ID, PREFIX_MESSAGES, build_messages, make_prompt
+from .batch_chat import parse_questions
+from .query_expansion import (
+    QUERY_EXPANSION, QUERY_EXPANSION_MAX, QUERY_EXPANSION_MAX_WORDS, REWRITE_PROMPT, parse_rewrites
+)
+from .admission import AdmissionController
+from .cache import TTLCache
+from .http_cache import StaticAsset, cached_response, file_response, IMMUTABLE_CACHE_CONTROL
+from .uploads import upload_store, receive_image, receive_multipart, UploadTooLarge
+from .logging_setup import request_context, stage, record_stage, logging_stats
+from .inference import inference_info
+from .profiling import (
+    LOOP_LAG_MONITOR, sample_cpu, memory_profiler, inference_stats, loop_monitor, torch_threads, process_stats
+)
+
+try:
+    # Optional: brotli for clients that accept it (falls back to gzip)
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
 
 # Load environment variables from .env file
 load_dotenv()
@@ -31,6 +74,44 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "openai")  # "openai" or "ollama"
 GEN_MODEL = os.getenv("GEN_MODEL", "gpt-4o-mini")  # or e.g. "llama3"
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# Alternate provider for hedged requests / failover ("" disables), and the
+# model each provider uses when it is not the primary
+FALLBACK_PROVIDER = os.getenv("FALLBACK_PROVIDER", "")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL") or (GEN_MODEL if MODEL_PROVIDER == "openai" else "gpt-4o-mini")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL") or (GEN_MODEL if MODEL_PROVIDER == "ollama" else "llama3")
+# Send OpenAI a prompt_cache_key for the static prompt prefix (disable for OpenAI-compatible servers)
+OPENAI_PROMPT_CACHE_KEY = os.getenv("OPENAI_PROMPT_CACHE_KEY", "true").lower() == "true"
+
+# Cached /chat answers (per tenant, settings version and normalized question)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "900"))
+# Trust X-Forwarded-For for client IPs (only behind a reverse proxy)
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true"
+
+# /chat/batch: questions per request, concurrent generations, queries per retrieval pass
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_RETRIEVAL_SIZE = int(os.getenv("BATCH_RETRIEVAL_SIZE", "32"))
+
+# QUERY_EXPANSION=llm: time budget for the rewrite call, and cached rewrites
+QUERY_REWRITE_TIMEOUT = float(os.getenv("QUERY_REWRITE_TIMEOUT", "2"))
+QUERY_REWRITE_CACHE_SIZE = int(os.getenv("QUERY_REWRITE_CACHE_SIZE", "2000"))
+
+# Maximum document upload size for /ingest/upload (bytes)
+MAX_INGEST_UPLOAD_SIZE = int(os.getenv("MAX_INGEST_UPLOAD_SIZE", str(50 * 1024 * 1024)))
+
+# Widget caching: bootstrap payload and unversioned widget URLs (seconds)
+BOOTSTRAP_MAX_AGE = int(os.getenv("BOOTSTRAP_MAX_AGE", "60"))
+WIDGET_MAX_AGE = int(os.getenv("WIDGET_MAX_AGE", "300"))
+WIDGET_DIR = Path(os.getenv("WIDGET_DIR", "../widget"))
+
+# Token for /admin endpoints (profiling); unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Request id header (taken from the client/proxy when present, echoed back)
+REQUEST_ID_HEADER = "X-Request-ID"
+# Requests slower than this are always logged; faster successful ones are sampled
+LOG_SLOW_REQUEST_MS = float(os.getenv("LOG_SLOW_REQUEST_MS", "2000"))
 
 # CORS configuration
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
@@ -51,26 +132,96 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files for the widget
-app.mount("/widget", StaticFiles(directory="./widget"), name="widget")
+@app.middleware("http")
+async def request_logging(request, call_next):
+    """Bind a request id, collect stage timings and log one line per request."""
+    request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex[:16]
+    started = time.perf_counter()
+    with request_context(request_id) as timings:
+        response = await call_next(request)
+        duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        response.headers[REQUEST_ID_HEADER] = request_id
+        logger.info("Request finished", extra={
+            # Fast successful requests are high-volume: sample them
+            "sample": response.status_code < 400 and duration_ms < LOG_SLOW_REQUEST_MS,
+            "fields": {
+                "method": request.method,
+                "path": request.url.path,
+                "status": response.status_code,
+                "duration_ms": duration_ms,
+                **{f"{name}_ms": ms for name, ms in timings.items()}
+            }
+        })
+    return response
 
-# Create uploads directory if it doesn't exist
-UPLOADS_DIR = Path("./uploads")
-UPLOADS_DIR.mkdir(exist_ok=True)
+@app.middleware("http")
+async def tenant_context(request, call_next):
+    """Bind the tenant named by the request (header or widget key) for its duration."""
+    try:
+        tenant = resolve_tenant(
+            request.headers.get(TENANT_HEADER),
+            request.headers.get(WIDGET_KEY_HEADER) or request.query_params.get(WIDGET_KEY_PARAM),
+            trusted=_is_admin(request)
+        )
+    except PermissionError as e:
+        return JSONResponse(status_code=403, content={"error": str(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    token = set_current_tenant(tenant)
+    try:
+        return await call_next(request)
+    finally:
+        reset_current_tenant(token)
 
-# Mount uploads directory
-app.mount("/uploads", StaticFiles(directory="./uploads"), name="uploads")
+# Compress JSON and widget assets
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=500, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=500)
+
+# Streamed line by line; the compressors would hold the lines back in their buffers
+UNCOMPRESSED_PATHS = {"/chat/batch"}
+
+@app.middleware("http")
+async def skip_compression(request, call_next):
+    """Hide Accept-Encoding from the compression middleware (registered after it, so outside) on streaming routes."""
+    if request.url.path in UNCOMPRESSED_PATHS:
+        request.scope["headers"] = [(k, v) for k, v in request.scope["headers"] if k != b"accept-encoding"]
+    return await call_next(request)
 
 # Pydantic models
+class RetrievalFilters(BaseModel):
+    source: Optional[Union[str, List[str]]] = Field(None, description="Source path(s)")
+    source_prefix: Optional[str] = Field(None, description="Source path prefix (e.g. a folder)")
+    source_tag: Optional[Union[str, List[str]]] = Field(None, description="Source tag(s) given at ingestion")
+    file_type: Optional[Union[str, List[str]]] = Field(None, description='File type(s), e.g. "pdf"')
+    ingest_batch: Optional[Union[str, List[str]]] = Field(None, description="Ingestion run(s)")
+    page_min: Optional[int] = Field(None, ge=1, description="First page")
+    page_max: Optional[int] = Field(None, ge=1, description="Last page")
+
 class ChatRequest(BaseModel):
     message: str = Field(..., min_length=1, max_length=1000, description="User's question")
     session_id: Optional[str] = Field(None, description="Optional session identifier")
+    filters: Optional[RetrievalFilters] = Field(None, description="Only search matching documents")
 
 class ChatResponse(BaseModel):
     answer: str
     citations: List[Dict[str, Any]]
     context_used: int
     response_time: float
+    provider: Optional[str] = None
+    cached: bool = False
+    usage: Optional[Dict[str, Any]] = None
+
+class BatchQuestion(BaseModel):
+    id: Optional[str] = Field(None, description="Caller's id for the question (defaults to its position)")
+    message: str = Field(..., min_length=1, description="Question (over 1000 characters is reported per item)")
+
+class BatchChatRequest(BaseModel):
+    questions: List[Union[BatchQuestion, str]] = Field(..., min_items=1, description="Questions to answer")
+    concurrency: Optional[int] = Field(None, ge=1, le=32, description="Concurrent LLM generations")
+    use_cache: bool = Field(True, description="Serve cached answers where available")
+    filters: Optional[RetrievalFilters] = Field(None, description="Only search matching documents")
 
 class SettingsUpdate(BaseModel):
     title: Optional[str] = Field(None, min_length=1, max_length=100)
@@ -94,31 +245,58 @@ class SettingsUpdate(BaseModel):
 class IngestRequest(BaseModel):
     input_path: str = Field(..., description="Path to file or directory")
     source_tag: str = Field("local", description="Source identifier")
-    chunk_size: int = Field(600, ge=100, le=2000, description="Tokens per chunk")
-    overlap: int = Field(80, ge=0, le=500, description="Overlapping tokens")
+    chunk_size: int = Field(600, ge=100, le=2000, description="Characters per chunk (character chunker)")
+    overlap: int = Field(80, ge=0, le=500, description="Overlapping characters (character chunker)")
+    chunker: str = Field(DEFAULT_CHUNKER, pattern=r"^(structured|character)$", description="Chunking engine")
+    chunk_tokens: int = Field(DEFAULT_CHUNK_TOKENS, ge=32, le=512, description="Tokens per chunk (structured chunker)")
+    overlap_tokens: int = Field(DEFAULT_OVERLAP_TOKENS, ge=0, le=128, description="Overlapping tokens (structured chunker)")
+
+# Form fields of /ingest/upload (parsed by hand while the file streams in)
+class IngestUploadForm(BaseModel):
+    source_tag: str = Field("upload", description="Source identifier")
+    chunker: str = Field(DEFAULT_CHUNKER, pattern=r"^(structured|character)$", description="Chunking engine")
+    chunk_tokens: int = Field(DEFAULT_CHUNK_TOKENS, ge=32, le=512, description="Tokens per chunk (structured chunker)")
+    overlap_tokens: int = Field(DEFAULT_OVERLAP_TOKENS, ge=0, le=128, description="Overlapping tokens (structured chunker)")
+
+class CollectionDeleteRequest(BaseModel):
+    source: Optional[str] = Field(None, description="Delete chunks from this source document")
+    ingest_batch: Optional[str] = Field(None, description="Delete chunks written by this ingestion run")
+
+class SnapshotRequest(BaseModel):
+    name: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_-][A-Za-z0-9._-]{0,99}$", description="Snapshot name")
+
+class ReindexRequest(BaseModel):
+    embed_model: Optional[str] = Field(None, max_length=200, description="Embedding model of the new version (default: EMBED_MODEL)")
+    chunk_size: int = Field(600, ge=100, le=2000, description="Characters per chunk (character chunker)")
+    overlap: int = Field(80, ge=0, le=500, description="Overlapping characters (character chunker)")
+    chunker: str = Field(DEFAULT_CHUNKER, pattern=r"^(structured|character)$", description="Chunking engine")
+    chunk_tokens: int = Field(DEFAULT_CHUNK_TOKENS, ge=32, le=512, description="Tokens per chunk (structured chunker)")
+    overlap_tokens: int = Field(DEFAULT_OVERLAP_TOKENS, ge=0, le=128, description="Overlapping tokens (structured chunker)")
+    queries: Optional[List[str]] = Field(None, max_length=500, description="Validation queries (default: sampled from the collection)")
+    auto_swap: bool = Field(True, description="Swap the new version in as soon as it validates")
+    reuse_embeddings: Optional[bool] = Field(None, description="Reuse stored vectors (default: when the embedding model is unchanged)")
+    min_overlap: Optional[float] = Field(None, ge=0.0, le=1.0, description="Minimum mean source overlap with the live version")
 
-# LLM calling functions
-async def call_openai(prompt: str, temperature: float = 0.2, max_tokens: int = 140) -> str:
+# LLM calling functions (messages: static prefix from prompts.py, then the prompt)
+async def call_openai(prompt: str, temperature: float = 0.2, max_tokens: int = 140, model: str = OPENAI_MODEL,
+                      system: Optional[str] = None) -> Completion:
     """Call OpenAI API for text generation."""
     if not OPENAI_API_KEY:
         raise HTTPException(status_code=500, detail="OpenAI API key not configured")
     
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
     payload = {
-        "model": GEN_MODEL,
-        "messages": [
-            {
-                "role": "system", 
-                "content": "You are a friendly Vision Flows Agency teammate.\n\nRULES\n- Use ONLY the provided Context. If missing, say what's missing and ask 1 targeted question.\n- Keep answers short: 60–100 words total. Max 4 bullets. No intro phrases or summaries.\n- Format lists with \"• \"; one idea per line; no tables unless asked.\n- If asked about pricing/timeline/scope: ask 1 scoping question, then give a clear next step (book call, custom quote, or starter package).\n- Do not repeat yourself or restate the question.\n- End every reply with the token: <END>\n\nEXAMPLES:\nUser: Do you build Shopify stores? What's the cost?\nAssistant:\n• Yes—Shopify setup, payments, products, and basic design\n• Typical range: $1,500–$3,500; varies by catalog size and integrations\n• Share product count + must-have apps, and I'll confirm a package or custom quote\n<END>\n\nUser: Can you add a website chatbot?\nAssistant:\n• We install a site + Instagram chatbot for FAQs, leads, and simple booking\n• Setup: $500–$1,500; ongoing from $150–$300/mo based on features\n• Do you want lead qualification, calendar booking, or handoff to a human?\n<END>\n\nCONTEXT\n{{context}}"
-            },
-            {"role": "user", "content": prompt}
-        ],
+        "model": model,
+        "messages": build_messages(prompt, system),
         "temperature": temperature,
         "max_tokens": max_tokens,
         "frequency_penalty": 0.4,
         "presence_penalty": 0.0,
         "stop": ["<END>"]
     }
+    if OPENAI_PROMPT_CACHE_KEY:
+        # Routes requests sharing the prefix to the same cache
+        payload["prompt_cache_key"] = f"rag-{PREFIX_ID}"
     
     try:
         async with httpx.AsyncClient(timeout=60) as client:
@@ -129,7 +307,12 @@ async def call_openai(prompt: str, temperature: float = 0.2, max_tokens: int = 1
             )
             response.raise_for_status()
             data = response.json()
-            return data["choices"][0]["message"]["content"]
+            usage = data.get("usage") or {}
+            return Completion(data["choices"][0]["message"]["content"], {
+                "prompt_tokens": usage.get("prompt_tokens"),
+                "completion_tokens": usage.get("completion_tokens"),
+                "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+            })
     except httpx.HTTPStatusError as e:
         logger.error(f"OpenAI API error: {e.response.text}")
         raise HTTPException(status_code=500, detail=f"OpenAI API error: {e.response.text}")
@@ -137,24 +320,22 @@ async def call_openai(prompt: str, temperature: float = 0.2, max_tokens: int = 1
         logger.error(f"Error calling OpenAI: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error calling OpenAI: {str(e)}")
 
-async def call_ollama(prompt: str, temperature: float = 0.2, max_tokens: int = 140) -> str:
+async def call_ollama(prompt: str, temperature: float = 0.2, max_tokens: int = 140, model: str = OLLAMA_MODEL,
+                      system: Optional[str] = None) -> Completion:
     """Call local Ollama API for text generation."""
+    messages = build_messages(prompt, system)
+    prompt_tokens = sum(estimate_tokens(message["content"]) + 4 for message in messages)
     payload = {
-        "model": GEN_MODEL,
-        "messages": [
-            {
-                "role": "system", 
-                "content": "You are a friendly Vision Flows Agency teammate.\n\nRULES\n- Use ONLY the provided Context. If missing, say what's missing and ask 1 targeted question.\n- Keep answers short: 60–100 words total. Max 4 bullets. No intro phrases or summaries.\n- Format lists with \"• \"; one idea per line; no tables unless asked.\n- If asked about pricing/timeline/scope: ask 1 scoping question, then give a clear next step (book call, custom quote, or starter package).\n- Do not repeat yourself or restate the question.\n- End every reply with the token: <END>\n\nEXAMPLES:\nUser: Do you build Shopify stores? What's the cost?\nAssistant:\n• Yes—Shopify setup, payments, products, and basic design\n• Typical range: $1,500–$3,500; varies by catalog size and integration\n• Share product count + must-have apps, and I'll confirm a package or custom quote\n<END>\n\nUser: Can you add a website chatbot?\nAssistant:\n• We install a site + Instagram chatbot for FAQs, leads, and simple booking\n• Setup: $500–$1,500; ongoing from $150–$300/mo based on features\n• Do you want lead qualification, calendar booking, or handoff to a human?\n<END>\n\nCONTEXT\n{{context}}"
-            },
-            {"role": "user", "content": prompt}
-        ],
+        "model": model,
+        "messages": messages,
         "stream": False,
+        "keep_alive": ollama_model.keep_alive,
         "options": {
             "temperature": temperature,
             "num_predict": max_tokens,
             "top_p": 0.9,
             "repeat_penalty": 1.1,
-            "num_ctx": 4096
+            "num_ctx": ollama_model.num_ctx_for(prompt_tokens, max_tokens)
         },
         "stop": ["<END>"]
     }
@@ -164,7 +345,16 @@ async def call_ollama(prompt: str, temperature: float = 0.2, max_tokens: int = 1
             response = await client.post(f"{OLLAMA_BASE_URL}/api/chat", json=payload)
             response.raise_for_status()
             data = response.json()
-            return data.get("message", {}).get("content", "")
+            ollama_model.record(data)
+            # prompt_eval_count counts only the tokens Ollama had to evaluate;
+            # the rest of the (estimated) prompt came from its KV cache
+            evaluated = data.get("prompt_eval_count")
+            return Completion(data.get("message", {}).get("content", ""), {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": data.get("eval_count"),
+                "cached_tokens": max(prompt_tokens - evaluated, 0) if evaluated is not None else None,
+                "estimated": True
+            })
     except httpx.HTTPStatusError as e:
         logger.error(f"Ollama API error: {e.response.text}")
         raise HTTPException(status_code=500, detail=f"Ollama API error: {e.response.text}")
@@ -172,26 +362,64 @@ async def call_ollama(prompt: str, temperature: float = 0.2, max_tokens: int = 1
         logger.error(f"Error calling Ollama: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error calling Ollama: {str(e)}")
 
-def make_prompt(user_msg: str, contexts: List[Dict[str, Any]]) -> str:
-    """Create a prompt with retrieved context for the LLM."""
-    if not contexts:
-        return f"Question: {user_msg}\n\nContext: No relevant documents found.\n\nAnswer: I don't have enough information to answer your question. Please provide more context or ask about something else."
-    
-    # Format context with short, titled chunks (following GPT's recommendation)
-    context_chunks = []
-    for context in contexts:
-        # Extract section title if available, otherwise use source
-        source = context.get("metadata", {}).get("source", "document")
-        section_title = context.get("metadata", {}).get("section_title", "")
-        
-        if section_title:
-            context_chunks.append(f"{section_title}:\n{context['text']}")
-        else:
-            context_chunks.append(f"{source}:\n{context['text']}")
-    
-    context_blob = "\n\n".join(context_chunks)
+# Admission control for /chat and the answer cache that bypasses it
+admission = AdmissionController()
+answer_cache = TTLCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+
+# Loaded-model and context-window management for the Ollama provider
+ollama_model = OllamaModel(OLLAMA_BASE_URL, OLLAMA_MODEL)
+
+# Generation router: primary provider, hedged to / failed over to FALLBACK_PROVIDER
+generation_router = GenerationRouter(
+    {"openai": call_openai, "ollama": call_ollama},
+    primary=MODEL_PROVIDER,
+    fallback=FALLBACK_PROVIDER or None
+)
+
+# Short, deterministic-ish rewrites for retrieval (QUERY_EXPANSION=llm)
+rewrite_cache = TTLCache(QUERY_REWRITE_CACHE_SIZE, 24 * 3600)
+REWRITE_SYSTEM_PROMPT = "You write search queries. Reply with the queries only, one per line."
+
+async def expand_query(message: str) -> Optional[List[str]]:
+    """
+    LLM rewrites of a short question for multi-query retrieval.
     
-    return f"Question: {user_msg}\n\nContext:\n{context_blob}\n\nAnswer:"
+    Returns None outside QUERY_EXPANSION=llm (retrieve() then applies its
+    own default), and [] when the rewrite call fails or runs past
+    QUERY_REWRITE_TIMEOUT, so a slow provider never blocks retrieval.
+    The call goes straight to the primary provider, not through the
+    router, so these short calls don't skew its latency windows.
+    """
+    if QUERY_EXPANSION != "llm":
+        return None
+    if len(message.split()) > QUERY_EXPANSION_MAX_WORDS:
+        return []
+    key = _normalize_question(message)
+    cached = rewrite_cache.get(key)
+    if cached is not None:
+        return cached
+    prompt = REWRITE_PROMPT.format(n=QUERY_EXPANSION_MAX, question=message)
+    try:
+        completion = await asyncio.wait_for(
+            generation_router.providers[MODEL_PROVIDER](prompt, 0.3, 80, system=REWRITE_SYSTEM_PROMPT),
+            QUERY_REWRITE_TIMEOUT
+        )
+    except Exception as e:
+        logger.warning(f"Query rewrite failed, searching with the original question only: {e}")
+        return []
+    rewrites = parse_rewrites(completion.text, message)
+    rewrite_cache.set(key, rewrites)
+    return rewrites
+
+# Answers and rewrites are kept across restarts with the retrieval caches,
+# as long as the models, prompts and (for answers) the collection are unchanged
+warm_caches.register("answers", answer_cache, lambda: {
+    "provider": MODEL_PROVIDER, "model": GEN_MODEL, "fallback": [FALLBACK_PROVIDER, OPENAI_MODEL, OLLAMA_MODEL],
+    "prefix": PREFIX_ID, "retrieval": retrieval_signature()
+}, collection_of=lambda key: key[1])
+warm_caches.register("query_rewrites", rewrite_cache, lambda: {
+    "provider": MODEL_PROVIDER, "model": GEN_MODEL, "prompt": REWRITE_PROMPT, "max": QUERY_EXPANSION_MAX
+})
 
 # API endpoints
 @app.get("/")
@@ -205,6 +433,7 @@ async def root():
             "chat": "/chat",
             "settings": "/settings",
             "suggested": "/suggested",
+            "bootstrap": "/bootstrap",
             "ingest": "/ingest",
             "health": "/health",
             "docs": "/docs"
@@ -218,9 +447,104 @@ async def health():
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "model_provider": MODEL_PROVIDER,
-        "llm_model": GEN_MODEL
+        "llm_model": GEN_MODEL,
+        "fallback_provider": FALLBACK_PROVIDER or None,
+        "circuits": {name: breaker.state for name, breaker in generation_router.breakers.items()},
+        "logging": logging_stats()
+    }
+
+@app.get("/admission/stats")
+async def get_admission_stats():
+    """In-flight/queue state, rejections, queue-wait percentiles and answer cache stats."""
+    return {**admission.snapshot(), "answer_cache": answer_cache.snapshot()}
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Hit rates of the runtime caches and their last warm-cache snapshot and restore."""
+    return warm_caches.info()
+
+@app.get("/generation/stats")
+async def get_generation_stats():
+    """Per-provider latency percentiles, hedging counters, token usage and circuit state."""
+    stats = {**generation_router.snapshot(), "prompt_prefix": PREFIX_ID}
+    if "ollama" in generation_router.order:
+        stats["ollama"] = ollama_model.snapshot()
+    return stats
+
+def _is_admin(request: Request) -> bool:
+    """Whether the caller presents ADMIN_TOKEN (X-Admin-Token or Bearer)."""
+    if not ADMIN_TOKEN:
+        return False
+    token = request.headers.get("x-admin-token", "")
+    authorization = request.headers.get("authorization", "")
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[7:].strip()
+    return secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def require_admin(request: Request) -> None:
+    """Allow only callers presenting ADMIN_TOKEN (X-Admin-Token or Bearer)."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+def _profile_download(body: str, kind: str) -> PlainTextResponse:
+    """Folded stacks as a downloadable file (flamegraph.pl, speedscope, inferno)."""
+    filename = f"{kind}-{os.getpid()}-{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded"
+    return PlainTextResponse(body, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/admin/profile/runtime", dependencies=[Depends(require_admin)])
+async def get_runtime_profile():
+    """Torch threads, local model inference timings, event-loop lag and process stats."""
+    return {
+        "torch": torch_threads(),
+        "pools": inference_info(),
+        "inference": inference_stats.snapshot(),
+        "event_loop": loop_monitor.snapshot(),
+        "process": process_stats(),
+        "tracemalloc": memory_profiler.running
     }
 
+@app.post("/admin/profile/cpu", dependencies=[Depends(require_admin)])
+async def profile_cpu(seconds: float = 10, interval_ms: float = 5, format: str = "folded"):
+    """Sample all thread stacks for a while; returns folded stacks (or JSON with format=json)."""
+    result = await run_in_threadpool(sample_cpu, seconds, interval_ms)
+    if format == "json":
+        return result
+    return _profile_download(result["folded"], "cpu")
+
+@app.post("/admin/profile/memory/start", dependencies=[Depends(require_admin)])
+async def start_memory_profile():
+    """Start tracemalloc (slows allocations until stopped)."""
+    memory_profiler.start()
+    return {"success": True, "tracing": memory_profiler.running}
+
+@app.post("/admin/profile/memory/stop", dependencies=[Depends(require_admin)])
+async def stop_memory_profile():
+    """Stop tracemalloc and drop its snapshots."""
+    memory_profiler.stop()
+    return {"success": True, "tracing": memory_profiler.running}
+
+@app.get("/admin/profile/memory/snapshot", dependencies=[Depends(require_admin)])
+async def memory_snapshot(limit: int = 30, format: str = "json"):
+    """Top allocation sites; format=folded downloads bytes-weighted stacks for a flamegraph."""
+    try:
+        result = await run_in_threadpool(memory_profiler.snapshot, limit)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "folded":
+        return _profile_download(result["folded"], "memory")
+    result.pop("folded")
+    return result
+
+@app.get("/admin/profile/memory/diff", dependencies=[Depends(require_admin)])
+async def memory_diff(limit: int = 30):
+    """Allocation growth since the previous snapshot or diff."""
+    try:
+        return await run_in_threadpool(memory_profiler.diff, limit)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 @app.get("/settings")
 async def get_settings():
     """Get current chatbot settings."""
@@ -266,89 +590,305 @@ async def get_suggested_questions():
     settings = load_settings()
     return {"suggested": settings.get("suggested", [])}
 
+def _client_ip(request: Request) -> Optional[str]:
+    """Client address, honoring X-Forwarded-For only behind a trusted proxy."""
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+def _normalize_question(message: str) -> str:
+    """Case- and whitespace-insensitive form of a question, for cache keys."""
+    return " ".join(message.lower().split()).rstrip("?!. ")
+
+def _request_filters(filters: Optional[RetrievalFilters]) -> Optional[Dict[str, Any]]:
+    """Normalized retrieval filter of a request (400 if invalid)."""
+    try:
+        return normalize_filters(filters.dict(exclude_none=True) if filters else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filters: {str(e)}")
+
+def _invalidate_answers() -> None:
+    """Drop cached answers after the knowledge base changed."""
+    answer_cache.clear()
+
+def _build_answer(completion: Completion, hits: List[Dict[str, Any]], provider: str) -> Dict[str, Any]:
+    """Clean up a generated answer and attach citations for the hits it used."""
+    text = completion.text
+    # Remove <END> token if present
+    if text.endswith("<END>"):
+        text = text[:-5].strip()
+    
+    citations = []
+    for i, hit in enumerate(hits):
+        citations.append({
+            "index": i + 1,
+            "source": hit.get("metadata", {}).get("source", "document"),
+            "page": hit.get("metadata", {}).get("page_number"),
+            "paragraph": hit.get("metadata", {}).get("paragraph_number"),
+            "score": hit.get("rerank_score", 0),
+            "text_preview": hit.get("text", "")[:100] + "..."
+        })
+    
+    return {
+        "answer": text,
+        "citations": citations,
+        "context_used": len(hits),
+        "provider": provider,
+        "usage": completion.usage
+    }
+
 @app.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """Main chat endpoint with RAG processing."""
     start_time = datetime.now()
     
     try:
         # Load current settings for LLM parameters
-        settings = load_settings()
+        settings_version, settings = load_settings_versioned()
         chat_settings = settings.get("chat_settings", {})
         
         # Get LLM parameters from settings with sensible defaults
         temperature = chat_settings.get("temperature", 0.2)
         max_tokens = chat_settings.get("max_tokens", 140)  # Reduced default for conciseness
         
-        # Step 1: Retrieve relevant documents (reduced to top 3-5 as recommended)
-        hits = retrieve(request.message, k=5)[:3]  # Top 3 after reranking
-        
-        # Step 2: Create prompt with context
-        prompt = make_prompt(request.message, hits)
+        # Cached answers are served without taking a slot or a rate-limit token
+        question = _normalize_question(request.message)
+        filters = _request_filters(request.filters)
+        collection = collection_name_for()
+        cache_key = (current_tenant(), collection, write_stamps.current(collection), settings_version, question,
+                     filter_key(filters))
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            admission.stats["cache_hits"] += 1
+            return ChatResponse(
+                **{**cached, "usage": None},
+                response_time=(datetime.now() - start_time).total_seconds(),
+                cached=True
+            )
         
-        # Step 3: Generate response using LLM with user settings
-        if MODEL_PROVIDER == "ollama":
-            text = await call_ollama(prompt, temperature, max_tokens)
-        else:
-            text = await call_openai(prompt, temperature, max_tokens)
+        # Admission control: per-session/IP rate limits, then a /chat slot
+        # (suggested questions may use the reserved priority slots)
+        admission.check_rate(_client_ip(http_request), request.session_id)
+        priority = question in {_normalize_question(q) for q in settings.get("suggested", [])}
         
-        # Step 4: Clean up response (remove <END> token if present)
-        if text.endswith("<END>"):
-            text = text[:-5].strip()
+        async with admission.chat.slot(priority) as waited:
+            record_stage("queue", waited * 1000)
+            # Step 1: Retrieve relevant documents (reduced to top 3-5 as recommended),
+            # searching optional rewrites of the question alongside it
+            with stage("expand"):
+                expansions = await expand_query(request.message)
+            hits = (await run_in_threadpool(retrieve, request.message, 5, expansions, filters))[:3]  # Top 3 after reranking
+            
+            # Step 2: Create prompt with context
+            prompt = make_prompt(request.message, hits)
+            
+            # Step 3: Generate response using LLM with user settings (hedged across providers)
+            with stage("generate"):
+                completion, provider = await generation_router.generate(prompt, temperature, max_tokens)
         
-        # Step 5: Prepare response with citations
+        # Step 4: Clean up response and attach citations
+        answer = _build_answer(completion, hits, provider)
         response_time = (datetime.now() - start_time).total_seconds()
+        answer_cache.set(cache_key, answer)
         
-        citations = []
-        for i, hit in enumerate(hits):
-            citations.append({
-                "index": i + 1,
-                "source": hit.get("metadata", {}).get("source", "document"),
-                "page": hit.get("metadata", {}).get("page_number"),
-                "score": hit.get("rerank_score", 0),
-                "text_preview": hit.get("text", "")[:100] + "..."
-            })
-        
-        return ChatResponse(
-            answer=text,
-            citations=citations,
-            context_used=len(hits),
-            response_time=response_time
-        )
+        return ChatResponse(**answer, response_time=response_time)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
 
+async def _run_batch(questions: List[Dict[str, str]], concurrency: int, use_cache: bool,
+                     filters: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Answer a list of questions, yielding each result as it completes.
+    
+    Questions are retrieved BATCH_RETRIEVAL_SIZE at a time (one embedding
+    pass and one batched rerank per group) and generation runs with at
+    most `concurrency` LLM calls in flight. Results carry their position
+    in the input (`index`) since they arrive in completion order.
+    """
+    settings_version, settings = load_settings_versioned()
+    chat_settings = settings.get("chat_settings", {})
+    temperature = chat_settings.get("temperature", 0.2)
+    max_tokens = chat_settings.get("max_tokens", 140)
+    tenant, collection = current_tenant(), collection_name_for()
+    stamp = write_stamps.current(collection)
+    cache_key = lambda message: (tenant, collection, stamp, settings_version, _normalize_question(message),
+                                 filter_key(filters))
+    
+    batch_started = time.perf_counter()
+    elapsed_ms = lambda: round((time.perf_counter() - batch_started) * 1000, 1)
+    results: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks: List[asyncio.Task] = []
+    
+    def failed(index: int, item: Dict[str, str], error: str) -> Dict[str, Any]:
+        return {"index": index, "id": item["id"], "question": item["message"], "error": error,
+                "timing": {"elapsed_ms": elapsed_ms()}}
+    
+    async def answer(index: int, item: Dict[str, str], hits: List[Dict[str, Any]], retrieval_ms: float):
+        try:
+            queued = time.perf_counter()
+            # Per-batch concurrency, then a slot of the budget all batches share
+            async with semaphore, admission.batch.slot():
+                started = time.perf_counter()
+                prompt = make_prompt(item["message"], hits)
+                completion, provider = await generation_router.generate(prompt, temperature, max_tokens)
+            result = _build_answer(completion, hits, provider)
+            answer_cache.set(cache_key(item["message"]), result)
+            await results.put({
+                "index": index, "id": item["id"], "question": item["message"], **result, "cached": False,
+                "timing": {
+                    "retrieval_ms": retrieval_ms,
+                    "queue_ms": round((started - queued) * 1000, 1),
+                    "generation_ms": round((time.perf_counter() - started) * 1000, 1),
+                    "elapsed_ms": elapsed_ms()
+                }
+            })
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            await results.put(failed(index, item, f"Generation failed: {detail}"))
+    
+    async def produce():
+        for start in range(0, len(questions), BATCH_RETRIEVAL_SIZE):
+            pending = []
+            for index, item in enumerate(questions[start:start + BATCH_RETRIEVAL_SIZE], start=start):
+                if len(item["message"]) > 1000:
+                    await results.put(failed(index, item, "Question exceeds 1000 characters"))
+                    continue
+                cached = answer_cache.get(cache_key(item["message"])) if use_cache else None
+                if cached is not None:
+                    await results.put({"index": index, "id": item["id"], "question": item["message"],
+                                       **cached, "usage": None, "cached": True, "timing": {"elapsed_ms": elapsed_ms()}})
+                else:
+                    pending.append((index, item))
+            if not pending:
+                continue
+            
+            started = time.perf_counter()
+            try:
+                hit_lists = await run_in_threadpool(retrieve_batch, [item["message"] for _, item in pending], 5, filters)
+            except Exception as e:
+                logger.error(f"Error in batch retrieval: {str(e)}")
+                for index, item in pending:
+                    await results.put(failed(index, item, f"Retrieval failed: {str(e)}"))
+                continue
+            # Retrieval cost of the group, shared evenly by its questions
+            retrieval_ms = round((time.perf_counter() - started) * 1000 / len(pending), 1)
+            for (index, item), hits in zip(pending, hit_lists):
+                tasks.append(asyncio.create_task(answer(index, item, hits[:3], retrieval_ms)))
+    
+    producer = asyncio.create_task(produce())
+    try:
+        for _ in range(len(questions)):
+            getter = asyncio.ensure_future(results.get())
+            await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                # Surface a crashed producer instead of waiting forever
+                if producer.exception() is not None:
+                    getter.cancel()
+                    raise producer.exception()
+                await getter
+            yield getter.result()
+    finally:
+        # Client went away (or we are done): stop outstanding work
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
+
+@app.post("/chat/batch", dependencies=[Depends(require_admin)])
+async def chat_batch(http_request: Request):
+    """
+    Answer many questions in one request (offline evaluation, FAQ generation).
+    
+    Accepts a JSON body ({"questions": [...], "concurrency": n, "use_cache": bool,
+    "filters": {...}}) or JSONL / plain text with one question per line. Streams one JSON
+    result per line as answers complete, then a summary line. Generations of
+    all batches share the BATCH_MAX_IN_FLIGHT budget, apart from /chat's slots.
+    """
+    admission.check_rate(_client_ip(http_request), None)
+    body = await http_request.body()
+    content_type = http_request.headers.get("content-type", "")
+    try:
+        if content_type.startswith("application/json"):
+            request = BatchChatRequest.parse_obj(json.loads(body))
+        else:
+            request = BatchChatRequest(questions=parse_questions(body.decode("utf-8").splitlines()))
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch: {str(e)}")
+    
+    questions = [
+        {"id": str(i + 1), "message": q} if isinstance(q, str) else {"id": q.id or str(i + 1), "message": q.message}
+        for i, q in enumerate(request.questions)
+    ]
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+    concurrency = request.concurrency or BATCH_CONCURRENCY
+    filters = _request_filters(request.filters)
+    
+    async def stream():
+        started = time.perf_counter()
+        counts = {"answered": 0, "cached": 0, "errors": 0}
+        async for result in _run_batch(questions, concurrency, request.use_cache, filters):
+            if "error" in result:
+                counts["errors"] += 1
+            else:
+                counts["answered"] += 1
+                counts["cached"] += result["cached"]
+            yield json.dumps(result) + "\n"
+        summary = {"questions": len(questions), **counts, "concurrency": concurrency,
+                   "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+        logger.info(f"Batch chat finished: {summary}")
+        yield json.dumps({"summary": summary}) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.post("/ingest")
 async def ingest_documents(request: IngestRequest):
     """Ingest documents into the vector store."""
     try:
         input_path = request.input_path
+        ingest_batch = new_ingest_batch()
         
         if os.path.isfile(input_path):
             # Single file ingestion
-            result = ingest_single_file(
-                input_path, 
+            result = await run_in_threadpool(
+                ingest_single_file,
+                input_path,
                 request.source_tag, 
                 request.chunk_size, 
-                request.overlap
+                request.overlap,
+                request.chunker,
+                request.chunk_tokens,
+                request.overlap_tokens,
+                ingest_batch
             )
         elif os.path.isdir(input_path):
             # Directory ingestion
-            result = ingest_folder(
-                input_path, 
+            result = await run_in_threadpool(
+                ingest_folder,
+                input_path,
                 request.source_tag, 
                 request.chunk_size, 
-                request.overlap
+                request.overlap,
+                request.chunker,
+                request.chunk_tokens,
+                request.overlap_tokens,
+                ingest_batch
             )
         else:
             raise HTTPException(status_code=400, detail=f"Path does not exist: {input_path}")
         
         if result > 0:
+            _invalidate_answers()
             return {
                 "success": True,
                 "chunks_created": result,
+                "ingest_batch": ingest_batch,
                 "message": f"Successfully ingested {result} chunks"
             }
         else:
@@ -358,11 +898,77 @@ async def ingest_documents(request: IngestRequest):
         logger.error(f"Error in ingest endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/ingest/upload")
+async def ingest_upload(request: Request):
+    """
+    Ingest an uploaded document (multipart form: file, source_tag, chunker,
+    chunk_tokens, overlap_tokens).
+    
+    The body is parsed as it arrives and the file part spooled to a
+    temporary file, stopping as soon as it passes MAX_INGEST_UPLOAD_SIZE;
+    the document parser then reads that spool directly in a worker thread.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    try:
+        try:
+            filename, fields = await receive_multipart(request, spool.write, MAX_INGEST_UPLOAD_SIZE)
+            form = IngestUploadForm(**fields)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except (ValueError, ValidationError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid upload: {str(e)}")
+        if filename is None:
+            raise HTTPException(status_code=400, detail="Missing file")
+        filename = Path(filename).name
+        if Path(filename).suffix.lower() not in STREAM_LOADERS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported file type. Supported: {', '.join(sorted(STREAM_LOADERS))}"
+            )
+        await run_in_threadpool(spool.seek, 0)
+        
+        ingest_batch = new_ingest_batch()
+        result = await run_in_threadpool(
+            ingest_stream,
+            spool,
+            filename,
+            form.source_tag,
+            chunker=form.chunker,
+            chunk_tokens=form.chunk_tokens,
+            overlap_tokens=form.overlap_tokens,
+            ingest_batch=ingest_batch
+        )
+        
+        if result > 0:
+            _invalidate_answers()
+            return {
+                "success": True,
+                "filename": filename,
+                "chunks_created": result,
+                "ingest_batch": ingest_batch,
+                "message": f"Successfully ingested {result} chunks"
+            }
+        else:
+            raise HTTPException(status_code=400, detail="No documents were ingested")
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in ingest upload endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await run_in_threadpool(spool.close)
+
 @app.get("/ingest/stats")
 async def get_ingestion_statistics():
     """Get statistics about the vector store."""
     return get_ingestion_stats()
 
+@app.get("/ingest/watch")
+async def get_watch_status():
+    """Status of watched-folder ingestion in this worker (WATCH_DIRS)."""
+    return folder_watcher.snapshot()
+
 @app.get("/collection/info")
 async def get_vector_collection_info():
     """Get information about the current vector collection."""
@@ -370,10 +976,11 @@ async def get_vector_collection_info():
 
 @app.post("/collection/clear")
 async def clear_vector_collection():
-    """Clear all documents from the vector collection."""
+    """Clear all documents from the vector collection (drop and recreate)."""
     try:
-        result = clear_collection()
+        result = await run_in_threadpool(clear_collection)
         if result.get("success"):
+            _invalidate_answers()
             return result
         else:
             raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
@@ -381,56 +988,210 @@ async def clear_vector_collection():
         logger.error(f"Error clearing collection: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/collection/delete")
+async def delete_vector_documents(request: CollectionDeleteRequest):
+    """Delete chunks by source document or by ingestion batch."""
+    if bool(request.source) == bool(request.ingest_batch):
+        raise HTTPException(status_code=400, detail="Provide exactly one of 'source' or 'ingest_batch'")
+    if request.source:
+        result = await run_in_threadpool(delete_by_source, request.source)
+    else:
+        result = await run_in_threadpool(delete_by_ingest_batch, request.ingest_batch)
+    if not result.get("success"):
+        raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
+    _invalidate_answers()
+    return result
+
+@app.post("/collection/compact", dependencies=[Depends(require_admin)])
+async def compact_vector_collection(metadata: bool = False):
+    """Rebuild the collection to reclaim space left by deletes (metadata=true also migrates to compact metadata)."""
+    result = await run_in_threadpool(migrate_metadata if metadata else compact_collection)
+    if not result.get("success"):
+        raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
+    _invalidate_answers()
+    return result
+
+@app.post("/collection/snapshot", dependencies=[Depends(require_admin)])
+async def snapshot_vector_collection(request: Optional[SnapshotRequest] = None):
+    """Snapshot the vector store directory."""
+    result = await run_in_threadpool(snapshot_collection, request.name if request else None)
+    if not result.get("success"):
+        raise HTTPException(status_code=400, detail=result.get("error", "Unknown error"))
+    return result
+
+@app.get("/collection/snapshots")
+async def get_vector_snapshots():
+    """List available vector store snapshots."""
+    return {"snapshots": list_snapshots()}
+
+@app.post("/collection/restore", dependencies=[Depends(require_admin)])
+async def restore_vector_collection(request: SnapshotRequest):
+    """Restore the vector store from a snapshot."""
+    if not request.name:
+        raise HTTPException(status_code=400, detail="Snapshot name is required")
+    result = await run_in_threadpool(restore_snapshot, request.name)
+    if not result.get("success"):
+        raise HTTPException(status_code=400, detail=result.get("error", "Unknown error"))
+    _invalidate_answers()
+    return result
+
+@app.post("/collection/reindex", status_code=202, dependencies=[Depends(require_admin)])
+async def reindex_vector_collection(request: ReindexRequest):
+    """Rebuild the collection into a new version in the background (blue/green)."""
+    try:
+        return await run_in_threadpool(start_reindex, **request.dict())
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/collection/reindex")
+async def get_reindex_status():
+    """Progress and validation of the last reindex, and the collection versions."""
+    return await run_in_threadpool(reindex_status)
+
+@app.post("/collection/reindex/swap", dependencies=[Depends(require_admin)])
+async def swap_reindexed_collection(force: bool = False):
+    """Activate the reindexed version (force=true even if it failed validation)."""
+    try:
+        result = await run_in_threadpool(swap_reindexed, force)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    _invalidate_answers()
+    return result
+
+@app.delete("/collection/reindex", dependencies=[Depends(require_admin)])
+async def discard_reindexed_collection():
+    """Delete a reindexed version that was not swapped in."""
+    try:
+        return await run_in_threadpool(discard_reindexed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/collection/rollback", dependencies=[Depends(require_admin)])
+async def rollback_vector_collection():
+    """Make the previous collection version active again."""
+    try:
+        result = await run_in_threadpool(rollback)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    _invalidate_answers()
+    return result
+
+@app.get("/tenants")
+async def get_tenants():
+    """List tenant collections served by this process."""
+    return {"tenants": await run_in_threadpool(list_tenant_collections)}
+
+# Widget assets, served from memory; embed.js links the versioned chat.html URL
+chat_asset = StaticAsset(WIDGET_DIR / "chat.html", "text/html")
+embed_asset = StaticAsset(
+    WIDGET_DIR / "embed.js",
+    "application/javascript",
+    substitutions={"__CHAT_HTML_VERSION__": chat_asset}
+)
+WIDGET_ASSETS = {"chat.html": chat_asset, "embed.js": embed_asset}
+
+def _serve_widget_asset(request: Request, asset: StaticAsset, cache_control: str):
+    """Serve a widget asset with its content hash as ETag."""
+    body, version = asset.load()
+    return cached_response(request, body, asset.media_type, f'"{version}"', cache_control)
+
+# Serialized bootstrap payloads by (tenant, settings version)
+_bootstrap_bodies: Dict[tuple, bytes] = {}
+
+@app.get("/bootstrap")
+async def get_bootstrap(request: Request):
+    """
+    Everything the widget needs to render, in one cacheable response.
+    
+    The ETag is the settings content hash, so unchanged settings answer
+    conditional requests with 304 and shared caches can serve the rest.
+    """
+    version, settings = load_settings_versioned()
+    cache_key = (current_tenant(), version)
+    body = _bootstrap_bodies.get(cache_key)
+    if body is None:
+        body = json.dumps({
+            "version": version,
+            "settings": settings,
+            "suggested": settings.get("suggested", [])
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if len(_bootstrap_bodies) >= 256:
+            _bootstrap_bodies.clear()
+        _bootstrap_bodies[cache_key] = body
+    return cached_response(
+        request, body, "application/json", f'"{version}"',
+        f"public, max-age={BOOTSTRAP_MAX_AGE}, stale-while-revalidate=86400",
+        vary=f"{TENANT_HEADER}, {WIDGET_KEY_HEADER}"
+    )
+
 @app.get("/widget/embed.js")
-async def get_embed_script():
+async def get_embed_script(request: Request):
     """Serve the embed script for Framer integration."""
-    return FileResponse("../widget/embed.js", media_type="application/javascript")
+    return _serve_widget_asset(request, embed_asset, f"public, max-age={WIDGET_MAX_AGE}")
 
 @app.get("/widget/chat.html")
-async def get_chat_interface():
+async def get_chat_interface(request: Request):
     """Serve the chat interface HTML."""
-    return FileResponse("../widget/chat.html", media_type="text/html")
+    return _serve_widget_asset(request, chat_asset, f"public, max-age={WIDGET_MAX_AGE}")
+
+@app.get("/widget/v/{version}/{name}")
+async def get_versioned_widget_asset(request: Request, version: str, name: str):
+    """Serve a widget asset under a content-hash URL, cached as immutable."""
+    asset = WIDGET_ASSETS.get(name)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    # A stale version (old embed.js still cached somewhere) gets current content, briefly cached
+    if version != asset.version:
+        return _serve_widget_asset(request, asset, "public, max-age=60")
+    return _serve_widget_asset(request, asset, IMMUTABLE_CACHE_CONTROL)
+
+# Mount static files for the widget test pages (after the widget routes above,
+# which would otherwise be shadowed by the mount)
+app.mount("/widget", StaticFiles(directory="./widget"), name="widget")
 
 @app.post("/upload/image")
-async def upload_image(file: UploadFile = File(...)):
-    """Upload an image file for the chatbot."""
+async def upload_image(request: Request):
+    """
+    Upload an image file for the chatbot (multipart field "file").
+    
+    The body is parsed as it streams in and the image written in chunks
+    off the event loop, stopping as soon as it passes MAX_FILE_SIZE. It is
+    stored under the hash of its content, so re-uploading the same icon
+    returns the existing file.
+    """
     try:
-        # Validate file type
-        if not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Validate file size (max 5MB)
-        if file.size and file.size > 5 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="File size must be less than 5MB")
-        
-        # Generate unique filename
-        file_extension = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-        filename = f"chatbot_icon_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_extension}"
-        file_path = UPLOADS_DIR / filename
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Return file info
+        stored = await receive_image(request)
         return JSONResponse({
             "success": True,
-            "filename": filename,
-            "url": f"/uploads/{filename}",
+            "filename": stored["filename"],
+            "url": f"/uploads/{stored['filename']}",
+            "size": stored["size"],
+            "type": stored["type"],
+            "duplicate": stored["duplicate"],
+            "variants": {str(width): f"/uploads/{name}" for width, name in stored["variants"].items()},
             "message": "Image uploaded successfully"
         })
-        
+    
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error uploading image: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 @app.get("/uploads/{filename}")
-async def get_uploaded_image(filename: str):
-    """Serve uploaded images."""
-    file_path = UPLOADS_DIR / filename
-    if not file_path.exists():
+async def get_uploaded_image(request: Request, filename: str):
+    """Serve uploaded images; content-addressed names are cached as immutable."""
+    found = await run_in_threadpool(upload_store.resolve, filename)
+    if found is None:
         raise HTTPException(status_code=404, detail="Image not found")
-    return FileResponse(file_path)
+    path, media_type, immutable = found
+    if immutable:
+        return file_response(request, path, media_type, IMMUTABLE_CACHE_CONTROL, etag=f'"{Path(filename).stem}"')
+    return file_response(request, path, media_type, "public, max-age=300, must-revalidate")
 
 # Error handlers
 @app.exception_handler(404)
@@ -461,12 +1222,29 @@ async def startup_event():
         logger.warning("OpenAI API key not set - chat functionality will not work")
     elif MODEL_PROVIDER == "ollama":
         logger.info(f"Ollama base URL: {OLLAMA_BASE_URL}")
+    if FALLBACK_PROVIDER:
+        logger.info(f"Fallback provider: {FALLBACK_PROVIDER} (hedged requests enabled)")
+    if LOOP_LAG_MONITOR:
+        loop_monitor.start()
+    if "ollama" in generation_router.order and OLLAMA_PRELOAD:
+        # In the background: loading a large model can take a while
+        asyncio.create_task(ollama_model.preload(PREFIX_MESSAGES))
+    if WARM_CACHE:
+        await run_in_threadpool(warm_caches.load)
+        warm_caches.start()
+    if folder_watcher.dirs:
+        folder_watcher.on_change = _invalidate_answers
+        await run_in_threadpool(folder_watcher.start)
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on application shutdown."""
     logger.info("Shutting down RAG Chatbot API...")
+    loop_monitor.stop()
+    await run_in_threadpool(folder_watcher.stop)
+    if WARM_CACHE:
+        await run_in_threadpool(warm_caches.stop)
 
 if __name__ == "__main__":
     import uvicorn
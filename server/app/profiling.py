@@ -0,0 +1,278 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+import tracemalloc
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+# CPU profile limits (seconds) and default sampling interval (ms)
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Frames kept per allocation traceback while tracemalloc is running
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "25"))
+
+# Event-loop lag monitor: heartbeat interval and the lag that triggers a stack dump
+LOOP_LAG_MONITOR = os.getenv("LOOP_LAG_MONITOR", "true").lower() == "true"
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "250"))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _collapse(frame) -> str:
+    """Root-first, ';'-joined stack of a frame (folded flamegraph format)."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def sample_cpu(seconds: float, interval_ms: float = PROFILE_INTERVAL_MS) -> Dict[str, Any]:
+    """
+    Sample the stacks of every thread for a while.
+
+    Wall-clock sampling of sys._current_frames(): cheap, needs no
+    instrumentation, and shows threads blocked in C code (torch, SQLite)
+    as well as Python. Run it in a worker thread; it blocks for `seconds`.
+
+    Returns:
+        Dict with the folded stacks ("thread;frame;frame count" lines),
+        sample count and duration
+    """
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    interval = max(interval_ms, 1) / 1000
+    own_id = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks: Counter = Counter()
+    samples = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            name = names.get(thread_id)
+            if name is None:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                name = names.get(thread_id, str(thread_id))
+            stacks[f"{name};{_collapse(frame)}"] += 1
+        samples += 1
+        time.sleep(interval)
+    folded = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+    return {"folded": folded, "samples": samples, "seconds": seconds, "interval_ms": interval * 1000}
+
+
+class MemoryProfiler:
+    """tracemalloc snapshots on demand, with diffs against the previous snapshot."""
+
+    def __init__(self):
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = TRACEMALLOC_FRAMES) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            logger.warning(f"tracemalloc started ({frames} frames); allocations are slower until it is stopped")
+
+    def stop(self) -> None:
+        with self._lock:
+            tracemalloc.stop()
+            self._previous = None
+
+    def _take(self) -> tracemalloc.Snapshot:
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running; start it first")
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+
+    def snapshot(self, limit: int = 30) -> Dict[str, Any]:
+        """Top allocation sites now, and the folded traceback view for a flamegraph."""
+        with self._lock:
+            snapshot = self._take()
+            self._previous = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        top = snapshot.statistics("lineno")[:limit]
+        folded = Counter()
+        for stat in snapshot.statistics("traceback"):
+            frames = [f"{os.path.basename(f.filename)}:{f.lineno}" for f in stat.traceback]
+            folded[";".join(reversed(frames))] += stat.size
+        return {
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "top": [{"site": str(stat.traceback), "size_bytes": stat.size, "count": stat.count} for stat in top],
+            "folded": "\n".join(f"{stack} {size}" for stack, size in folded.most_common()) + "\n",
+        }
+
+    def diff(self, limit: int = 30) -> Dict[str, Any]:
+        """Allocation growth since the previous snapshot (which this replaces)."""
+        with self._lock:
+            snapshot = self._take()
+            previous, self._previous = self._previous, snapshot
+        if previous is None:
+            return {"error": "No previous snapshot; this one is the baseline"}
+        changes = snapshot.compare_to(previous, "lineno")[:limit]
+        return {
+            "top": [
+                {"site": str(stat.traceback), "size_diff_bytes": stat.size_diff, "size_bytes": stat.size,
+                 "count_diff": stat.count_diff}
+                for stat in changes
+            ]
+        }
+
+
+class InferenceStats:
+    """Call counts and latency percentiles of the local models (embedder, reranker)."""
+
+    def __init__(self, window: int = 500):
+        self._latencies: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._items: Counter = Counter()
+        self._calls: Counter = Counter()
+
+    @contextmanager
+    def timed(self, model: str, items: int = 1) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._latencies[model].append(time.perf_counter() - started)
+            self._calls[model] += 1
+            self._items[model] += items
+
+    def snapshot(self) -> Dict[str, Any]:
+        stats = {}
+        for model, window in list(self._latencies.items()):
+            values = sorted(window)
+            pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 1) if values else None
+            stats[model] = {
+                "calls": self._calls[model],
+                "items": self._items[model],
+                "p50_ms": pick(0.50),
+                "p95_ms": pick(0.95),
+                "max_ms": round(values[-1] * 1000, 1) if values else None,
+            }
+        return stats
+
+
+class LoopLagMonitor:
+    """
+    Detect a blocked event loop and log what it is stuck in.
+
+    A coroutine on the loop stamps a heartbeat every LOOP_LAG_INTERVAL; a
+    watchdog thread notices when the heartbeat stalls past the threshold
+    and logs the loop thread's current stack — the callback blocking it.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold_ms: float = LOOP_LAG_THRESHOLD_MS):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.lags: deque = deque(maxlen=1000)
+        self.stalls = 0
+        self.recent_stalls: deque = deque(maxlen=20)
+        self._heartbeat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    async def _beat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lags.append(max(now - expected, 0))
+            self._heartbeat = now
+
+    def _watch(self) -> None:
+        reported = False
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._heartbeat
+            if stalled < self.threshold + self.interval:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>"
+            self.stalls += 1
+            self.recent_stalls.append({"at": time.time(), "stalled_ms": round(stalled * 1000, 1), "stack": stack})
+            logger.warning(f"Event loop blocked for {stalled * 1000:.0f} ms", extra={"fields": {"stack": stack}})
+
+    def start(self) -> None:
+        """Start on the running loop (call from a startup handler)."""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        lags = sorted(self.lags)
+        pick = lambda q: round(lags[min(len(lags) - 1, int(q * len(lags)))] * 1000, 1) if lags else None
+        return {
+            "running": self._task is not None,
+            "lag_p50_ms": pick(0.50),
+            "lag_p99_ms": pick(0.99),
+            "lag_max_ms": round(lags[-1] * 1000, 1) if lags else None,
+            "stalls": self.stalls,
+            "threshold_ms": self.threshold * 1000,
+            "recent_stalls": list(self.recent_stalls),
+        }
+
+
+def torch_threads() -> Dict[str, Any]:
+    """Torch intra-/inter-op thread settings (None when torch is not loaded)."""
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return {"loaded": False}
+    return {
+        "loaded": True,
+        "intra_op_threads": torch.get_num_threads(),
+        "inter_op_threads": torch.get_num_interop_threads(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def process_stats() -> Dict[str, Any]:
+    """Threads, peak RSS and GC counters of this worker."""
+    import gc
+    stats: Dict[str, Any] = {
+        "pid": os.getpid(),
+        "threads": threading.active_count(),
+        "thread_names": sorted(Counter(t.name.rstrip("0123456789_-") for t in threading.enumerate()).items()),
+        "gc_counts": gc.get_count(),
+    }
+    try:
+        import resource
+        # ru_maxrss is KiB on Linux
+        stats["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        pass
+    return stats
+
+
+memory_profiler = MemoryProfiler()
+inference_stats = InferenceStats()
+loop_monitor = LoopLagMonitor()
@@ -0,0 +1,78 @@
+import json
+import hashlib
+from typing import Any, Dict, List, Optional
+
+# Static head of every chat request. It must stay byte-identical between
+# requests (no dates, ids or per-request text) so providers can reuse the
+# computation for it: OpenAI prompt caching matches on the exact prefix,
+# and Ollama keeps the KV cache of the tokens a new prompt shares with the
+# previous one. Everything that varies goes in the final user message.
+SYSTEM_PROMPT = (
+    "You are a friendly Vision Flows Agency teammate.\n\n"
+    "RULES\n"
+    "- Use ONLY the Context in the user's message. If missing, say what's missing and ask 1 targeted question.\n"
+    "- Keep answers short: 60–100 words total. Max 4 bullets. No intro phrases or summaries.\n"
+    "- Format lists with \"• \"; one idea per line; no tables unless asked.\n"
+    "- If asked about pricing/timeline/scope: ask 1 scoping question, then give a clear next step "
+    "(book call, custom quote, or starter package).\n"
+    "- Do not repeat yourself or restate the question.\n"
+    "- End every reply with the token: <END>"
+)
+
+# Few-shot examples, sent as prior turns after the system prompt
+FEW_SHOT = [
+    (
+        "Do you build Shopify stores? What's the cost?",
+        "• Yes—Shopify setup, payments, products, and basic design\n"
+        "• Typical range: $1,500–$3,500; varies by catalog size and integrations\n"
+        "• Share product count + must-have apps, and I'll confirm a package or custom quote\n"
+        "<END>"
+    ),
+    (
+        "Can you add a website chatbot?",
+        "• We install a site + Instagram chatbot for FAQs, leads, and simple booking\n"
+        "• Setup: $500–$1,500; ongoing from $150–$300/mo based on features\n"
+        "• Do you want lead qualification, calendar booking, or handoff to a human?\n"
+        "<END>"
+    ),
+]
+
+PREFIX_MESSAGES: List[Dict[str, str]] = [{"role": "system", "content": SYSTEM_PROMPT}]
+for _question, _answer in FEW_SHOT:
+    PREFIX_MESSAGES += [{"role": "user", "content": _question}, {"role": "assistant", "content": _answer}]
+
+# Identifies the prefix (OpenAI prompt_cache_key, stats); changes whenever it does
+PREFIX_ID = hashlib.sha256(json.dumps(PREFIX_MESSAGES).encode("utf-8")).hexdigest()[:12]
+
+
+def build_messages(prompt: str, system: Optional[str] = None) -> List[Dict[str, str]]:
+    """
+    Chat messages for a prompt: the static prefix, then the prompt as the last user turn.
+
+    A custom `system` (e.g. query rewriting) replaces the whole prefix.
+    """
+    if system is not None:
+        return [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+    return PREFIX_MESSAGES + [{"role": "user", "content": prompt}]
+
+
+def make_prompt(user_msg: str, contexts: List[Dict[str, Any]]) -> str:
+    """Create the variable part of the prompt: retrieved context, then the question."""
+    if not contexts:
+        return f"Context: No relevant documents found.\n\nQuestion: {user_msg}\n\nAnswer: I don't have enough information to answer your question. Please provide more context or ask about something else."
+
+    # Format context with short, titled chunks (following GPT's recommendation)
+    context_chunks = []
+    for context in contexts:
+        # Extract section title if available, otherwise use source
+        source = context.get("metadata", {}).get("source", "document")
+        section_title = context.get("metadata", {}).get("section_title", "")
+
+        if section_title:
+            context_chunks.append(f"{section_title}:\n{context['text']}")
+        else:
+            context_chunks.append(f"{source}:\n{context['text']}")
+
+    context_blob = "\n\n".join(context_chunks)
+
+    return f"Context:\n{context_blob}\n\nQuestion: {user_msg}\n\nAnswer:"
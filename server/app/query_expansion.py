@@ -0,0 +1,114 @@
+import os
+import re
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+# Query expansion before dense retrieval: "off", "template" (offline keyword
+# rewrites) or "llm" (a short rewrite call to the generation provider)
+QUERY_EXPANSION = os.getenv("QUERY_EXPANSION", "off").lower()
+# Rewrites per query, and the longest query (in words) that gets expanded
+QUERY_EXPANSION_MAX = int(os.getenv("QUERY_EXPANSION_MAX", "3"))
+QUERY_EXPANSION_MAX_WORDS = int(os.getenv("QUERY_EXPANSION_MAX_WORDS", "8"))
+# Optional JSON file of extra {"term": ["synonym", ...]} entries
+QUERY_SYNONYMS_FILE = os.getenv("QUERY_SYNONYMS_FILE", "")
+
+_STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "do", "does", "did", "you", "your", "we", "our",
+    "i", "me", "my", "can", "could", "would", "should", "will", "what", "whats", "how", "much", "many",
+    "which", "who", "when", "where", "why", "to", "of", "for", "in", "on", "at", "with", "about", "and",
+    "or", "it", "its", "this", "that", "there", "any", "have", "has", "please", "tell",
+}
+
+# Phrasings customers use for the same thing as the documents
+_SYNONYMS: Dict[str, List[str]] = {
+    "pricing": ["price", "cost", "rates", "packages"],
+    "price": ["pricing", "cost", "rates"],
+    "cost": ["price", "pricing", "fees"],
+    "timeline": ["turnaround time", "how long it takes", "delivery schedule"],
+    "contact": ["email", "phone", "book a call"],
+    "services": ["what we offer", "capabilities", "packages"],
+    "support": ["maintenance", "help", "ongoing support"],
+    "refund": ["money back", "cancellation policy"],
+    "hours": ["opening hours", "availability"],
+    "chatbot": ["chat bot", "website assistant", "AI agent"],
+    "website": ["web design", "site build"],
+}
+
+_WORD_RE = re.compile(r"[a-z0-9][a-z0-9'+-]*")
+
+
+def _load_synonyms() -> Dict[str, List[str]]:
+    synonyms = {term: list(values) for term, values in _SYNONYMS.items()}
+    if QUERY_SYNONYMS_FILE and Path(QUERY_SYNONYMS_FILE).exists():
+        try:
+            with open(QUERY_SYNONYMS_FILE, 'r', encoding='utf-8') as f:
+                for term, values in json.load(f).items():
+                    synonyms.setdefault(term.lower(), []).extend(values)
+        except Exception as e:
+            logger.error(f"Error loading query synonyms: {str(e)}")
+    return synonyms
+
+
+SYNONYMS = _load_synonyms()
+
+
+def keywords(query: str) -> List[str]:
+    """Content words of a query, in order, without stopwords."""
+    return [w for w in _WORD_RE.findall(query.lower()) if w not in _STOPWORDS]
+
+
+def template_expansions(query: str, max_rewrites: int = QUERY_EXPANSION_MAX) -> List[str]:
+    """
+    Cheap offline rewrites of a short query.
+
+    "pricing?" becomes e.g. ["price", "cost", "pricing details"]: synonym
+    substitutions first, then a keyword-only form and a descriptive
+    template. Long queries are left alone since they already embed well.
+    """
+    words = keywords(query)
+    if not words or len(query.split()) > QUERY_EXPANSION_MAX_WORDS:
+        return []
+    base = " ".join(words)
+    candidates = []
+    for i, word in enumerate(words):
+        for synonym in SYNONYMS.get(word, []):
+            candidates.append(" ".join(words[:i] + [synonym] + words[i + 1:]))
+    candidates.append(base)
+    candidates.append(f"{base} details")
+
+    seen = {" ".join(query.lower().split())}
+    rewrites = []
+    for candidate in candidates:
+        if candidate not in seen:
+            seen.add(candidate)
+            rewrites.append(candidate)
+        if len(rewrites) >= max_rewrites:
+            break
+    return rewrites
+
+
+REWRITE_PROMPT = (
+    "Rewrite the customer question below into {n} short alternative search queries "
+    "for a company knowledge base. Use different wording and likely document terms. "
+    "Return one query per line, nothing else.\n\nQuestion: {question}"
+)
+
+
+def parse_rewrites(text: str, question: str, max_rewrites: int = QUERY_EXPANSION_MAX) -> List[str]:
+    """Clean an LLM rewrite response into a list of distinct queries."""
+    seen = {" ".join(question.lower().split())}
+    rewrites = []
+    for line in text.splitlines():
+        line = re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip().strip('"')
+        key = " ".join(line.lower().split())
+        if line and key not in seen and len(line) <= 200:
+            seen.add(key)
+            rewrites.append(line)
+        if len(rewrites) >= max_rewrites:
+            break
+    return rewrites
@@ -1,12 +1,46 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional, Tuple, NamedTuple
 import os
+import re
+import time
+import shutil
+import sqlite3
+import hashlib
 import logging
+import threading
+import contextvars
+from abc import ABC, abstractmethod
+from array import array
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
+from collections import OrderedDict
+
+import chromadb
+from chromadb.config import Settings as ChromaSettings
 from langchain_chroma import Chroma
 from langchain.docstore.document import Document
 from FlagEmbedding import FlagReranker
 from langchain_huggingface import HuggingFaceEmbeddings
 
+from .tenants import DEFAULT_TENANT, current_tenant, use_tenant
+from .vector_index import MmapVectorIndex, build_index, VECTOR_DTYPE
+from .query_expansion import QUERY_EXPANSION, QUERY_EXPANSION_MAX, template_expansions
+from .diversity import (
+    RETRIEVAL_DIVERSITY, MMR_LAMBDA, MMR_FETCH_FACTOR, NEAR_DUPLICATE_SIMILARITY, SIMHASH_MAX_DISTANCE, diversify,
+    fetch_size
+)
+from .logging_setup import stage
+from .sources import SourceStore, SourceRegistry, SOURCES_DB, expand_metadata
+from .filters import SearchFilter, compile_filters, filter_key, RETRIEVAL_FILTER_MODE, FILTER_OVERFETCH
+from .cache import TTLCache
+from .warm_cache import warm_caches
+from .versions import CollectionPointers, WriteStamps, POINTERS_FILE, WRITE_STAMPS_DIR, base_of
+from .inference import (
+    configure_torch, embed_pool, rerank_pool, PooledEmbeddings, set_embed_max_length,
+    EMBED_BATCH_SIZE, EMBED_MAX_LENGTH, RERANK_BATCH_SIZE, RERANK_MAX_LENGTH
+)
+
 # Get logger from package
 logger = logging.getLogger(__name__)
 
@@ -17,66 +51,695 @@ EMBED_MODEL_NAME = os.getenv("EMBED_MODEL", "BAAI/bge-small-en-v1.5")
 CHROMA_DIR = os.getenv("CHROMA_DIR", "./chroma_db")
 COLLECTION_NAME = os.getenv("COLLECTION", "docs")
 
-# Initialize embeddings with normalization for better similarity search
-embeddings = HuggingFaceEmbeddings(
+# Cap torch's thread pools before the models are loaded
+configure_torch()
+
+# Initialize embeddings with normalization for better similarity search;
+# every embedding call (queries and ingestion) runs on the embedder pool
+_embedder = HuggingFaceEmbeddings(
     model_name=EMBED_MODEL_NAME, 
-    encode_kwargs={"normalize_embeddings": True}
+    encode_kwargs={"normalize_embeddings": True, "batch_size": EMBED_BATCH_SIZE}
 )
+set_embed_max_length(_embedder, EMBED_MAX_LENGTH)
+embeddings = PooledEmbeddings(_embedder, embed_pool)
+
+# Other embedding models, loaded when a collection built with one is opened
+_embedding_models: Dict[str, PooledEmbeddings] = {EMBED_MODEL_NAME: embeddings}
+_embedding_models_lock = threading.Lock()
+
+
+def get_embeddings(model_name: Optional[str] = None) -> PooledEmbeddings:
+    """Embeddings for a model name (default: EMBED_MODEL), loading it on first use."""
+    model_name = model_name or EMBED_MODEL_NAME
+    with _embedding_models_lock:
+        model = _embedding_models.get(model_name)
+        if model is None:
+            logger.info(f"Loading embedding model: {model_name}")
+            embedder = HuggingFaceEmbeddings(
+                model_name=model_name,
+                encode_kwargs={"normalize_embeddings": True, "batch_size": EMBED_BATCH_SIZE}
+            )
+            set_embed_max_length(embedder, EMBED_MAX_LENGTH)
+            model = _embedding_models[model_name] = PooledEmbeddings(embedder, embed_pool)
+        return model
+
+
+def collection_embed_model(collection) -> str:
+    """Embedding model a collection was built with (collections from before versioning: EMBED_MODEL)."""
+    return (collection.metadata or {}).get("embed_model") or EMBED_MODEL_NAME
+
+# Tenant store handles kept open; Chroma segment memory budget (0 = unlimited)
+TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "32"))
+CHROMA_MEMORY_LIMIT_BYTES = int(os.getenv("CHROMA_MEMORY_LIMIT_BYTES", "0"))
+
+# Collection maintenance configuration
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "500"))
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "./chroma_snapshots")
+
+# Serializes writes against maintenance operations that replace collection files
+maintenance_lock = threading.RLock()
+
+# Source documents (stored once, referenced by source_id from each chunk)
+source_store = SourceStore(Path(CHROMA_DIR) / SOURCES_DB)
+
+# Active version of each collection, switched by blue/green reindexing (see reindex.py)
+collection_pointers = CollectionPointers(Path(CHROMA_DIR) / POINTERS_FILE)
+
+# Write token of each collection, shared by workers (see versions.WriteStamps)
+write_stamps = WriteStamps(Path(CHROMA_DIR) / WRITE_STAMPS_DIR)
+
+# Search backend: "chroma" (query the collection directly) or "mmap" (an
+# in-process read replica of each collection under VECTOR_INDEX_DIR)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "./vector_index")
+
+
+def _open_client():
+    """
+    Open the persistent Chroma client shared by every tenant collection.
+    
+    With CHROMA_MEMORY_LIMIT_BYTES set, Chroma's LRU segment cache unloads
+    the HNSW indexes of idle collections once the limit is reached.
+    """
+    settings = ChromaSettings(anonymized_telemetry=False)
+    if CHROMA_MEMORY_LIMIT_BYTES > 0:
+        settings.chroma_segment_cache_policy = "LRU"
+        settings.chroma_memory_limit_bytes = CHROMA_MEMORY_LIMIT_BYTES
+    return chromadb.PersistentClient(path=CHROMA_DIR, settings=settings)
+
+
+def base_collection_name(tenant: Optional[str] = None) -> str:
+    """Logical collection name of a tenant (what its versions are named after)."""
+    tenant = tenant or current_tenant()
+    return COLLECTION_NAME if tenant == DEFAULT_TENANT else f"{COLLECTION_NAME}__{tenant}"
+
+
+def collection_name_for(tenant: Optional[str] = None) -> str:
+    """Chroma collection that holds a tenant's documents (the active version)."""
+    return collection_pointers.active(base_collection_name(tenant))
+
+
+def _restore_retired(name: str):
+    """Put back a collection that a compaction renamed aside but did not replace (crash mid-swap)."""
+    try:
+        retired = _client.get_collection(f"{name}.retired")
+    except Exception:
+        return None
+    retired.modify(name=name)
+    logger.warning(f"Restored collection {name} left aside by an interrupted compaction")
+    return retired
+
+
+def _open_vectorstore(tenant: str, create: bool = True) -> Optional[Chroma]:
+    """
+    Open the LangChain store for a tenant on the shared client, with its collection's embedding model.
+
+    A missing collection is created only when `create` is set; otherwise None is returned.
+    """
+    name = collection_name_for(tenant)
+    try:
+        model_name = collection_embed_model(_client.get_collection(name))
+    except Exception:
+        restored = _restore_retired(name)
+        if restored is None and not create:
+            return None
+        model_name = collection_embed_model(restored) if restored is not None else EMBED_MODEL_NAME
+    return Chroma(
+        client=_client,
+        collection_name=name, 
+        embedding_function=get_embeddings(model_name)
+    )
+
+
+# Shared client; tenant stores are opened lazily and kept in LRU order
+_client = _open_client()
+_stores: "OrderedDict[str, Chroma]" = OrderedDict()
+_stores_lock = threading.Lock()
+
+
+def get_vectorstore(tenant: Optional[str] = None, create: bool = True) -> Optional[Chroma]:
+    """
+    Return the vector store of a tenant (default: the current request's).
+    
+    Handles are opened on first use and the least recently used ones are
+    dropped beyond TENANT_CACHE_SIZE; the default tenant is never evicted.
+    A handle is reopened when another collection version became active.
+    Read paths pass create=False and get None for a tenant without a
+    collection, so requests naming new tenants don't create collections.
+    """
+    tenant = tenant or current_tenant()
+    name = collection_name_for(tenant)
+    with _stores_lock:
+        store = _stores.get(tenant)
+        if store is not None and store._collection.name == name:
+            _stores.move_to_end(tenant)
+            return store
+        store = _open_vectorstore(tenant, create)
+        if store is None:
+            return None
+        _stores[tenant] = store
+        while len(_stores) > TENANT_CACHE_SIZE:
+            evicted = next((t for t in _stores if t != DEFAULT_TENANT), None)
+            if evicted is None:
+                break
+            del _stores[evicted]
+            logger.info(f"Evicted vector store handle for tenant: {evicted}")
+        return store
+
+
+def _forget_vectorstore(tenant: Optional[str] = None) -> None:
+    """Drop a cached store handle so the next access reopens it."""
+    with _stores_lock:
+        _stores.pop(tenant or current_tenant(), None)
+
+
+def _reopen_client() -> None:
+    """Reopen the shared client (after the files under CHROMA_DIR were replaced)."""
+    global _client
+    with _stores_lock:
+        _stores.clear()
+        _client = _open_client()
+
+
+def current_embeddings() -> PooledEmbeddings:
+    """Embedding model of the current tenant's active collection."""
+    return get_vectorstore().embeddings
+
+
+def list_tenant_collections() -> List[Dict[str, Any]]:
+    """List tenant collections (their active versions) with their chunk counts."""
+    prefix = f"{COLLECTION_NAME}__"
+    names = {getattr(collection, "name", collection) for collection in _client.list_collections()}
+    tenants = []
+    for base in sorted({base_of(name) for name in names}):
+        if base == COLLECTION_NAME:
+            tenant = DEFAULT_TENANT
+        elif base.startswith(prefix) and "." not in base[len(prefix):]:
+            tenant = base[len(prefix):]
+        else:
+            continue
+        name = collection_pointers.active(base)
+        if name not in names:
+            continue
+        tenants.append({
+            "tenant": tenant,
+            "collection_name": name,
+            "document_count": _client.get_collection(name).count()
+        })
+    return tenants
+
+
+class SearchHit(NamedTuple):
+    """One search result; distance is on Chroma's scale (lower is closer)."""
+    id: str
+    text: str
+    metadata: Dict[str, Any]
+    distance: float
+    # Stored embedding, returned when the diversity stage needs it
+    embedding: Optional[List[float]] = None
+
+
+class VectorSearch(ABC):
+    """Nearest-neighbour search over the current tenant's collection."""
+
+    name = "base"
+
+    @abstractmethod
+    def search_by_vector(self, vector: List[float], k: int, with_embeddings: bool = False,
+                         where: Optional[Dict[str, Any]] = None) -> List[SearchHit]:
+        """The k nearest chunks, restricted to chunks matching a Chroma `where` clause if given."""
+
+    def search(self, query: str, k: int) -> List[SearchHit]:
+        return self.search_by_vector(current_embeddings().embed_query(query), k)
+
+    def invalidate(self, tenant: Optional[str] = None) -> None:
+        """Called after a tenant's collection was written to."""
+
+    def invalidate_all(self) -> None:
+        """Called after the whole store was replaced."""
+
+    def info(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class ChromaSearch(VectorSearch):
+    """Search the tenant's Chroma collection (Chroma's own HNSW index)."""
+
+    name = "chroma"
+
+    def search_by_vector(self, vector: List[float], k: int, with_embeddings: bool = False,
+                         where: Optional[Dict[str, Any]] = None) -> List[SearchHit]:
+        # Query the collection directly: ids are needed to merge result lists
+        include = ["documents", "metadatas", "distances"] + (["embeddings"] if with_embeddings else [])
+        results = get_vectorstore()._collection.query(query_embeddings=[vector], n_results=k, where=where,
+                                                      include=include)
+        vectors = results["embeddings"][0] if with_embeddings else [None] * len(results["ids"][0])
+        return [
+            SearchHit(chunk_id, text, metadata or {}, float(distance), embedding)
+            for chunk_id, text, metadata, distance, embedding in zip(
+                results["ids"][0], results["documents"][0], results["metadatas"][0],
+                results["distances"][0], vectors
+            )
+        ]
+
+
+class MmapSearch(VectorSearch):
+    """
+    Search an in-process copy of each collection (see vector_index.py).
+    
+    Chroma stays the store of record: every write, from any worker, changes
+    the collection's write stamp, an index built from an older stamp is
+    stale, and stale or missing indexes are rebuilt in the background from
+    the stored embeddings while queries fall back to Chroma. Filtered
+    queries also go to Chroma, which applies the where-clause during its
+    search (the mmap index holds no metadata to filter on).
+    """
+
+    name = "mmap"
+
+    def __init__(self, root: str = VECTOR_INDEX_DIR, dtype: str = VECTOR_DTYPE):
+        self.root = Path(root)
+        self.dtype = dtype
+        self.fallback = ChromaSearch()
+        self._indexes: "OrderedDict[str, MmapVectorIndex]" = OrderedDict()
+        self._stale = set()
+        self._building = set()
+        # Indexes on disk built before this time predate a store restore
+        self._valid_after: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def index_dir(self, tenant: Optional[str] = None) -> Path:
+        return self.root / collection_name_for(tenant)
+
+    def _load(self, tenant: str) -> Optional[MmapVectorIndex]:
+        """Open a tenant's index from disk if it matches the collection."""
+        directory = self.index_dir(tenant)
+        if not (directory / "manifest.json").exists():
+            return None
+        try:
+            index = MmapVectorIndex(directory)
+        except Exception as e:
+            logger.warning(f"Could not open vector index {directory}: {str(e)}")
+            return None
+        built_at = index.manifest.get("built_at", "")
+        if (self._valid_after and built_at < self._valid_after) or \
+                index.write_stamp != write_stamps.current(directory.name) or \
+                index.source_count != get_vectorstore(tenant)._collection.count():
+            logger.info(f"Vector index {directory} is out of date")
+            return None
+        return index
+
+    def _index(self) -> Optional[MmapVectorIndex]:
+        """The current tenant's index, or None (scheduling a rebuild) if unavailable."""
+        tenant = current_tenant()
+        name = collection_name_for(tenant)
+        stamp = write_stamps.current(name)
+        with self._lock:
+            index = self._indexes.get(tenant)
+            if index is not None and index.directory.name != name:
+                # Another collection version was swapped in
+                del self._indexes[tenant]
+                index = None
+            if index is not None and index.write_stamp != stamp:
+                # Written to since the index was built (possibly by another worker)
+                self._stale.add(tenant)
+            if index is not None and tenant not in self._stale:
+                self._indexes.move_to_end(tenant)
+                return index
+            if tenant in self._building:
+                return None
+        if tenant not in self._stale:
+            index = self._load(tenant)
+            if index is not None:
+                with self._lock:
+                    self._indexes[tenant] = index
+                    while len(self._indexes) > TENANT_CACHE_SIZE:
+                        self._indexes.popitem(last=False)
+                return index
+        self._schedule_rebuild(tenant)
+        return None
+
+    def _schedule_rebuild(self, tenant: str) -> None:
+        with self._lock:
+            if tenant in self._building:
+                return
+            self._building.add(tenant)
+        threading.Thread(target=self._rebuild_in_background, args=(tenant,),
+                         name=f"vector-index-{tenant}", daemon=True).start()
+
+    def _rebuild_in_background(self, tenant: str) -> None:
+        try:
+            self.rebuild(tenant)
+        except Exception as e:
+            logger.error(f"Error rebuilding vector index for tenant {tenant}: {str(e)}")
+        finally:
+            with self._lock:
+                self._building.discard(tenant)
+
+    def rebuild(self, tenant: Optional[str] = None, batch_size: int = MAINTENANCE_BATCH_SIZE) -> Dict[str, Any]:
+        """Rebuild a tenant's index from the embeddings stored in Chroma."""
+        tenant = tenant or current_tenant()
+        with use_tenant(tenant), maintenance_lock:
+            collection = get_vectorstore(tenant)._collection
+            with self._lock:
+                self._stale.discard(tenant)
+            # Read before copying: a write during the copy leaves the index stale
+            stamp = write_stamps.current(collection.name)
+            manifest = build_index(
+                self.index_dir(tenant),
+                _iter_records(collection, batch_size),
+                space=(collection.metadata or {}).get("hnsw:space", "l2"),
+                dtype=self.dtype,
+                source_count=collection.count(),
+                write_stamp=stamp
+            )
+            index = MmapVectorIndex(self.index_dir(tenant))
+        with self._lock:
+            self._indexes[tenant] = index
+        return manifest
+
+    def search_by_vector(self, vector: List[float], k: int, with_embeddings: bool = False,
+                         where: Optional[Dict[str, Any]] = None) -> List[SearchHit]:
+        index = None if where is not None else self._index()
+        if index is None:
+            return self.fallback.search_by_vector(vector, k, with_embeddings, where)
+        hits = []
+        for row, distance in index.search(vector, k):
+            chunk_id, text, metadata = index.record(row)
+            embedding = index.vector(row) if with_embeddings else None
+            hits.append(SearchHit(chunk_id, text, metadata, distance, embedding))
+        return hits
+
+    def invalidate(self, tenant: Optional[str] = None) -> None:
+        with self._lock:
+            self._stale.add(tenant or current_tenant())
+
+    def invalidate_all(self) -> None:
+        with self._lock:
+            self._valid_after = datetime.now().isoformat()
+            self._stale.update(self._indexes)
+            self._indexes.clear()
+
+    def info(self) -> Dict[str, Any]:
+        tenant = current_tenant()
+        with self._lock:
+            index = self._indexes.get(tenant)
+            state = {
+                "backend": self.name,
+                "stale": tenant in self._stale,
+                "building": tenant in self._building,
+            }
+        state["index"] = index.info() if index is not None else None
+        return state
+
+
+def _iter_records(collection, batch_size: int):
+    """Page through a collection with its stored embeddings."""
+    offset = 0
+    while True:
+        batch = collection.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=batch_size,
+            offset=offset
+        )
+        if not batch["ids"]:
+            break
+        yield batch
+        offset += len(batch["ids"])
+
+
+def _open_search_backend() -> VectorSearch:
+    if VECTOR_BACKEND == "mmap":
+        return MmapSearch()
+    if VECTOR_BACKEND != "chroma":
+        logger.warning(f"Unknown VECTOR_BACKEND {VECTOR_BACKEND!r}, using chroma")
+    return ChromaSearch()
+
+
+search_backend = _open_search_backend()
+
+
+# Writes made by this worker per physical collection (reindexing checks
+# that the live collection did not change while it built the new one)
+_write_counts: Dict[str, int] = {}
+
+
+def notify_collection_changed(tenant: Optional[str] = None) -> None:
+    """Tell the search backend (and the retrieval cache) that a tenant's collection was written to."""
+    name = collection_name_for(tenant)
+    _write_counts[name] = _write_counts.get(name, 0) + 1
+    write_stamps.bump(name)
+    search_backend.invalidate(tenant)
+    retrieval_cache.clear()
+
+
+def write_count(collection_name: str) -> int:
+    return _write_counts.get(collection_name, 0)
 
-# Lazy-init Chroma store (collections auto-created on first add)
-vectorstore = Chroma(
-    collection_name=COLLECTION_NAME, 
-    embedding_function=embeddings, 
-    persist_directory=CHROMA_DIR
-)
 
 # Local reranker (cross-encoder) for improving retrieval quality
-reranker = FlagReranker(os.getenv("RERANK_MODEL", "BAAI/bge-reranker-base"))
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL", "BAAI/bge-reranker-base")
+reranker = FlagReranker(RERANK_MODEL_NAME)
+
+# Hot-path caches, snapshotted by warm_caches so restarts start warm:
+# query embeddings by (model, text), cross-encoder scores by (query, passage
+# hash) and reranked results by collection write stamp and request
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "5000"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2000"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "900"))
+
+query_embedding_cache = TTLCache(QUERY_EMBED_CACHE_SIZE)
+rerank_cache = TTLCache(RERANK_CACHE_SIZE)
+retrieval_cache = TTLCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL)
+
+
+def collection_version(name: str) -> Optional[str]:
+    """Content version of a physical collection (chunk count and source rows), None if it is gone."""
+    try:
+        count = _client.get_collection(name).count()
+    except Exception:
+        return None
+    return f"{count}:{source_store.fingerprint(name)}"
+
+
+def retrieval_signature() -> Dict[str, Any]:
+    """Models and settings that reranked results depend on (besides the collection itself)."""
+    return {
+        "rerank_model": RERANK_MODEL_NAME, "rerank_max_length": RERANK_MAX_LENGTH,
+        "embed_max_length": EMBED_MAX_LENGTH, "backend": VECTOR_BACKEND,
+        "diversity": [RETRIEVAL_DIVERSITY, MMR_LAMBDA, MMR_FETCH_FACTOR, NEAR_DUPLICATE_SIMILARITY, SIMHASH_MAX_DISTANCE],
+        "expansion": [QUERY_EXPANSION, QUERY_EXPANSION_MAX], "filter_mode": [RETRIEVAL_FILTER_MODE, FILTER_OVERFETCH],
+    }
+
+
+def _pack_vector(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack_vector(data: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(data)
+    return vector.tolist()
+
+
+warm_caches.set_collection_version(collection_version)
+warm_caches.register("query_embeddings", query_embedding_cache, lambda: {"embed_max_length": EMBED_MAX_LENGTH},
+                     encode=_pack_vector, decode=_unpack_vector)
+warm_caches.register("rerank_scores", rerank_cache,
+                     lambda: {"model": RERANK_MODEL_NAME, "max_length": RERANK_MAX_LENGTH})
+warm_caches.register("retrieval", retrieval_cache, retrieval_signature, collection_of=lambda key: key[0])
 
 logger.info(f"RAG pipeline initialized with model: {EMBED_MODEL_NAME}")
 logger.info(f"Vector store: {CHROMA_DIR}")
-logger.info(f"Collection: {COLLECTION_NAME}")
+logger.info(f"Collection: {COLLECTION_NAME} (tenant collections: {COLLECTION_NAME}__<tenant>)")
+logger.info(f"Search backend: {search_backend.name}")
+
+
+def _rerank_scores(pairs: List[Tuple[str, str]], batch_size: int = RERANK_BATCH_SIZE) -> List[float]:
+    """Cross-encoder scores for (query, passage) pairs (only pairs not in rerank_cache are scored)."""
+    if not pairs:
+        return []
+    keys = [(query, hashlib.blake2b(passage.encode("utf-8"), digest_size=16).digest()) for query, passage in pairs]
+    cached = [rerank_cache.get(key) for key in keys]
+    missing = [i for i, score in enumerate(cached) if score is None]
+    if missing:
+        scores = rerank_pool.run(
+            reranker.compute_score, [pairs[i] for i in missing], batch_size=batch_size,
+            max_length=RERANK_MAX_LENGTH, items=len(missing)
+        )
+        # FlagReranker returns a bare float for a single pair
+        scores = [scores] if isinstance(scores, (int, float)) else list(scores)
+        for i, score in zip(missing, scores):
+            cached[i] = float(score)
+            rerank_cache.set(keys[i], cached[i])
+    return cached
+
+
+def _embed_queries(queries: List[str]) -> List[List[float]]:
+    """Embed queries with the current collection's model (only those not in query_embedding_cache)."""
+    model_name = collection_embed_model(get_vectorstore()._collection)
+    vectors = [query_embedding_cache.get((model_name, query)) for query in queries]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        model = current_embeddings()
+        if len(missing) == 1:
+            embedded = [model.embed_query(queries[missing[0]])]
+        else:
+            embedded = model.embed_documents([queries[i] for i in missing])
+        for i, vector in zip(missing, embedded):
+            vectors[i] = list(vector)
+            query_embedding_cache.set((model_name, queries[i]), vectors[i])
+    return vectors
+
+
+def _ranked_items(hits: List[SearchHit], rerank_scores: List[float]) -> List[Dict[str, Any]]:
+    """Combine search hits with rerank scores, best first."""
+    items = []
+    for hit, rr_score in zip(hits, rerank_scores):
+        items.append({
+            "id": hit.id,
+            "text": hit.text,
+            "metadata": hit.metadata,
+            "score": float(hit.distance),  # Similarity score from embeddings
+            "rerank_score": float(rr_score)  # Reranking score from cross-encoder
+        })
+    
+    # Sort by rerank score (higher is better)
+    items.sort(key=lambda x: x["rerank_score"], reverse=True)
+    return items
+
+
+def _attach_sources(items: List[Dict[str, Any]]) -> None:
+    """Join the source rows of the returned items into their metadata (one lookup for all)."""
+    source_ids = [item["metadata"]["source_id"] for item in items if "source_id" in item["metadata"]]
+    if not source_ids:
+        return
+    sources = source_store.get_many(source_ids)
+    for item in items:
+        item["metadata"] = expand_metadata(item["metadata"], sources)
+
+
+def _expansions_for(query: str) -> List[str]:
+    """Rewrites used when the caller doesn't supply any (template mode only)."""
+    return template_expansions(query) if QUERY_EXPANSION == "template" else []
 
 
-def retrieve(query: str, k: int = 8) -> List[Dict[str, Any]]:
+# Runs the searches of one query's rewrites side by side
+_search_pool = ThreadPoolExecutor(max_workers=QUERY_EXPANSION_MAX + 1, thread_name_prefix="search")
+
+
+def _search(vector: List[float], k: int, search_filter: Optional[SearchFilter] = None) -> List[SearchHit]:
     """
-    Dense retrieval via Chroma, then rerank with cross-encoder.
+    One vector search, with the filter pushed into it as a where-clause
+    (RETRIEVAL_FILTER_MODE=pre) or applied to an over-fetched result.
+    """
+    if search_filter is None:
+        return search_backend.search_by_vector(vector, k, RETRIEVAL_DIVERSITY)
+    if RETRIEVAL_FILTER_MODE == "post":
+        where, fetch = None, k * FILTER_OVERFETCH
+    else:
+        # Source ids beyond FILTER_MAX_SOURCE_IDS are checked after the search
+        where, fetch = search_filter.where, k * FILTER_OVERFETCH if search_filter.residual else k
+    hits = search_backend.search_by_vector(vector, fetch, RETRIEVAL_DIVERSITY, where)
+    if where is None or search_filter.residual:
+        hits = [hit for hit in hits if search_filter.matches(hit.metadata)][:k]
+    return hits
+
+
+def _search_all(vectors: List[List[float]], k: int,
+                search_filter: Optional[SearchFilter] = None) -> List[List[SearchHit]]:
+    """Search several query vectors concurrently (each in the caller's tenant context)."""
+    if len(vectors) == 1:
+        return [_search(vectors[0], k, search_filter)]
+    futures = [
+        _search_pool.submit(contextvars.copy_context().run, _search, vector, k, search_filter)
+        for vector in vectors
+    ]
+    return [future.result() for future in futures]
+
+
+def _merge_hits(hit_lists: List[List[SearchHit]]) -> List[SearchHit]:
+    """Union of result lists, deduplicated by chunk id (keeping the closest distance)."""
+    best: Dict[str, SearchHit] = {}
+    for hits in hit_lists:
+        for hit in hits:
+            current = best.get(hit.id)
+            if current is None or hit.distance < current.distance:
+                best[hit.id] = hit
+    return sorted(best.values(), key=lambda hit: hit.distance)
+
+
+def retrieve(query: str, k: int = 8, expansions: Optional[List[str]] = None,
+             filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Dense retrieval via the search backend, then rerank with cross-encoder.
+    
+    Between the two, near-duplicate candidates (SimHash) are dropped and
+    MMR over their stored embeddings picks a diverse set from an
+    over-fetched pool (MMR_FETCH_FACTOR × k per variant), so rerank work
+    and context slots go to distinct passages. With query expansion, the
+    query and its rewrites are embedded in one batch and searched
+    concurrently; the union is deduplicated by chunk id and up to k per
+    variant are reranked once against the original query. A filter scopes
+    the search itself (see filters.py) rather than the reranked results.
+    Query embeddings, rerank scores and whole results are cached (and kept
+    across restarts by warm_caches); results until the collection changes.
     
     Args:
         query: User's question
-        k: Number of documents to retrieve initially
+        k: Candidates reranked per query variant (more are searched for MMR)
+        expansions: Rewrites of the query (default: per QUERY_EXPANSION)
+        filters: Normalized retrieval filter (see normalize_filters)
         
     Returns:
-        List of dicts with: {text, metadata, score, rerank_score}
+        List of dicts with: {id, text, metadata, score, rerank_score}
     """
     try:
-        # Step 1: Dense retrieval using embeddings
-        docs_and_scores = vectorstore.similarity_search_with_score(query, k=k)
+        if get_vectorstore(create=False) is None:
+            logger.warning("No collection for this tenant yet")
+            return []
+        collection = collection_name_for()
+        queries = [query] + (expansions if expansions is not None else _expansions_for(query))
+        # The write stamp changes with any worker's write, so other workers' results go stale at once
+        cache_key = (collection, write_stamps.current(collection), tuple(queries), k, filter_key(filters))
+        cached = retrieval_cache.get(cache_key)
+        if cached is not None:
+            return [{**item, "metadata": dict(item["metadata"])} for item in cached]
         
-        if not docs_and_scores:
-            logger.warning(f"No documents found for query: {query}")
+        search_filter = compile_filters(filters, source_store, collection)
+        if search_filter is not None and search_filter.empty:
+            logger.info("No sources match the retrieval filter")
             return []
         
-        # Step 2: Prepare pairs for reranking
-        pairs = [(query, doc.page_content) for doc, _ in docs_and_scores]
+        # Step 1: Dense retrieval using embeddings (query + rewrites)
+        with stage("embed"):
+            vectors = _embed_queries(queries)
+        with stage("search"):
+            candidates = _merge_hits(_search_all(vectors, fetch_size(k), search_filter))
         
-        # Step 3: Rerank using cross-encoder for better relevance
-        rerank_scores = reranker.compute_score(pairs)
+        if not candidates:
+            logger.warning("No documents found for query", extra={"fields": {"query_chars": len(query)}})
+            return []
+        
+        # Step 2: Drop near-duplicates and pick a diverse set (MMR) to rerank, k per variant
+        hits = diversify(vectors, candidates, k * len(queries))
+        pairs = [(query, hit.text) for hit in hits]
         
-        # Step 4: Combine and sort results
-        items = []
-        for (doc, sim_score), rr_score in zip(docs_and_scores, rerank_scores):
-            items.append({
-                "text": doc.page_content,
-                "metadata": doc.metadata,
-                "score": float(sim_score),  # Similarity score from embeddings
-                "rerank_score": float(rr_score)  # Reranking score from cross-encoder
-            })
+        # Step 3: Rerank using cross-encoder for better relevance
+        with stage("rerank"):
+            rerank_scores = _rerank_scores(pairs)
         
-        # Sort by rerank score (higher is better)
-        items.sort(key=lambda x: x["rerank_score"], reverse=True)
+        # Step 4: Combine and sort results, then join source details for citations
+        items = _ranked_items(hits, rerank_scores)
+        _attach_sources(items)
         
-        logger.info(f"Retrieved {len(items)} documents for query: {query}")
+        # High-volume event: sampled, and without the question text
+        logger.info("Retrieved documents", extra={"sample": True, "fields": {
+            "results": len(items), "variants": len(queries), "candidates": len(candidates),
+            "query_chars": len(query)
+        }})
+        retrieval_cache.set(cache_key, [{**item, "metadata": dict(item["metadata"])} for item in items])
         return items
         
     except Exception as e:
@@ -84,16 +747,72 @@ def retrieve(query: str, k: int = 8) -> List[Dict[str, Any]]:
         return []
 
 
+def retrieve_batch(queries: List[str], k: int = 8,
+                   filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Retrieve for many queries at once.
+    
+    All queries (and their rewrites, with QUERY_EXPANSION=template) are
+    embedded in one pass and every (query, candidate) pair is reranked
+    together in RERANK_BATCH_SIZE batches, instead of one embedding call
+    and one small rerank per query.
+    
+    Args:
+        queries: Questions to retrieve for
+        k: Candidates reranked per query variant, as in retrieve()
+        filters: Normalized retrieval filter applied to every query
+        
+    Returns:
+        One result list per query, as returned by retrieve()
+    """
+    if not queries:
+        return []
+    if get_vectorstore(create=False) is None:
+        return [[] for _ in queries]
+    search_filter = compile_filters(filters, source_store, collection_name_for())
+    if search_filter is not None and search_filter.empty:
+        return [[] for _ in queries]
+    
+    # Step 1: Embed all query variants in one pass, then search each
+    variants = [[query] + _expansions_for(query) for query in queries]
+    flat = [v for group in variants for v in group]
+    vectors = _embed_queries(flat)
+    hit_lists, offset = [], 0
+    for group in variants:
+        group_vectors = vectors[offset:offset + len(group)]
+        candidates = _merge_hits(_search_all(group_vectors, fetch_size(k), search_filter))
+        hit_lists.append(diversify(group_vectors, candidates, k * len(group)))
+        offset += len(group)
+    
+    # Step 2: Rerank every distinct candidate pair together
+    pairs = [(query, hit.text) for query, hits in zip(queries, hit_lists) for hit in hits]
+    rerank_scores = _rerank_scores(pairs)
+    
+    # Step 3: Split the scores back per query
+    results, offset = [], 0
+    for hits in hit_lists:
+        results.append(_ranked_items(hits, rerank_scores[offset:offset + len(hits)]))
+        offset += len(hits)
+    _attach_sources([item for items in results for item in items])
+    logger.info(f"Batch retrieved {len(pairs)} candidates for {len(queries)} queries")
+    return results
+
+
 def get_collection_info() -> Dict[str, Any]:
     """Get information about the current vector collection."""
     try:
-        collection = vectorstore._collection
-        if collection:
+        store = get_vectorstore(create=False)
+        if store is not None:
+            collection = store._collection
             count = collection.count()
             return {
                 "document_count": count,
-                "collection_name": COLLECTION_NAME,
-                "embedding_model": EMBED_MODEL_NAME
+                "collection_name": collection_name_for(),
+                "tenant": current_tenant(),
+                "embedding_model": collection_embed_model(collection),
+                "size_bytes": _dir_size(Path(CHROMA_DIR)),
+                "sources": source_store.count(collection_name_for()),
+                "search": search_backend.info()
             }
         return {"error": "Collection not initialized"}
     except Exception as e:
@@ -101,13 +820,304 @@ def get_collection_info() -> Dict[str, Any]:
         return {"error": str(e)}
 
 
+def _dir_size(path: Path) -> int:
+    """Total size in bytes of all files under path."""
+    if not path.exists():
+        return 0
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def _collection_state() -> Dict[str, Any]:
+    """Chunk count and on-disk size, used for before/after reports."""
+    return {"count": get_vectorstore()._collection.count(), "size_bytes": _dir_size(Path(CHROMA_DIR))}
+
+
+def _maintenance_report(operation: str, started: float, before: Dict[str, Any], **extra) -> Dict[str, Any]:
+    """Build the result dict for a maintenance operation."""
+    after = _collection_state()
+    report = {
+        "success": True,
+        "operation": operation,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "count_before": before["count"],
+        "count_after": after["count"],
+        "size_before_bytes": before["size_bytes"],
+        "size_after_bytes": after["size_bytes"],
+    }
+    report.update(extra)
+    logger.info(f"{operation} finished in {report['duration_ms']} ms "
+                f"({report['count_before']} -> {report['count_after']} chunks, "
+                f"{report['size_before_bytes']} -> {report['size_after_bytes']} bytes)")
+    return report
+
+
+def _delete_where(operation: str, where: Dict[str, Any], batch_size: int,
+                  source_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Delete all chunks matching a metadata filter in bounded id batches, then their source rows."""
+    try:
+        with maintenance_lock:
+            started = time.perf_counter()
+            before = _collection_state()
+            collection = get_vectorstore()._collection
+            deleted = 0
+            while True:
+                ids = collection.get(where=where, limit=batch_size, include=[])["ids"]
+                if not ids:
+                    break
+                collection.delete(ids=ids)
+                deleted += len(ids)
+            if source_ids:
+                source_store.delete(source_ids)
+            notify_collection_changed()
+            return _maintenance_report(operation, started, before, deleted=deleted)
+    except Exception as e:
+        logger.error(f"Error in {operation}: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
+def _source_filter(key: str, value: str, source_ids: List[str]) -> Dict[str, Any]:
+    """Match chunks by source_id, and legacy chunks that still carry the full metadata."""
+    if not source_ids:
+        return {key: value}
+    return {"$or": [{key: value}, {"source_id": {"$in": source_ids}}]}
+
+
+def delete_by_source(source: str, batch_size: int = MAINTENANCE_BATCH_SIZE,
+                     source_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Delete every chunk that came from one source document.
+    
+    With source_ids, only the chunks of those source rows (and legacy
+    chunks carrying the path) are deleted, e.g. a file's previous version.
+    """
+    if source_ids is None:
+        source_ids = source_store.ids_for(collection_name_for(), source=source)
+    return _delete_where("delete_by_source", _source_filter("source", source, source_ids), batch_size, source_ids)
+
+
+def delete_by_ingest_batch(ingest_batch: str, batch_size: int = MAINTENANCE_BATCH_SIZE) -> Dict[str, Any]:
+    """Delete every chunk written by one ingestion run."""
+    source_ids = source_store.ids_for(collection_name_for(), ingest_batch=ingest_batch)
+    return _delete_where("delete_by_ingest_batch", _source_filter("ingest_batch", ingest_batch, source_ids),
+                         batch_size, source_ids)
+
+
 def clear_collection():
-    """Clear all documents from the collection."""
+    """Clear all documents by dropping and recreating the collection."""
     try:
-        vectorstore._collection.delete(where={})
-        vectorstore.persist()
-        logger.info("Collection cleared successfully")
-        return {"success": True, "message": "Collection cleared"}
+        with maintenance_lock:
+            started = time.perf_counter()
+            before = _collection_state()
+            get_vectorstore().reset_collection()
+            source_store.delete_collection(collection_name_for())
+            notify_collection_changed()
+            logger.info("Collection cleared successfully")
+            return _maintenance_report("clear", started, before, message="Collection cleared")
     except Exception as e:
         logger.error(f"Error clearing collection: {str(e)}")
         return {"success": False, "error": str(e)}
+
+
+# SQLite files under CHROMA_DIR (Chroma's own, and the sources table)
+_SQLITE_FILES = ("chroma.sqlite3", SOURCES_DB)
+
+
+def _vacuum_sqlite() -> None:
+    """Reclaim free pages left in the SQLite files by deletes."""
+    for name in _SQLITE_FILES:
+        db_path = Path(CHROMA_DIR) / name
+        if db_path.exists():
+            conn = sqlite3.connect(str(db_path))
+            try:
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+
+
+def compact_collection(batch_size: int = MAINTENANCE_BATCH_SIZE,
+                       transform: Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]] = None,
+                       on_copied: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    """
+    Rebuild the collection to reclaim space left by deletes.
+    
+    Chroma never shrinks the HNSW segment (deleted vectors stay in
+    link_lists.bin) or chroma.sqlite3, so all records are copied with their
+    stored embeddings (no re-embedding) into a fresh collection, which then
+    replaces the old one, and the SQLite file is vacuumed.
+    
+    Args:
+        batch_size: Records copied per page
+        transform: Optional rewrite of each page's metadatas while copying
+        on_copied: Called after the copy, before the new collection replaces the old one
+    """
+    try:
+        with maintenance_lock:
+            started = time.perf_counter()
+            before = _collection_state()
+            client = _client
+            source = get_vectorstore()._collection
+            collection_name = collection_name_for()
+            # Tenant ids never contain ".", so these can't collide with a tenant's collection
+            rebuild_name = f"{collection_name}.rebuild"
+            retired_name = f"{collection_name}.retired"
+            
+            existing = [getattr(c, "name", c) for c in client.list_collections()]
+            for stale in (rebuild_name, retired_name):
+                if stale in existing:
+                    client.delete_collection(stale)
+            target = client.create_collection(rebuild_name, metadata=source.metadata or None)
+            
+            copied = 0
+            while True:
+                batch = source.get(
+                    include=["embeddings", "documents", "metadatas"],
+                    limit=batch_size,
+                    offset=copied
+                )
+                if not batch["ids"]:
+                    break
+                target.add(
+                    ids=batch["ids"],
+                    embeddings=batch["embeddings"],
+                    documents=batch["documents"],
+                    metadatas=transform(batch["metadatas"]) if transform else batch["metadatas"]
+                )
+                copied += len(batch["ids"])
+            if on_copied is not None:
+                on_copied()
+            
+            # Keep the old collection until the new one is in place
+            source.modify(name=retired_name)
+            try:
+                target.modify(name=collection_name)
+            except Exception:
+                source.modify(name=collection_name)
+                raise
+            client.delete_collection(retired_name)
+            _forget_vectorstore()
+            notify_collection_changed()
+            _vacuum_sqlite()
+            return _maintenance_report("compact", started, before, copied=copied)
+    except Exception as e:
+        logger.error(f"Error compacting collection: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
+def migrate_metadata(batch_size: int = MAINTENANCE_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Move chunks written with full per-chunk metadata to the compact schema.
+    
+    A compaction whose copy step rewrites legacy metadata to
+    source_id/page/offset/section/paragraph and stores the document-level
+    fields once per (source, ingest batch) in the sources table.
+    """
+    registry = SourceRegistry()
+
+    def transform(metadatas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [m if m and "source_id" in m else registry.compact(m or {}) for m in metadatas]
+
+    report = compact_collection(
+        batch_size, transform, on_copied=lambda: source_store.add(collection_name_for(), registry.rows)
+    )
+    if report.get("success"):
+        report["sources_created"] = len(registry.rows)
+    return report
+
+
+def _snapshot_path(name: str) -> Path:
+    """Resolve a snapshot name, rejecting anything that is not a plain name."""
+    if not re.fullmatch(r"[A-Za-z0-9._-]{1,100}", name) or name.startswith("."):
+        raise ValueError(f"Invalid snapshot name: {name}")
+    return Path(SNAPSHOT_DIR) / name
+
+
+def snapshot_collection(name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Copy CHROMA_DIR to SNAPSHOT_DIR/<name>.
+    
+    The SQLite database is copied with the online backup API so the copy is
+    consistent; segment files are copied while writes are held off.
+    """
+    try:
+        name = name or datetime.now().strftime("%Y%m%d_%H%M%S")
+        target = _snapshot_path(name)
+        if target.exists():
+            return {"success": False, "error": f"Snapshot already exists: {name}"}
+        with maintenance_lock:
+            started = time.perf_counter()
+            before = _collection_state()
+            source_dir = Path(CHROMA_DIR)
+            shutil.copytree(source_dir, target, ignore=shutil.ignore_patterns("*.sqlite3*"))
+            for db_name in _SQLITE_FILES:
+                db_path = source_dir / db_name
+                if db_path.exists():
+                    src = sqlite3.connect(str(db_path))
+                    dst = sqlite3.connect(str(target / db_name))
+                    try:
+                        src.backup(dst)
+                    finally:
+                        dst.close()
+                        src.close()
+            return _maintenance_report("snapshot", started, before, snapshot=name,
+                                       snapshot_size_bytes=_dir_size(target))
+    except Exception as e:
+        logger.error(f"Error creating snapshot: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
+def list_snapshots() -> List[Dict[str, Any]]:
+    """List available snapshots, newest first."""
+    root = Path(SNAPSHOT_DIR)
+    if not root.exists():
+        return []
+    snapshots = [
+        {
+            "name": path.name,
+            "size_bytes": _dir_size(path),
+            "created_at": datetime.fromtimestamp(path.stat().st_mtime).isoformat()
+        }
+        for path in root.iterdir() if path.is_dir()
+    ]
+    return sorted(snapshots, key=lambda s: s["created_at"], reverse=True)
+
+
+def restore_snapshot(name: str) -> Dict[str, Any]:
+    """
+    Replace CHROMA_DIR with a snapshot and reopen the vector store.
+    
+    The snapshot is staged next to CHROMA_DIR first and swapped in with
+    renames, so a failed copy never leaves a half-restored store behind.
+    """
+    try:
+        source = _snapshot_path(name)
+        if not source.is_dir():
+            return {"success": False, "error": f"Snapshot not found: {name}"}
+        with maintenance_lock:
+            started = time.perf_counter()
+            before = _collection_state()
+            live_dir = Path(CHROMA_DIR)
+            staging_dir = live_dir.with_name(live_dir.name + ".restore")
+            retired_dir = live_dir.with_name(live_dir.name + ".old")
+            for path in (staging_dir, retired_dir):
+                if path.exists():
+                    shutil.rmtree(path)
+            shutil.copytree(source, staging_dir)
+            
+            # Release the open client (and its cached system) before swapping files
+            _client.clear_system_cache()
+            live_dir.rename(retired_dir)
+            try:
+                staging_dir.rename(live_dir)
+            except Exception:
+                retired_dir.rename(live_dir)
+                raise
+            finally:
+                _reopen_client()
+                source_store.reset()
+                search_backend.invalidate_all()
+                retrieval_cache.clear()
+            shutil.rmtree(retired_dir, ignore_errors=True)
+            return _maintenance_report("restore", started, before, snapshot=name)
+    except Exception as e:
+        logger.error(f"Error restoring snapshot: {str(e)}")
+        return {"success": False, "error": str(e)}
@@ -0,0 +1,530 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+import contextvars
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import rag
+from .rag import (
+    CHROMA_DIR, EMBED_MODEL_NAME, MAINTENANCE_BATCH_SIZE, VECTOR_INDEX_DIR, maintenance_lock, source_store,
+    collection_pointers, base_collection_name, collection_name_for, collection_embed_model, get_embeddings,
+    write_count
+)
+from .ingest import (
+    LOADERS, DEFAULT_CHUNKER, DEFAULT_CHUNK_SIZE, DEFAULT_OVERLAP, DEFAULT_CHUNK_TOKENS, DEFAULT_OVERLAP_TOKENS,
+    _load_file, chunk_documents, new_ingest_batch
+)
+from .bench_search import _sample_queries
+from .sources import SourceRegistry, expand_metadata
+from .tenants import current_tenant
+from .versions import version_name, version_of
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+# Validation of a rebuilt collection against the live one
+REINDEX_VALIDATION_QUERIES = int(os.getenv("REINDEX_VALIDATION_QUERIES", "50"))
+REINDEX_VALIDATION_K = int(os.getenv("REINDEX_VALIDATION_K", "5"))
+# Mean share of the live top-k sources a query must still find in the new version
+REINDEX_MIN_OVERLAP = float(os.getenv("REINDEX_MIN_OVERLAP", "0.5"))
+# A running job whose state file hasn't been updated for this long died with its worker
+REINDEX_STALE_SECONDS = int(os.getenv("REINDEX_STALE_SECONDS", "600"))
+
+# Job state, one file per tenant next to the collection pointers, so every worker sees it
+REINDEX_JOBS_DIR = "reindex_jobs"
+
+_RUNNING = ("building", "validating")
+# Fields kept in the state file beyond the constructor arguments
+_STATE_FIELDS = ("id", "embed_model", "reuse_embeddings", "status", "progress", "validation", "error",
+                 "started_at", "finished_at", "live_count", "live_writes")
+
+
+class ReindexJob:
+    """One background rebuild of a tenant's collection into a new version."""
+
+    def __init__(self, tenant: str, base: str, live: str, target: str, options: Dict[str, Any]):
+        self.id = uuid.uuid4().hex[:12]
+        self.tenant = tenant
+        self.base = base
+        self.live = live
+        self.target = target
+        self.options = options
+        self.embed_model = options.get("embed_model") or EMBED_MODEL_NAME
+        self.reuse_embeddings = False
+        self.status = "building"
+        self.progress = {"sources_total": 0, "sources_done": 0, "chunks": 0, "rechunked": 0, "copied": 0,
+                         "embedded": 0, "reused": 0}
+        self.validation: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.started_at = datetime.now().isoformat()
+        self.finished_at: Optional[str] = None
+        # Live collection state when the build started, to detect writes made meanwhile
+        self.live_count = 0
+        self.live_writes = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "tenant": self.tenant,
+            "status": self.status,
+            "live": self.live,
+            "target": self.target,
+            "embed_model": self.embed_model,
+            "reuse_embeddings": self.reuse_embeddings,
+            "options": {k: v for k, v in self.options.items() if k != "queries"},
+            "progress": dict(self.progress),
+            "validation": self.validation,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "ReindexJob":
+        job = cls(state["tenant"], state["base"], state["live"], state["target"], state["options"])
+        for field in _STATE_FIELDS:
+            setattr(job, field, state[field])
+        return job
+
+    def save(self) -> None:
+        """Write the job's state for the other workers (atomically, like the collection pointers)."""
+        state = {**self.snapshot(), "base": self.base, "live_count": self.live_count,
+                 "live_writes": self.live_writes}
+        path = _job_path(self.tenant)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp, path)
+
+
+# Jobs running in this process (by id); other workers only see their state files
+_running: Dict[str, ReindexJob] = {}
+_jobs_lock = threading.Lock()
+
+
+def _job_path(tenant: str) -> Path:
+    return Path(CHROMA_DIR) / REINDEX_JOBS_DIR / f"{tenant}.json"
+
+
+def _load_job(tenant: str) -> Optional[ReindexJob]:
+    """
+    Last reindex job of a tenant, from whichever worker started or changed it.
+
+    A job still marked running whose file went untouched for
+    REINDEX_STALE_SECONDS (and that isn't running here) is reported as
+    interrupted.
+    """
+    path = _job_path(tenant)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        age = time.time() - path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read reindex state {path}: {str(e)}")
+        return None
+    job = _running.get(state["id"]) or ReindexJob.from_state(state)
+    if job.status in _RUNNING and job.id not in _running and age > REINDEX_STALE_SECONDS:
+        job.status = "interrupted"
+        job.error = "The worker running the reindex stopped"
+    return job
+
+
+def _collection_names() -> List[str]:
+    return [getattr(c, "name", c) for c in rag._client.list_collections()]
+
+
+def _versions_of(base: str, names: List[str]) -> List[str]:
+    return [name for name in names if name == base or (name.startswith(base + ".v") and version_of(name))]
+
+
+def _drop_collection(name: str) -> None:
+    """Delete a collection version with its source rows and vector index."""
+    try:
+        rag._client.delete_collection(name)
+    except Exception as e:
+        logger.warning(f"Could not delete collection {name}: {str(e)}")
+    source_store.delete_collection(name)
+    shutil.rmtree(Path(VECTOR_INDEX_DIR) / name, ignore_errors=True)
+
+
+def _text_key(text: str) -> bytes:
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+def _as_list(vector) -> List[float]:
+    return vector.tolist() if hasattr(vector, "tolist") else list(vector)
+
+
+def _pages(collection, include: List[str], where: Optional[Dict[str, Any]] = None,
+           batch_size: int = MAINTENANCE_BATCH_SIZE):
+    offset = 0
+    while True:
+        batch = collection.get(where=where, include=include, limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        yield batch
+        offset += len(batch["ids"])
+
+
+def _scan_sources(live, reuse: bool) -> Tuple[List[Dict[str, Any]], Dict[bytes, str]]:
+    """
+    Source documents of the live collection, and (when reusing embeddings)
+    chunk text hash → live chunk id.
+    """
+    first_chunks: Dict[Tuple, Dict[str, Any]] = {}
+    reusable: Dict[bytes, str] = {}
+    for batch in _pages(live, ["documents", "metadatas"]):
+        for chunk_id, text, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+            metadata = metadata or {}
+            if "source_id" in metadata:
+                key = ("source_id", metadata["source_id"])
+            else:
+                key = ("legacy", metadata.get("source"), metadata.get("ingest_batch"))
+            first_chunks.setdefault(key, metadata)
+            if reuse:
+                reusable[_text_key(text)] = chunk_id
+
+    rows = source_store.get_many(key[1] for key in first_chunks if key[0] == "source_id")
+    sources = []
+    for key, metadata in first_chunks.items():
+        if key[0] == "source_id":
+            row = rows.get(key[1]) or {"source": "document"}
+            sources.append({"source": row["source"], "ingest_batch": row.get("ingest_batch"),
+                            "ingested_at": row.get("ingested_at"), "source_tag": row.get("source_tag"),
+                            "where": {"source_id": key[1]}, "rows": {key[1]: row}})
+        else:
+            source, ingest_batch = key[1], key[2]
+            where = {"source": source} if ingest_batch is None else \
+                {"$and": [{"source": source}, {"ingest_batch": ingest_batch}]}
+            sources.append({"source": source or "document", "ingest_batch": ingest_batch,
+                            "ingested_at": metadata.get("ingested_at"), "source_tag": metadata.get("source_tag"),
+                            "where": where, "rows": {}})
+    return sources, reusable
+
+
+def _rechunk(job: ReindexJob, entry: Dict[str, Any], registry: SourceRegistry) -> Optional[List]:
+    """Re-read a source file with the job's chunk settings (None if the file is gone)."""
+    path = Path(entry["source"])
+    if not (path.is_file() and path.suffix.lower() in LOADERS):
+        return None
+    documents = _load_file(path)
+    if not documents:
+        return None
+    for doc in documents:
+        # Keep the path as recorded at ingestion (loaders normalize it)
+        doc.metadata["source"] = entry["source"]
+    options = job.options
+    return chunk_documents(
+        documents, entry["source_tag"], options["chunk_size"], options["overlap"], options["chunker"],
+        options["chunk_tokens"], options["overlap_tokens"], entry["ingest_batch"] or new_ingest_batch(),
+        entry["ingested_at"] or datetime.now().isoformat(), registry
+    )
+
+
+def _write(job: ReindexJob, target, texts: List[str], metadatas: List[Dict[str, Any]],
+           vectors: List[Optional[List[float]]]) -> None:
+    """Embed the chunks that have no reusable vector and add the page to the new collection."""
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        embedded = get_embeddings(job.embed_model).embed_documents([texts[i] for i in missing])
+        for i, vector in zip(missing, embedded):
+            vectors[i] = vector
+    target.add(ids=[uuid.uuid4().hex for _ in texts], documents=texts, metadatas=metadatas,
+               embeddings=[_as_list(vector) for vector in vectors])
+    job.progress["chunks"] += len(texts)
+    job.progress["embedded"] += len(missing)
+    job.progress["reused"] += len(texts) - len(missing)
+    job.save()
+
+
+def _build(job: ReindexJob) -> SourceRegistry:
+    """Fill the new collection version from the sources of the live one."""
+    client = rag._client
+    live = client.get_collection(job.live)
+    reuse = job.options.get("reuse_embeddings")
+    job.reuse_embeddings = collection_embed_model(live) == job.embed_model if reuse is None else reuse
+    with maintenance_lock:
+        job.live_count = live.count()
+        job.live_writes = write_count(job.live)
+
+    if job.target in _collection_names():
+        _drop_collection(job.target)
+    metadata = {k: v for k, v in (live.metadata or {}).items() if k.startswith("hnsw:")}
+    metadata.update(embed_model=job.embed_model, chunker=job.options["chunker"], reindex_job=job.id)
+    target = client.create_collection(job.target, metadata=metadata)
+
+    sources, reusable = _scan_sources(live, job.reuse_embeddings)
+    job.progress["sources_total"] = len(sources)
+    registry = SourceRegistry()
+    batch_size = MAINTENANCE_BATCH_SIZE
+    for entry in sources:
+        docs = _rechunk(job, entry, registry)
+        if docs is not None:
+            # Reuse the live vector of every chunk whose text didn't change
+            for start in range(0, len(docs), batch_size):
+                page = docs[start:start + batch_size]
+                texts = [doc.page_content for doc in page]
+                live_ids = [reusable.get(_text_key(text)) for text in texts]
+                found = {}
+                wanted = list(dict.fromkeys(chunk_id for chunk_id in live_ids if chunk_id))
+                if wanted:
+                    stored = live.get(ids=wanted, include=["embeddings"])
+                    found = dict(zip(stored["ids"], stored["embeddings"]))
+                _write(job, target, texts, [doc.metadata for doc in page],
+                       [found.get(chunk_id) if chunk_id else None for chunk_id in live_ids])
+            job.progress["rechunked"] += 1
+        else:
+            # Source file no longer available: carry its existing chunks over
+            include = ["documents", "metadatas"] + (["embeddings"] if job.reuse_embeddings else [])
+            for batch in _pages(live, include, where=entry["where"]):
+                metadatas = [registry.compact(expand_metadata(m or {}, entry["rows"])) for m in batch["metadatas"]]
+                vectors = list(batch["embeddings"]) if job.reuse_embeddings else [None] * len(batch["ids"])
+                _write(job, target, list(batch["documents"]), metadatas, vectors)
+            job.progress["copied"] += 1
+        job.progress["sources_done"] += 1
+
+    source_store.add(job.target, registry.rows)
+    return registry
+
+
+def _live_changed(job: ReindexJob) -> bool:
+    live = rag._client.get_collection(job.live)
+    return live.count() != job.live_count or write_count(job.live) != job.live_writes
+
+
+def _result_sources(results: Dict[str, Any]) -> List[set]:
+    """Source path sets of each query's results."""
+    metadatas = results["metadatas"]
+    rows = source_store.get_many(m["source_id"] for hits in metadatas for m in hits if m and "source_id" in m)
+    return [{expand_metadata(m or {}, rows).get("source") for m in hits} for hits in metadatas]
+
+
+def validate(job: ReindexJob, source_count: int) -> Dict[str, Any]:
+    """
+    Compare the new version with the live one on a query set.
+
+    Each query is embedded with each collection's own model; the new
+    version passes when every query finds something, the mean share of
+    live top-k sources still found is at least the minimum overlap, and no
+    source document was lost.
+    """
+    client = rag._client
+    live, target = client.get_collection(job.live), client.get_collection(job.target)
+    queries = job.options.get("queries") or _sample_queries(live, REINDEX_VALIDATION_QUERIES)
+    min_overlap = job.options.get("min_overlap")
+    min_overlap = REINDEX_MIN_OVERLAP if min_overlap is None else min_overlap
+    report: Dict[str, Any] = {
+        "queries": len(queries),
+        "k": REINDEX_VALIDATION_K,
+        "min_overlap": min_overlap,
+        "live_chunks": live.count(),
+        "new_chunks": target.count(),
+        "live_sources": job.progress["sources_total"],
+        "new_sources": source_count,
+    }
+    reasons = []
+    if not queries:
+        reasons.append("no validation queries (the live collection is empty)")
+    else:
+        live_results = live.query(
+            query_embeddings=get_embeddings(collection_embed_model(live)).embed_documents(queries),
+            n_results=REINDEX_VALIDATION_K, include=["metadatas"]
+        )
+        new_results = target.query(
+            query_embeddings=get_embeddings(job.embed_model).embed_documents(queries),
+            n_results=REINDEX_VALIDATION_K, include=["metadatas"]
+        )
+        empty, overlaps = 0, []
+        for expected, found in zip(_result_sources(live_results), _result_sources(new_results)):
+            if not found:
+                empty += 1
+            if expected:
+                overlaps.append(len(expected & found) / len(expected))
+        report["empty_results"] = empty
+        report["mean_source_overlap"] = round(sum(overlaps) / len(overlaps), 3) if overlaps else None
+        if empty:
+            reasons.append(f"{empty} queries returned nothing")
+        if overlaps and report["mean_source_overlap"] < min_overlap:
+            reasons.append(f"mean source overlap {report['mean_source_overlap']} is below {min_overlap}")
+    if source_count < job.progress["sources_total"]:
+        reasons.append(f"{job.progress['sources_total'] - source_count} sources are missing")
+    report["passed"] = not reasons
+    report["reasons"] = reasons
+    return report
+
+
+def _run(job: ReindexJob) -> None:
+    try:
+        registry = _build(job)
+        if _live_changed(job):
+            job.status = "stale"
+            job.error = "The live collection was written to during the rebuild; run it again"
+            _drop_collection(job.target)
+            return
+        job.status = "validating"
+        job.save()
+        job.validation = validate(job, len(registry.rows))
+        job.status = "validated" if job.validation["passed"] else "failed_validation"
+        logger.info(f"Reindex {job.id} of {job.live} into {job.target}: {job.status}")
+        if job.status == "validated" and job.options.get("auto_swap", True):
+            try:
+                _activate(job)
+            except RuntimeError as e:
+                logger.warning(f"Reindex {job.id} not swapped in: {str(e)}")
+                _drop_collection(job.target)
+    except Exception as e:
+        logger.error(f"Error in reindex {job.id}: {str(e)}")
+        job.status = "failed"
+        job.error = str(e)
+        _drop_collection(job.target)
+    finally:
+        job.finished_at = datetime.now().isoformat()
+        with _jobs_lock:
+            _running.pop(job.id, None)
+        job.save()
+
+
+def start_reindex(embed_model: Optional[str] = None, chunker: str = DEFAULT_CHUNKER,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE, overlap: int = DEFAULT_OVERLAP,
+                  chunk_tokens: int = DEFAULT_CHUNK_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                  queries: Optional[List[str]] = None, auto_swap: bool = True,
+                  reuse_embeddings: Optional[bool] = None, min_overlap: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Start rebuilding the current tenant's collection into a new version in the background.
+
+    Searches keep using the live version throughout. Source files still on
+    disk are re-read and re-chunked with the given settings; sources whose
+    files are gone (uploads) keep their chunks. Chunk vectors are reused
+    when the text and embedding model are unchanged. When the new version
+    validates, it is swapped in (unless auto_swap is off).
+
+    Args:
+        embed_model: Embedding model of the new version (default: EMBED_MODEL)
+        chunker, chunk_size, overlap, chunk_tokens, overlap_tokens: Chunk settings, as for ingestion
+        queries: Validation queries (default: sampled chunk openings)
+        auto_swap: Activate the new version as soon as it validates
+        reuse_embeddings: Reuse stored vectors (default: when the live version used the same model)
+        min_overlap: Minimum mean source overlap (default: REINDEX_MIN_OVERLAP)
+
+    Raises:
+        RuntimeError: A reindex is already running for the tenant
+    """
+    tenant = current_tenant()
+    with _jobs_lock:
+        job = _load_job(tenant)
+        if job is not None and job.status in _RUNNING:
+            raise RuntimeError(f"Reindex {job.id} is already running for this tenant")
+        if job is not None and job.status == "interrupted":
+            _drop_collection(job.target)
+        base, live = base_collection_name(), collection_name_for()
+        names = _collection_names() + [v for v in collection_pointers.entry(base).values() if isinstance(v, str)]
+        version = max([version_of(name) for name in _versions_of(base, names)] + [0]) + 1
+        job = ReindexJob(tenant, base, live, version_name(base, version), {
+            "embed_model": embed_model, "chunker": chunker, "chunk_size": chunk_size, "overlap": overlap,
+            "chunk_tokens": chunk_tokens, "overlap_tokens": overlap_tokens, "queries": queries,
+            "auto_swap": auto_swap, "reuse_embeddings": reuse_embeddings, "min_overlap": min_overlap,
+        })
+        _running[job.id] = job
+        job.save()
+    threading.Thread(target=contextvars.copy_context().run, args=(_run, job),
+                     name=f"reindex-{tenant}", daemon=True).start()
+    logger.info(f"Reindex {job.id} started: {live} -> {job.target} (model {job.embed_model})")
+    return job.snapshot()
+
+
+def _activate(job: ReindexJob) -> Dict[str, Any]:
+    """Point the tenant at the job's version; the one before the previous is deleted."""
+    with maintenance_lock:
+        if collection_name_for(job.tenant) != job.live or _live_changed(job):
+            job.status = "stale"
+            job.error = "The live collection changed since the rebuild started; run it again"
+            job.save()
+            raise RuntimeError(job.error)
+        before = collection_pointers.entry(job.base)
+        entry = collection_pointers.set_active(job.base, job.target, version=version_of(job.target),
+                                               embed_model=job.embed_model, job=job.id)
+        retired = before.get("previous")
+        if retired and retired not in (job.target, job.live):
+            _drop_collection(retired)
+        job.status = "swapped"
+        job.save()
+    logger.info(f"Swapped {job.base} to {job.target}")
+    return entry
+
+
+def swap(force: bool = False) -> Dict[str, Any]:
+    """
+    Activate the current tenant's validated version.
+
+    With force, a version that failed validation is activated as well.
+
+    Raises:
+        ValueError: No version is waiting to be swapped in
+        RuntimeError: The live collection changed since the rebuild
+    """
+    job = _load_job(current_tenant())
+    allowed = ("validated", "failed_validation") if force else ("validated",)
+    if job is None or job.status not in allowed:
+        status = job.status if job is not None else "none"
+        raise ValueError(f"No reindexed version to swap in (last reindex: {status})")
+    return _activate(job)
+
+
+def discard() -> Dict[str, Any]:
+    """Delete the current tenant's rebuilt version that was not swapped in."""
+    job = _load_job(current_tenant())
+    if job is None or job.status not in ("validated", "failed_validation"):
+        status = job.status if job is not None else "none"
+        raise ValueError(f"No reindexed version to discard (last reindex: {status})")
+    _drop_collection(job.target)
+    job.status = "discarded"
+    job.save()
+    return job.snapshot()
+
+
+def rollback() -> Dict[str, Any]:
+    """
+    Make the current tenant's previous version active again.
+
+    Instant: the previous version is kept in full until the next swap.
+    Chunks ingested since the swap are only in the version rolled back from.
+
+    Raises:
+        ValueError: There is no previous version
+    """
+    base = base_collection_name()
+    with maintenance_lock:
+        previous = collection_pointers.entry(base).get("previous")
+        if previous and previous not in _collection_names():
+            raise ValueError(f"Previous version {previous} no longer exists")
+        return collection_pointers.rollback(base)
+
+
+def reindex_status() -> Dict[str, Any]:
+    """Last reindex job of the current tenant and its collection versions."""
+    base = base_collection_name()
+    entry = collection_pointers.entry(base)
+    client = rag._client
+    versions = []
+    for name in sorted(_versions_of(base, _collection_names()), key=version_of):
+        collection = client.get_collection(name)
+        versions.append({
+            "collection_name": name,
+            "version": version_of(name),
+            "document_count": collection.count(),
+            "embed_model": collection_embed_model(collection),
+            "active": name == entry["active"],
+            "previous": name == entry.get("previous"),
+        })
+    job = _load_job(current_tenant())
+    return {"job": job.snapshot() if job is not None else None, "pointer": entry, "versions": versions}
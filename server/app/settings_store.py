@@ -1,9 +1,15 @@
+import os
+import copy
 import json
+import hashlib
 import logging
+import threading
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 from datetime import datetime
 
+from .tenants import DEFAULT_TENANT, current_tenant
+
 # Get logger from package
 logger = logging.getLogger(__name__)
 
@@ -38,40 +44,115 @@ DEFAULT_SETTINGS = {
     "last_updated": datetime.now().isoformat()
 }
 
-# Configuration file path
+# Configuration file path (default tenant); other tenants live under TENANTS_DIR/<tenant>/
 CONFIG_PATH = Path("./config.json")
 BACKUP_PATH = Path("./config.backup.json")
+TENANTS_DIR = Path(os.getenv("TENANTS_DIR", "./tenants"))
+
+# Per-tenant settings snapshots: tenant -> (config file mtime_ns, merged settings, version)
+_snapshots: Dict[str, Tuple[Optional[int], Dict[str, Any], str]] = {}
+_snapshots_lock = threading.Lock()
+
+
+def _config_paths(tenant: Optional[str] = None) -> Tuple[Path, Path]:
+    """Config and backup file paths for a tenant."""
+    tenant = tenant or current_tenant()
+    if tenant == DEFAULT_TENANT:
+        return CONFIG_PATH, BACKUP_PATH
+    tenant_dir = TENANTS_DIR / tenant
+    return tenant_dir / "config.json", tenant_dir / "config.backup.json"
+
+
+def _config_mtime(path: Path) -> Optional[int]:
+    """Modification time of a config file, or None if it doesn't exist."""
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _settings_snapshot() -> Tuple[str, Dict[str, Any]]:
+    """
+    Return (version, settings) for the current tenant without copying.
+    
+    Settings are cached per tenant and only re-read when the config file's
+    mtime changes, so a request costs one stat() instead of a JSON parse.
+    The returned dict is shared and must not be modified.
+    """
+    tenant = current_tenant()
+    config_path, _ = _config_paths(tenant)
+    mtime = _config_mtime(config_path)
+    cached = _snapshots.get(tenant)
+    if cached is not None and cached[0] == mtime:
+        return cached[2], cached[1]
+    
+    if mtime is not None:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            settings = json.load(f)
+            logger.info(f"Settings loaded from config file ({tenant})")
+            
+            # Merge with defaults to ensure all keys exist
+            merged_settings = copy.deepcopy(DEFAULT_SETTINGS)
+            merged_settings.update(settings)
+    else:
+        logger.info(f"No config file found, using default settings ({tenant})")
+        merged_settings = copy.deepcopy(DEFAULT_SETTINGS)
+    
+    version = settings_version(merged_settings)
+    with _snapshots_lock:
+        _snapshots[tenant] = (mtime, merged_settings, version)
+    return version, merged_settings
 
 
 def load_settings() -> Dict[str, Any]:
     """
     Load settings from config file or return defaults.
     
+    Callers get their own copy of the cached snapshot and may modify it.
+    
     Returns:
         Dictionary containing current settings
     """
     try:
-        if CONFIG_PATH.exists():
-            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-                logger.info("Settings loaded from config file")
-                
-                # Merge with defaults to ensure all keys exist
-                merged_settings = DEFAULT_SETTINGS.copy()
-                merged_settings.update(settings)
-                
-                # Update timestamp
-                merged_settings["last_updated"] = datetime.now().isoformat()
-                
-                return merged_settings
-        else:
-            logger.info("No config file found, using default settings")
-            return DEFAULT_SETTINGS.copy()
-            
+        return copy.deepcopy(_settings_snapshot()[1])
     except Exception as e:
         logger.error(f"Error loading settings: {str(e)}")
         logger.info("Falling back to default settings")
-        return DEFAULT_SETTINGS.copy()
+        return copy.deepcopy(DEFAULT_SETTINGS)
+
+
+def load_settings_versioned() -> Tuple[str, Dict[str, Any]]:
+    """
+    Load settings together with their content version (see settings_version).
+    
+    Returns:
+        Tuple of (version, settings copy)
+    """
+    try:
+        version, settings = _settings_snapshot()
+        return version, copy.deepcopy(settings)
+    except Exception as e:
+        logger.error(f"Error loading settings: {str(e)}")
+        defaults = copy.deepcopy(DEFAULT_SETTINGS)
+        return settings_version(defaults), defaults
+
+
+def settings_version(settings: Dict[str, Any]) -> str:
+    """
+    Stable content hash of a settings dict.
+    
+    last_updated is left out so identical settings hash the same in every
+    worker, which makes the hash usable as an HTTP ETag.
+    """
+    content = {k: v for k, v in settings.items() if k != "last_updated"}
+    canonical = json.dumps(content, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def _invalidate_snapshot(tenant: Optional[str] = None) -> None:
+    """Drop the cached settings of a tenant after a write."""
+    with _snapshots_lock:
+        _snapshots.pop(tenant or current_tenant(), None)
 
 
 def save_settings(data: Dict[str, Any]) -> bool:
@@ -84,11 +165,12 @@ def save_settings(data: Dict[str, Any]) -> bool:
     Returns:
         True if successful, False otherwise
     """
+    config_path, backup_path = _config_paths()
     try:
         # Create backup of existing config
-        if CONFIG_PATH.exists():
+        if config_path.exists():
             import shutil
-            shutil.copy2(CONFIG_PATH, BACKUP_PATH)
+            shutil.copy2(config_path, backup_path)
             logger.info("Backup created")
         
         # Validate required fields
@@ -105,9 +187,13 @@ def save_settings(data: Dict[str, Any]) -> bool:
         # Update timestamp
         data["last_updated"] = datetime.now().isoformat()
         
-        # Save to file
-        with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
+        # Save to file (write-then-rename so readers never see a partial file)
+        config_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = config_path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, config_path)
+        _invalidate_snapshot()
         
         logger.info("Settings saved successfully")
         return True
@@ -177,17 +263,19 @@ def reset_settings() -> bool:
     Returns:
         True if successful, False otherwise
     """
+    config_path, backup_path = _config_paths()
     try:
         # Create backup of current config
-        if CONFIG_PATH.exists():
+        if config_path.exists():
             import shutil
-            shutil.copy2(CONFIG_PATH, BACKUP_PATH)
+            shutil.copy2(config_path, backup_path)
             logger.info("Backup created before reset")
         
         # Remove config file to trigger default loading
-        if CONFIG_PATH.exists():
-            CONFIG_PATH.unlink()
+        if config_path.exists():
+            config_path.unlink()
             logger.info("Config file removed")
+        _invalidate_snapshot()
         
         logger.info("Settings reset to defaults")
         return True
@@ -0,0 +1,274 @@
+import os
+import json
+import uuid
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .cache import TTLCache
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+# Source rows kept in memory for joining search results
+SOURCE_CACHE_SIZE = int(os.getenv("SOURCE_CACHE_SIZE", "5000"))
+
+SOURCES_DB = "sources.sqlite3"
+
+# Legacy per-chunk keys and their compact names
+CHUNK_KEYS = {"page_number": "page", "paragraph_number": "paragraph", "offset": "offset", "section_title": "section"}
+# Per-chunk values nothing reads back (0-based page duplicate, token count, copy of source)
+DROPPED_KEYS = {"page", "page_label", "chunk_tokens", "original_file"}
+# Stored as columns of the source row rather than in its attributes
+_SOURCE_COLUMNS = ("source", "ingest_batch", "ingested_at", "source_tag", "file_type")
+# Columns retrieval filters can match on (list of values each)
+FILTER_COLUMNS = ("source", "source_tag", "file_type", "ingest_batch")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    source_id TEXT PRIMARY KEY,
+    collection TEXT NOT NULL,
+    source TEXT NOT NULL,
+    ingest_batch TEXT,
+    ingested_at TEXT,
+    attributes TEXT NOT NULL,
+    source_tag TEXT,
+    file_type TEXT
+);
+"""
+
+# Created after _migrate, which adds the columns to older files
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS sources_by_source ON sources (collection, source);
+CREATE INDEX IF NOT EXISTS sources_by_batch ON sources (collection, ingest_batch);
+CREATE INDEX IF NOT EXISTS sources_by_tag ON sources (collection, source_tag);
+CREATE INDEX IF NOT EXISTS sources_by_type ON sources (collection, file_type);
+"""
+
+
+def file_type_of(source: str) -> Optional[str]:
+    """Lower-case extension of a source path ("pdf"), or None."""
+    return Path(source).suffix.lstrip(".").lower() or None
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """Add the source_tag/file_type columns to files written before them (file_type from the path)."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(sources)")}
+    if "source_tag" in columns:
+        return
+    with conn:
+        conn.execute("ALTER TABLE sources ADD COLUMN source_tag TEXT")
+        conn.execute("ALTER TABLE sources ADD COLUMN file_type TEXT")
+        rows = conn.execute("SELECT source_id, source FROM sources").fetchall()
+        conn.executemany("UPDATE sources SET file_type = ? WHERE source_id = ?",
+                         [(file_type_of(source), source_id) for source_id, source in rows])
+    logger.info(f"Added source_tag/file_type columns to the sources table ({len(rows)} rows)")
+
+
+def split_metadata(metadata: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Split full chunk metadata into (compact chunk fields, source-level fields).
+
+    Page, paragraph, offset and section stay on the chunk; per-chunk values
+    nothing reads are dropped; everything else (source, ingest batch,
+    loader and chunker fields) is the same for every chunk of a document.
+    """
+    chunk, source_level = {}, {}
+    for key, value in metadata.items():
+        if key in CHUNK_KEYS:
+            if value is not None and value != "":
+                chunk[CHUNK_KEYS[key]] = value
+        elif key not in DROPPED_KEYS:
+            source_level[key] = value
+    return chunk, source_level
+
+
+class SourceRegistry:
+    """Source rows created while compacting the chunks of one ingestion run or migration."""
+
+    def __init__(self):
+        self._rows: Dict[Tuple[str, Optional[str]], Dict[str, Any]] = {}
+
+    def compact(self, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Compact chunk metadata, registering its source on first sight."""
+        chunk, source_level = split_metadata(metadata)
+        source = str(source_level.get("source") or "document")
+        key = (source, source_level.get("ingest_batch"))
+        row = self._rows.get(key)
+        if row is None:
+            row = {
+                "source_id": uuid.uuid4().hex[:16],
+                "source": source,
+                "ingest_batch": source_level.get("ingest_batch"),
+                "ingested_at": source_level.get("ingested_at"),
+                "source_tag": source_level.get("source_tag"),
+                "file_type": source_level.get("file_type") or file_type_of(source),
+                "attributes": {k: v for k, v in source_level.items() if k not in _SOURCE_COLUMNS},
+            }
+            self._rows[key] = row
+        return {"source_id": row["source_id"], **chunk}
+
+    @property
+    def rows(self) -> List[Dict[str, Any]]:
+        return list(self._rows.values())
+
+
+class SourceStore:
+    """
+    Source documents, stored once per ingestion instead of on every chunk.
+
+    Lives in a small SQLite file next to chroma.sqlite3, so snapshots and
+    restores carry it along. Rows are looked up by id when search results
+    are turned into citations, through an LRU cache. Source path, tag, file
+    type and ingest batch are indexed columns, which retrieval filters
+    resolve to source ids.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._cache = TTLCache(SOURCE_CACHE_SIZE)
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call: the file is swapped out by snapshot restores
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        if not self._initialized:
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                conn.executescript(_SCHEMA)
+                _migrate(conn)
+                conn.executescript(_INDEXES)
+                self._initialized = True
+        return conn
+
+    def add(self, collection: str, rows: Iterable[Dict[str, Any]]) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO sources (source_id, collection, source, ingest_batch, ingested_at, "
+                    "attributes, source_tag, file_type) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(row["source_id"], collection, row["source"], row["ingest_batch"], row["ingested_at"],
+                      json.dumps(row["attributes"], default=str), row.get("source_tag"),
+                      row.get("file_type", file_type_of(row["source"]))) for row in rows]
+                )
+        finally:
+            conn.close()
+
+    def get_many(self, source_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Source rows by id (missing ids are left out)."""
+        found, missing = {}, []
+        for source_id in set(source_ids):
+            row = self._cache.get(source_id)
+            if row is None:
+                missing.append(source_id)
+            else:
+                found[source_id] = row
+        if missing:
+            conn = self._connect()
+            try:
+                placeholders = ",".join("?" * len(missing))
+                cursor = conn.execute(
+                    f"SELECT source_id, source, ingest_batch, ingested_at, attributes, source_tag, file_type "
+                    f"FROM sources WHERE source_id IN ({placeholders})", missing
+                )
+                for source_id, source, ingest_batch, ingested_at, attributes, source_tag, file_type in cursor:
+                    row = {"source": source, "ingest_batch": ingest_batch, "ingested_at": ingested_at,
+                           **json.loads(attributes)}
+                    row.update({k: v for k, v in (("source_tag", source_tag), ("file_type", file_type)) if v})
+                    self._cache.set(source_id, row)
+                    found[source_id] = row
+            finally:
+                conn.close()
+        return found
+
+    def ids_for(self, collection: str, source: Optional[str] = None, ingest_batch: Optional[str] = None) -> List[str]:
+        """Ids of a collection's sources with the given path or ingest batch."""
+        column, value = ("source", source) if source is not None else ("ingest_batch", ingest_batch)
+        conn = self._connect()
+        try:
+            cursor = conn.execute(f"SELECT source_id FROM sources WHERE collection = ? AND {column} = ?",
+                                  (collection, value))
+            return [row[0] for row in cursor]
+        finally:
+            conn.close()
+
+    def match(self, collection: str, values: Dict[str, List[str]], source_prefix: Optional[str] = None) -> List[str]:
+        """
+        Ids of a collection's sources matching every given column (any of
+        its values) and, if given, a source path prefix.
+        """
+        clauses, params = ["collection = ?"], [collection]
+        for column in FILTER_COLUMNS:
+            if values.get(column):
+                clauses.append(f"{column} IN ({','.join('?' * len(values[column]))})")
+                params.extend(values[column])
+        if source_prefix:
+            clauses.append("substr(source, 1, ?) = ?")
+            params.extend([len(source_prefix), source_prefix])
+        conn = self._connect()
+        try:
+            cursor = conn.execute(f"SELECT source_id FROM sources WHERE {' AND '.join(clauses)}", params)
+            return [row[0] for row in cursor]
+        finally:
+            conn.close()
+
+    def delete(self, source_ids: List[str]) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("DELETE FROM sources WHERE source_id = ?", [(i,) for i in source_ids])
+        finally:
+            conn.close()
+
+    def delete_collection(self, collection: str) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM sources WHERE collection = ?", (collection,))
+        finally:
+            conn.close()
+        self._cache.clear()
+
+    def reset(self) -> None:
+        """Forget cached rows and re-check the schema (after the file was replaced)."""
+        self._cache.clear()
+        self._initialized = False
+
+    def fingerprint(self, collection: str) -> str:
+        """Changes whenever a collection's sources are added or deleted (row count and newest rowid)."""
+        conn = self._connect()
+        try:
+            count, newest = conn.execute("SELECT COUNT(*), MAX(rowid) FROM sources WHERE collection = ?",
+                                         (collection,)).fetchone()
+            return f"{count}:{newest or 0}"
+        finally:
+            conn.close()
+
+    def count(self, collection: str) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM sources WHERE collection = ?", (collection,)).fetchone()[0]
+        finally:
+            conn.close()
+
+
+def expand_metadata(metadata: Dict[str, Any], sources: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Turn compact chunk metadata back into the full (legacy-named) form.
+
+    Chunks written before the compact schema have no source_id and are
+    returned unchanged.
+    """
+    source_id = metadata.get("source_id")
+    if source_id is None:
+        return metadata
+    expanded = dict(sources.get(source_id) or {"source": "document"})
+    for legacy, compact in CHUNK_KEYS.items():
+        if compact in metadata:
+            expanded[legacy] = metadata[compact]
+    expanded["source_id"] = source_id
+    return expanded
@@ -0,0 +1,122 @@
+import os
+import re
+import json
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Optional, Iterator
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+# Tenant used when a request doesn't name one (single-site deployments)
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")
+
+# Request headers / query parameter that select a tenant
+TENANT_HEADER = "X-Tenant-ID"
+WIDGET_KEY_HEADER = "X-Widget-Key"
+WIDGET_KEY_PARAM = "key"
+
+# Widget key → tenant mapping: "key1:tenant_a,key2:tenant_b" and/or a JSON file
+TENANT_WIDGET_KEYS = os.getenv("TENANT_WIDGET_KEYS", "")
+TENANTS_FILE = Path(os.getenv("TENANTS_FILE", "./tenants.json"))
+
+# When true (the default), X-Tenant-ID is only honoured from callers presenting
+# the admin token; anonymous clients select a tenant with a widget key
+REQUIRE_WIDGET_KEY = os.getenv("REQUIRE_WIDGET_KEY", "true").lower() == "true"
+
+# Starts and ends alphanumeric and stays short, so every collection name derived
+# from it (docs__<tenant>.v<N>.retired, ...) is still a valid Chroma name
+_TENANT_RE = re.compile(r"^[a-z0-9](?:[a-z0-9_-]{0,30}[a-z0-9])?$")
+
+_current_tenant: ContextVar[str] = ContextVar("current_tenant", default=DEFAULT_TENANT)
+
+
+def _load_widget_keys() -> Dict[str, str]:
+    """Build the widget key → tenant map from TENANT_WIDGET_KEYS and TENANTS_FILE."""
+    keys: Dict[str, str] = {}
+    for pair in filter(None, (p.strip() for p in TENANT_WIDGET_KEYS.split(","))):
+        key, _, tenant = pair.partition(":")
+        if key and tenant:
+            keys[key.strip()] = tenant.strip()
+    if TENANTS_FILE.exists():
+        try:
+            with open(TENANTS_FILE, 'r', encoding='utf-8') as f:
+                keys.update(json.load(f).get("widget_keys", {}))
+        except Exception as e:
+            logger.error(f"Error loading tenants file: {str(e)}")
+    return keys
+
+
+WIDGET_KEYS = _load_widget_keys()
+
+
+def normalize_tenant(tenant: Optional[str]) -> str:
+    """
+    Validate a tenant id.
+
+    Tenant ids end up in collection names and directory paths, so only
+    short lowercase slugs are accepted.
+
+    Raises:
+        ValueError: If the id is not a valid slug
+    """
+    if not tenant:
+        return DEFAULT_TENANT
+    tenant = tenant.strip().lower()
+    if not _TENANT_RE.match(tenant):
+        raise ValueError(f"Invalid tenant id: {tenant!r}")
+    return tenant
+
+
+def resolve_tenant(tenant_id: Optional[str] = None, widget_key: Optional[str] = None,
+                   trusted: bool = False) -> str:
+    """
+    Pick the tenant for a request.
+
+    A widget key wins over an explicit tenant header; unknown widget keys
+    are rejected rather than silently served from the default tenant. The
+    tenant header is only accepted from trusted (admin) callers unless
+    REQUIRE_WIDGET_KEY is off, so anonymous clients can't read another
+    tenant's documents by naming it.
+
+    Raises:
+        ValueError: If the widget key is unknown or the tenant id invalid
+        PermissionError: If an untrusted caller names a tenant
+    """
+    if widget_key:
+        tenant = WIDGET_KEYS.get(widget_key)
+        if tenant is None:
+            raise ValueError("Unknown widget key")
+        return normalize_tenant(tenant)
+    if tenant_id:
+        if REQUIRE_WIDGET_KEY and not trusted:
+            raise PermissionError(f"{TENANT_HEADER} requires the admin token; widgets use a widget key")
+        return normalize_tenant(tenant_id)
+    return DEFAULT_TENANT
+
+
+def current_tenant() -> str:
+    """Tenant of the request (or task) being processed."""
+    return _current_tenant.get()
+
+
+def set_current_tenant(tenant: str):
+    """Bind the tenant for the current context; returns a token for reset_current_tenant."""
+    return _current_tenant.set(normalize_tenant(tenant))
+
+
+def reset_current_tenant(token) -> None:
+    """Restore the tenant bound before set_current_tenant."""
+    _current_tenant.reset(token)
+
+
+@contextmanager
+def use_tenant(tenant: str) -> Iterator[str]:
+    """Run a block (CLI, background job) on behalf of a tenant."""
+    token = set_current_tenant(tenant)
+    try:
+        yield current_tenant()
+    finally:
+        reset_current_tenant(token)
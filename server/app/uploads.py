@@ -0,0 +1,378 @@
+import os
+import re
+import uuid
+import hashlib
+import logging
+import mimetypes
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+    from python_multipart.exceptions import MultipartParseError
+except ModuleNotFoundError:
+    # Releases before the package was renamed
+    from multipart.multipart import MultipartParser, parse_options_header
+    from multipart.exceptions import MultipartParseError
+
+try:
+    # Optional: resized variants of uploaded images (originals are served without it)
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIR = Path(os.getenv("UPLOADS_DIR", "./uploads"))
+# Largest image accepted by /upload/image (bytes), counted while the upload is copied
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", str(5 * 1024 * 1024)))
+ALLOWED_IMAGE_TYPES = [
+    media_type.strip()
+    for media_type in os.getenv("ALLOWED_IMAGE_TYPES", "image/jpeg,image/png,image/gif,image/webp").split(",")
+    if media_type.strip()
+]
+# Widths of the resized copies made of each upload (needs Pillow)
+IMAGE_VARIANT_WIDTHS = [int(w) for w in os.getenv("IMAGE_VARIANT_WIDTHS", "64,128,256").split(",") if w.strip()]
+# Largest image (width × height) accepted, read from the header before anything is decoded;
+# a small compressed file can otherwise expand to gigabytes of pixels (needs Pillow)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(25_000_000)))
+
+# Multipart framing and small form fields allowed on top of the file
+_FORM_OVERHEAD = 64 * 1024
+# Bytes the image type is sniffed from
+_SNIFF_BYTES = 12
+# EXIF orientations that turn the image by 90 degrees
+_ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+_EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/gif": "gif", "image/webp": "webp"}
+_MEDIA_TYPES = {extension: media_type for media_type, extension in _EXTENSIONS.items()}
+_SAVE_OPTIONS = {"png": {"optimize": True}, "jpg": {"quality": 85}, "webp": {"quality": 85}}
+_STORED_NAME = re.compile(r"^([0-9a-f]{32})(?:-w(\d+))?\.(png|jpg|gif|webp)$")
+
+
+class UploadTooLarge(ValueError):
+    """The upload exceeded the size limit while it was being copied."""
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Media type of an image from its first bytes (None if not a supported format)."""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _check_pixels(image) -> None:
+    """Reject an opened (not yet decoded) image with more than IMAGE_MAX_PIXELS pixels."""
+    if image.width * image.height > IMAGE_MAX_PIXELS:
+        raise ValueError(f"Image exceeds {IMAGE_MAX_PIXELS} pixels")
+
+
+class UploadStore:
+    """
+    Content-addressed image uploads.
+
+    Files are named by the hash of their content, so the same image
+    uploaded twice is stored once and a URL always refers to the same
+    bytes, which lets it be cached as immutable. Resized variants
+    (<hash>-w<width>.<ext>) are made once, at upload or on first request,
+    and kept next to the original. Files written by earlier versions under
+    other names are still served, with short-lived caching.
+    """
+
+    def __init__(self, root: Path = UPLOADS_DIR):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+
+    def writer(self, max_size: int = MAX_FILE_SIZE) -> "UploadWriter":
+        return UploadWriter(self, max_size)
+
+    def _store(self, temp: Path, digest: str, media_type: str, size: int) -> Dict[str, Any]:
+        """Move a written upload to its content-addressed name and make its variants."""
+        extension = _EXTENSIONS[media_type]
+        if Image is not None:
+            try:
+                with Image.open(temp) as image:
+                    _check_pixels(image)
+            except (OSError, Image.DecompressionBombError) as e:
+                raise ValueError(f"Not a valid image: {str(e)}")
+        path = self.root / f"{digest}.{extension}"
+        duplicate = path.exists()
+        if not duplicate:
+            os.replace(temp, path)
+        variants = {}
+        for width in IMAGE_VARIANT_WIDTHS:
+            try:
+                variant = self.variant(digest, extension, width)
+            except Exception as e:
+                logger.warning(f"Could not resize {path.name} to {width}px: {str(e)}")
+                continue
+            if variant != path:
+                variants[width] = variant.name
+        logger.info(f"Stored upload {path.name} ({size} bytes{', duplicate' if duplicate else ''})")
+        return {"filename": path.name, "size": size, "type": media_type, "hash": digest,
+                "duplicate": duplicate, "variants": variants}
+
+    def variant(self, digest: str, extension: str, width: int) -> Path:
+        """
+        A copy of a stored image at most `width` pixels wide, made on first use.
+
+        Returns the original when Pillow is unavailable, for GIFs (which
+        may be animated) and when the image is not wider than `width`.
+        The size is checked against IMAGE_MAX_PIXELS from the header, and
+        the image is scaled down before it is rotated upright, decoding
+        JPEGs at a reduced scale, so the full-size image is never held
+        in memory more than once.
+
+        Raises:
+            ValueError: the image has more than IMAGE_MAX_PIXELS pixels
+        """
+        source = self.root / f"{digest}.{extension}"
+        if not source.is_file():
+            raise FileNotFoundError(source.name)
+        path = self.root / f"{digest}-w{width}.{extension}"
+        if Image is None or extension == "gif" or path.exists():
+            return path if path.exists() else source
+        with self._lock:
+            if path.exists():
+                return path
+            with Image.open(source) as original:
+                _check_pixels(original)
+                rotated = original.getexif().get(0x0112, 1) in _ROTATED_ORIENTATIONS
+                shown_width = original.height if rotated else original.width
+                if shown_width <= width:
+                    return source
+                scale = width / shown_width
+                box = (max(1, round(original.width * scale)), max(1, round(original.height * scale)))
+                # Palette and bilevel images can only be resized by nearest neighbour
+                image = original.convert("RGBA") if original.mode in ("P", "1") else original
+                # Decodes JPEGs at the smallest scale that still covers the box (draft)
+                image.thumbnail(box, Image.LANCZOS)
+                resized = ImageOps.exif_transpose(image)
+            temp = self.root / f".variant-{uuid.uuid4().hex}.tmp"
+            try:
+                resized.save(temp, format=Image.registered_extensions()[f".{extension}"],
+                             **_SAVE_OPTIONS.get(extension, {}))
+                os.replace(temp, path)
+            finally:
+                if temp.exists():
+                    temp.unlink()
+        return path
+
+    def resolve(self, filename: str) -> Optional[Tuple[Path, str, bool]]:
+        """
+        Find a file to serve: (path, media type, immutable), None if unknown.
+
+        Variant names are only honoured for configured widths, so requests
+        can't make the server render arbitrary sizes.
+        """
+        if not filename or filename.startswith(".") or Path(filename).name != filename:
+            return None
+        match = _STORED_NAME.match(filename)
+        if match:
+            digest, width, extension = match.groups()
+            if width is None:
+                path = self.root / filename
+                return (path, _MEDIA_TYPES[extension], True) if path.is_file() else None
+            if int(width) not in IMAGE_VARIANT_WIDTHS:
+                return None
+            try:
+                return self.variant(digest, extension, int(width)), _MEDIA_TYPES[extension], True
+            except FileNotFoundError:
+                return None
+            except Exception as e:
+                # Serve the original rather than fail; not immutable, so a later fix shows up
+                logger.warning(f"Could not resize {digest}.{extension} to {width}px: {str(e)}")
+                return self.root / f"{digest}.{extension}", _MEDIA_TYPES[extension], False
+        # Uploads from before content addressing
+        path = self.root / filename
+        if not path.is_file():
+            return None
+        return path, mimetypes.guess_type(filename)[0] or "application/octet-stream", False
+
+
+class UploadWriter:
+    """
+    An upload being written into the store, fed block by block as it arrives.
+
+    Blocks are hashed and counted as they are written; the type is taken
+    from the file's first bytes rather than the client's content type, and
+    writing stops as soon as the size passes max_size. Blocking: call from
+    a worker thread.
+    """
+
+    def __init__(self, store: UploadStore, max_size: int):
+        self.store = store
+        self.max_size = max_size
+        self.size = 0
+        self.media_type: Optional[str] = None
+        self._head = b""
+        self._hasher = hashlib.sha256()
+        store.root.mkdir(parents=True, exist_ok=True)
+        self._temp = store.root / f".upload-{uuid.uuid4().hex}.tmp"
+        self._file = open(self._temp, "wb")
+
+    def _check_type(self) -> None:
+        self.media_type = sniff_image_type(self._head)
+        if self.media_type is None or self.media_type not in ALLOWED_IMAGE_TYPES:
+            raise ValueError(f"Unsupported image type. Allowed: {', '.join(ALLOWED_IMAGE_TYPES)}")
+
+    def write(self, block: bytes) -> None:
+        """
+        Raises:
+            ValueError: when the first bytes are not an allowed image type
+            UploadTooLarge: when the upload passes max_size
+        """
+        self.size += len(block)
+        if self.size > self.max_size:
+            raise UploadTooLarge(f"File exceeds {self.max_size} bytes")
+        if self.media_type is None:
+            self._head = (self._head + block)[:_SNIFF_BYTES]
+            if len(self._head) == _SNIFF_BYTES:
+                self._check_type()
+        self._hasher.update(block)
+        self._file.write(block)
+
+    def finish(self) -> Dict[str, Any]:
+        """Store the upload under its hash (see UploadStore); returns its description."""
+        try:
+            self._file.close()
+            if not self.size:
+                raise ValueError("Empty file")
+            if self.media_type is None:
+                self._check_type()
+            return self.store._store(self._temp, self._hasher.hexdigest()[:32], self.media_type, self.size)
+        finally:
+            self.abort()
+
+    def abort(self) -> None:
+        """Discard what was written (a no-op once finished)."""
+        self._file.close()
+        if self._temp.exists():
+            self._temp.unlink()
+
+
+async def receive_multipart(request: Request, write: Callable[[bytes], None],
+                            max_size: int) -> Tuple[Optional[str], Dict[str, str]]:
+    """
+    Stream the "file" part of a multipart/form-data request to `write`.
+
+    The body is read from the connection and parsed as it arrives; the
+    file part is handed to `write` block by block in a worker thread, so
+    neither the request nor the file is ever buffered whole. Reading stops
+    as soon as the file passes max_size or the body passes max_size plus
+    room for the form, whether or not a Content-Length was sent.
+
+    Returns:
+        (file name given by the client, None if there was no file part;
+        the other form fields)
+
+    Raises:
+        ValueError: not a multipart upload
+        UploadTooLarge: the request or the file exceeds the limit
+    """
+    limit = max_size + _FORM_OVERHEAD
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > limit:
+        raise UploadTooLarge(f"File exceeds {max_size} bytes")
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise ValueError("Expected a multipart/form-data upload")
+
+    part = {"field": b"", "value": b"", "headers": {}, "name": None, "is_file": False, "filename": None}
+    fields: Dict[str, str] = {}
+    blocks: List[bytes] = []
+
+    def on_part_begin() -> None:
+        part.update(headers={}, name=None, is_file=False)
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        part["field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        part["value"] += data[start:end]
+
+    def on_header_end() -> None:
+        part["headers"][part["field"].lower()] = part["value"]
+        part.update(field=b"", value=b"")
+
+    def on_headers_finished() -> None:
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        name = disposition.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in disposition:
+            # The first part named "file" that carries a file; other files are skipped
+            part["is_file"] = part["filename"] is None and name == "file"
+            if part["is_file"]:
+                part["filename"] = disposition[b"filename"].decode("utf-8", "replace")
+        elif name:
+            part["name"] = name
+            fields[name] = ""
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        if part["is_file"]:
+            blocks.append(data[start:end])
+        elif part["name"] is not None:
+            fields[part["name"]] += data[start:end].decode("utf-8", "replace")
+
+    def on_part_end() -> None:
+        part.update(name=None, is_file=False)
+
+    parser = MultipartParser(options[b"boundary"], {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field, "on_header_value": on_header_value,
+        "on_header_end": on_header_end, "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data, "on_part_end": on_part_end,
+    })
+    received = 0
+    size = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise UploadTooLarge(f"File exceeds {max_size} bytes")
+        try:
+            parser.write(chunk)
+        except MultipartParseError as e:
+            raise ValueError(f"Malformed multipart body: {str(e)}")
+        if blocks:
+            data = b"".join(blocks)
+            blocks.clear()
+            size += len(data)
+            if size > max_size:
+                raise UploadTooLarge(f"File exceeds {max_size} bytes")
+            await run_in_threadpool(write, data)
+    parser.finalize()
+    return part["filename"], fields
+
+
+async def receive_image(request: Request, store: Optional[UploadStore] = None,
+                        max_size: int = MAX_FILE_SIZE) -> Dict[str, Any]:
+    """
+    Stream the "file" part of a multipart/form-data request into the store
+    (see receive_multipart). Other form fields are ignored.
+
+    Raises:
+        ValueError: not a multipart upload, no file part, or not an allowed image
+        UploadTooLarge: the request or the file exceeds the limit
+    """
+    store = store or upload_store
+    writer = await run_in_threadpool(store.writer, max_size)
+    try:
+        filename, _ = await receive_multipart(request, writer.write, max_size)
+        if filename is None:
+            raise ValueError("Missing image file")
+        return await run_in_threadpool(writer.finish)
+    finally:
+        writer.abort()
+
+
+upload_store = UploadStore()
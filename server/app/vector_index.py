@@ -0,0 +1,471 @@
+import os
+import json
+import time
+import shutil
+import logging
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    # Optional: approximate (HNSW) search for large collections; exact search otherwise
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+# Storage type of the vector matrix: "float16" (half the size of float32,
+# no measurable recall loss) or "int8" (a quarter, one scale per row)
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float16")
+
+# Collections up to this size are searched exactly; larger ones use HNSW
+VECTOR_EXACT_SEARCH_MAX = int(os.getenv("VECTOR_EXACT_SEARCH_MAX", "50000"))
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+
+# Coarse search stage: a reduced and/or more coarsely quantized copy of the
+# vectors ("float16", "int8" or "binary" sign bits; "none" = off) is searched
+# first, and the VECTOR_RESCORE_FACTOR × k best rows are rescored against
+# the full-precision matrix. Every query reads the coarse copy (and HNSW
+# graph); full vectors are read for the shortlist only.
+VECTOR_COARSE = os.getenv("VECTOR_COARSE", "none")
+# Projection applied before coarse quantization: "pca" (fitted on a sample
+# of the collection), "truncate" (first dimensions; for Matryoshka-trained
+# models only) or "none"
+VECTOR_REDUCE = os.getenv("VECTOR_REDUCE", "none")
+VECTOR_REDUCED_DIM = int(os.getenv("VECTOR_REDUCED_DIM", "128"))
+VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "8"))
+
+# Rows scored per matrix product in exact search (bounds the float32 temporaries)
+SEARCH_BLOCK_ROWS = 65536
+# Vectors sampled to fit the PCA projection
+PCA_SAMPLE_ROWS = 20000
+
+INDEX_FORMAT = 2
+_MANIFEST = "manifest.json"
+_VECTORS = "vectors.bin"
+_SCALES = "scales.bin"
+_COARSE = "coarse.bin"
+_COARSE_SCALES = "coarse_scales.bin"
+_PROJECTION = "projection.npz"
+_IDS = "ids.json"
+_RECORDS = "records.jsonl"
+_RECORD_OFFSETS = "records.idx"
+_HNSW = "hnsw.bin"
+
+# Set bits per byte value, for Hamming distances on numpy < 2.0
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _to_distance(similarity: np.ndarray, space: str) -> np.ndarray:
+    """
+    Convert inner-product similarity of unit vectors into the distance Chroma reports.
+
+    Chroma's default "l2" space returns squared L2, which for normalized
+    vectors is 2 - 2·cos; "cosine" and "ip" return 1 - cos.
+    """
+    if space == "l2":
+        return 2.0 - 2.0 * similarity
+    return 1.0 - similarity
+
+
+def _quantize_int8(block: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization; returns (codes, scales)."""
+    scales = np.abs(block).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(block / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def _popcount(bits: np.ndarray) -> np.ndarray:
+    return np.bitwise_count(bits) if hasattr(np, "bitwise_count") else _POPCOUNT[bits]
+
+
+def _fit_projection(matrix: "_Matrix", count: int, dim: int, reduce: str,
+                    reduced_dim: int) -> Tuple[np.ndarray, np.ndarray, Optional[float]]:
+    """
+    Fit (mean, components) mapping full vectors into the coarse space.
+
+    Also returns the share of variance the projection keeps (PCA only).
+    """
+    reduced_dim = min(reduced_dim, dim)
+    if reduce == "truncate":
+        return np.zeros(dim, dtype=np.float32), np.eye(dim, dtype=np.float32)[:reduced_dim], None
+    rows = np.unique(np.linspace(0, count - 1, min(count, PCA_SAMPLE_ROWS)).astype(np.int64))
+    sample = matrix.rows(rows)
+    mean = sample.mean(axis=0)
+    _, singular, components = np.linalg.svd(sample - mean, full_matrices=False)
+    variance = singular ** 2
+    kept = float(variance[:reduced_dim].sum() / max(float(variance.sum()), 1e-12))
+    return mean.astype(np.float32), components[:reduced_dim].astype(np.float32), round(kept, 4)
+
+
+def _project(block: np.ndarray, mean: Optional[np.ndarray], components: Optional[np.ndarray]) -> np.ndarray:
+    """Project rows into the coarse space (unchanged without a projection) and renormalize them."""
+    if components is not None:
+        block = (block - mean) @ components.T
+    norms = np.linalg.norm(block, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (block / norms).astype(np.float32)
+
+
+def _encode_coarse(block: np.ndarray, dtype: str) -> Tuple[bytes, Optional[bytes]]:
+    """Coarse codes (and int8 scales) of projected rows."""
+    if dtype == "binary":
+        return np.packbits(block > 0, axis=1).tobytes(), None
+    if dtype == "int8":
+        codes, scales = _quantize_int8(block)
+        return codes.tobytes(), scales.tobytes()
+    return block.astype(np.float16).tobytes(), None
+
+
+def build_index(directory: Path, batches: Iterable[Dict[str, Any]], space: str = "l2",
+                dtype: str = VECTOR_DTYPE, source_count: Optional[int] = None, write_stamp: Optional[str] = None,
+                exact_search_max: int = VECTOR_EXACT_SEARCH_MAX, coarse: str = VECTOR_COARSE,
+                reduce: str = VECTOR_REDUCE, reduced_dim: int = VECTOR_REDUCED_DIM) -> Dict[str, Any]:
+    """
+    Write an index directory from batches of Chroma records.
+
+    Vectors are appended to a flat matrix file as they stream in; ids are
+    kept in a side file, and documents with their metadata as one JSON line
+    per row plus a file of line offsets, so they are read per hit. The
+    index is built in a sibling directory and swapped in with renames,
+    so readers never see a partial index.
+
+    With a coarse stage, a second pass projects every vector (PCA fitted
+    on a sample, or truncation), writes the coarse codes, and builds the
+    HNSW graph (if any) over the projected vectors instead of the full ones.
+
+    Args:
+        directory: Final index directory
+        batches: Dicts with ids, embeddings, documents and metadatas (as from collection.get)
+        space: Distance space of the source collection ("l2", "cosine" or "ip")
+        dtype: "float16" or "int8"
+        source_count: Record count of the source collection, used to detect staleness
+        write_stamp: Write token of the source collection when the copy started (see versions.WriteStamps)
+        exact_search_max: Build an HNSW graph above this many vectors (if hnswlib is installed)
+        coarse: Coarse stage storage: "none", "float16", "int8" or "binary"
+        reduce: Projection before the coarse stage: "none", "pca" or "truncate"
+        reduced_dim: Dimensions kept by the projection
+
+    Returns:
+        The manifest that was written
+    """
+    if dtype not in ("float16", "int8"):
+        raise ValueError(f"Unsupported vector dtype: {dtype}")
+    if coarse not in ("none", "float16", "int8", "binary"):
+        raise ValueError(f"Unsupported coarse stage: {coarse}")
+    if reduce not in ("none", "pca", "truncate"):
+        raise ValueError(f"Unsupported vector reduction: {reduce}")
+    if reduce != "none" and coarse == "none":
+        coarse = "float16"
+    started = time.perf_counter()
+    directory = Path(directory)
+    building_dir = directory.with_name(directory.name + ".building")
+    if building_dir.exists():
+        shutil.rmtree(building_dir)
+    building_dir.mkdir(parents=True)
+
+    ids: List[str] = []
+    offsets = [0]
+    count, dim = 0, None
+
+    with open(building_dir / _VECTORS, "wb") as vectors_file, open(building_dir / _SCALES, "wb") as scales_file, \
+            open(building_dir / _RECORDS, "wb") as records_file:
+        for batch in batches:
+            block = np.asarray(batch["embeddings"], dtype=np.float32)
+            if not len(block):
+                continue
+            dim = dim or block.shape[1]
+            if dtype == "int8":
+                codes, scales = _quantize_int8(block)
+                vectors_file.write(codes.tobytes())
+                scales_file.write(scales.tobytes())
+            else:
+                vectors_file.write(block.astype(np.float16).tobytes())
+
+            for document, metadata in zip(batch["documents"], batch["metadatas"]):
+                line = json.dumps([document, metadata or {}], ensure_ascii=False).encode("utf-8") + b"\n"
+                records_file.write(line)
+                offsets.append(offsets[-1] + len(line))
+            count += len(block)
+            ids.extend(batch["ids"])
+
+    np.asarray(offsets, dtype=np.uint64).tofile(building_dir / _RECORD_OFFSETS)
+    with open(building_dir / _IDS, "w", encoding="utf-8") as f:
+        json.dump(ids, f, ensure_ascii=False)
+
+    if not count:
+        coarse = "none"
+    # Binary codes are searched by a Hamming scan (hnswlib has no such space)
+    use_hnsw = hnswlib is not None and count > exact_search_max and coarse != "binary"
+    if count > exact_search_max and hnswlib is None:
+        logger.warning(f"{count} vectors exceed VECTOR_EXACT_SEARCH_MAX but hnswlib is not installed; "
+                       f"using exact search")
+
+    coarse_spec = None
+    if coarse != "none" or use_hnsw:
+        matrix = _open_matrix(building_dir, dtype, count, dim)
+        mean = components = graph = None
+        if coarse != "none":
+            coarse_spec = {"dtype": coarse, "reduce": reduce, "dim": dim}
+            if reduce != "none":
+                mean, components, kept = _fit_projection(matrix, count, dim, reduce, reduced_dim)
+                np.savez(building_dir / _PROJECTION, mean=mean, components=components)
+                coarse_spec.update(dim=len(components), explained_variance=kept)
+        if use_hnsw:
+            graph = hnswlib.Index(space="ip", dim=coarse_spec["dim"] if coarse_spec else dim)
+            graph.init_index(max_elements=count, ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+        coarse_file = open(building_dir / _COARSE, "wb") if coarse_spec else None
+        coarse_scales_file = open(building_dir / _COARSE_SCALES, "wb") if coarse == "int8" else None
+        try:
+            for start in range(0, count, SEARCH_BLOCK_ROWS):
+                stop = min(start + SEARCH_BLOCK_ROWS, count)
+                block = matrix.block(start, stop)
+                if coarse_spec is not None:
+                    block = _project(block, mean, components)
+                    codes, scales = _encode_coarse(block, coarse)
+                    coarse_file.write(codes)
+                    if scales is not None:
+                        coarse_scales_file.write(scales)
+                if graph is not None:
+                    graph.add_items(block, np.arange(start, stop))
+        finally:
+            for f in (coarse_file, coarse_scales_file):
+                if f is not None:
+                    f.close()
+        if graph is not None:
+            graph.save_index(str(building_dir / _HNSW))
+
+    manifest = {
+        "format": INDEX_FORMAT,
+        "dtype": dtype,
+        "count": count,
+        "dim": dim,
+        "space": space,
+        "hnsw": use_hnsw,
+        "coarse": coarse_spec,
+        "source_count": count if source_count is None else source_count,
+        "write_stamp": write_stamp,
+        "built_at": datetime.now().isoformat(),
+        "build_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    with open(building_dir / _MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    retired_dir = directory.with_name(directory.name + ".old")
+    if retired_dir.exists():
+        shutil.rmtree(retired_dir)
+    if directory.exists():
+        directory.rename(retired_dir)
+    building_dir.rename(directory)
+    shutil.rmtree(retired_dir, ignore_errors=True)
+    coarse_label = f", coarse {coarse_spec['dim']} x {coarse_spec['dtype']}" if coarse_spec else ""
+    logger.info(f"Built vector index {directory} ({count} x {dim} {dtype}{coarse_label}, "
+                f"{'hnsw' if use_hnsw else 'exact'}) in {manifest['build_ms']} ms")
+    return manifest
+
+
+class _Matrix:
+    """Read-only view of the on-disk vector matrix, dequantized a block at a time."""
+
+    def __init__(self, vectors: np.ndarray, scales: Optional[np.ndarray]):
+        self.vectors = vectors
+        self.scales = scales
+
+    def block(self, start: int, stop: int) -> np.ndarray:
+        block = np.asarray(self.vectors[start:stop], dtype=np.float32)
+        if self.scales is not None:
+            block *= self.scales[start:stop, None]
+        return block
+
+    def rows(self, rows: np.ndarray) -> np.ndarray:
+        """Selected rows (only their pages are read)."""
+        block = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            block *= self.scales[rows, None]
+        return block
+
+
+def _open_matrix(directory: Path, dtype: str, count: int, dim: Optional[int],
+                 vectors_file: str = _VECTORS, scales_file: str = _SCALES) -> _Matrix:
+    if not count:
+        return _Matrix(np.zeros((0, dim or 1), dtype=np.float16), None)
+    vectors = np.memmap(directory / vectors_file, dtype=np.dtype(dtype), mode="r", shape=(count, dim))
+    scales = np.fromfile(directory / scales_file, dtype=np.float32) if dtype == "int8" else None
+    return _Matrix(vectors, scales)
+
+
+class _CoarseStage:
+    """Memory-mapped coarse copy of the matrix, scored against a projected query."""
+
+    def __init__(self, directory: Path, spec: Dict[str, Any], count: int):
+        self.dtype = spec["dtype"]
+        self.dim = spec["dim"]
+        self.mean = self.components = None
+        if spec.get("reduce", "none") != "none":
+            projection = np.load(directory / _PROJECTION)
+            self.mean, self.components = projection["mean"], projection["components"]
+        if self.dtype == "binary":
+            self.codes = np.memmap(directory / _COARSE, dtype=np.uint8, mode="r",
+                                   shape=(count, (self.dim + 7) // 8))
+        else:
+            self.matrix = _open_matrix(directory, self.dtype, count, self.dim, _COARSE, _COARSE_SCALES)
+
+    def project(self, query: np.ndarray) -> np.ndarray:
+        return _project(query[None, :], self.mean, self.components)[0]
+
+    def scores(self, start: int, stop: int, projected: np.ndarray) -> np.ndarray:
+        """Approximate similarity of rows [start, stop) (binary: matching minus differing bits)."""
+        if self.dtype == "binary":
+            differing = _popcount(np.bitwise_xor(self.codes[start:stop], np.packbits(projected > 0))).sum(axis=1)
+            return (self.dim - 2.0 * differing).astype(np.float32)
+        return self.matrix.block(start, stop) @ projected
+
+
+class MmapVectorIndex:
+    """
+    In-process nearest-neighbour index over a memory-mapped vector matrix.
+
+    The matrix is mapped read-only, so the OS page cache holds it once no
+    matter how many workers open it. Search is an exact blocked matrix
+    product, or an HNSW graph lookup when the build produced one. With a
+    coarse stage, either runs over the coarse copy and yields a shortlist
+    that is rescored with the full-precision vectors. Documents and
+    metadata stay on disk (also mapped) and are decoded only for hits.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        with open(self.directory / _MANIFEST, "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != INDEX_FORMAT:
+            raise ValueError(f"Unsupported vector index format in {self.directory}")
+        self.count = self.manifest["count"]
+        self.dim = self.manifest["dim"]
+        self.space = self.manifest["space"]
+        self.matrix = _open_matrix(self.directory, self.manifest["dtype"], self.count, self.dim)
+        coarse_spec = self.manifest.get("coarse")
+        self.coarse = _CoarseStage(self.directory, coarse_spec, self.count) if coarse_spec else None
+        self.rescore_factor = VECTOR_RESCORE_FACTOR
+
+        with open(self.directory / _IDS, "r", encoding="utf-8") as f:
+            self.ids: List[str] = json.load(f)
+        self._offsets = np.fromfile(self.directory / _RECORD_OFFSETS, dtype=np.uint64)
+        # An empty file can't be mapped
+        self._records = np.memmap(self.directory / _RECORDS, dtype=np.uint8, mode="r") \
+            if self._offsets[-1] else np.zeros(0, dtype=np.uint8)
+
+        self.graph = None
+        if self.manifest.get("hnsw"):
+            if hnswlib is None:
+                logger.warning(f"{self.directory} has an HNSW graph but hnswlib is not installed; "
+                               f"using exact search")
+            else:
+                self.graph = hnswlib.Index(space="ip", dim=self.coarse.dim if self.coarse else self.dim)
+                self.graph.load_index(str(self.directory / _HNSW), max_elements=self.count)
+
+    @property
+    def source_count(self) -> int:
+        return self.manifest.get("source_count", self.count)
+
+    @property
+    def write_stamp(self) -> Optional[str]:
+        return self.manifest.get("write_stamp")
+
+    def _scan(self, scores_of: Callable[[int, int], np.ndarray], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k rows by score, scoring the matrix block by block."""
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, self.count, SEARCH_BLOCK_ROWS):
+            stop = min(start + SEARCH_BLOCK_ROWS, self.count)
+            scores = scores_of(start, stop)
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                scores = scores[top]
+                rows = top + start
+            else:
+                rows = np.arange(start, stop)
+            best_rows = np.concatenate([best_rows, rows])
+            best_scores = np.concatenate([best_scores, scores])
+        order = np.argsort(-best_scores, kind="stable")[:k]
+        return best_rows[order], best_scores[order]
+
+    def _exact_search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k rows by inner product over the full matrix."""
+        return self._scan(lambda start, stop: self.matrix.block(start, stop) @ query, k)
+
+    def _graph_search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        self.graph.set_ef(max(HNSW_EF_SEARCH, k))
+        labels, distances = self.graph.knn_query(query, k=k)
+        return labels[0].astype(np.int64), 1.0 - distances[0]
+
+    def _rescored_search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Shortlist on the coarse copy, then the top k of it by full-precision inner product."""
+        projected = self.coarse.project(query)
+        shortlist = min(self.count, max(k * self.rescore_factor, k))
+        if self.graph is not None:
+            rows, _ = self._graph_search(projected, shortlist)
+        else:
+            rows, _ = self._scan(lambda start, stop: self.coarse.scores(start, stop, projected), shortlist)
+        rows = np.sort(rows)
+        similarity = self.matrix.rows(rows) @ query
+        order = np.argsort(-similarity, kind="stable")[:k]
+        return rows[order], similarity[order]
+
+    def search(self, vector: List[float], k: int) -> List[Tuple[int, float]]:
+        """
+        Find the k nearest rows to a (normalized) query vector.
+
+        Returns:
+            List of (row, distance) with distances on Chroma's scale, nearest first
+        """
+        k = min(k, self.count)
+        if k <= 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        if self.coarse is not None:
+            rows, similarity = self._rescored_search(query, k)
+        elif self.graph is not None:
+            rows, similarity = self._graph_search(query, k)
+        else:
+            rows, similarity = self._exact_search(query, k)
+        distances = _to_distance(similarity, self.space)
+        return [(int(row), float(distance)) for row, distance in zip(rows, distances)]
+
+    def vector(self, row: int) -> List[float]:
+        """Stored (dequantized) vector of a row."""
+        return self.matrix.block(row, row + 1)[0].tolist()
+
+    def record(self, row: int) -> Tuple[str, str, Dict[str, Any]]:
+        """Return (id, document, metadata) of a row."""
+        start, stop = int(self._offsets[row]), int(self._offsets[row + 1])
+        document, metadata = json.loads(self._records[start:stop].tobytes())
+        return self.ids[row], document, metadata
+
+    def _file_size(self, name: str) -> int:
+        path = self.directory / name
+        return path.stat().st_size if path.exists() else 0
+
+    def info(self) -> Dict[str, Any]:
+        # Files every query scans: they should fit in RAM (page cache); with a
+        # coarse stage the full vectors are only read for the shortlist (and
+        # the coarse codes are only a fallback when there is a graph)
+        if self.graph is not None:
+            scanned = [_HNSW, _PROJECTION]
+        else:
+            scanned = [_COARSE, _COARSE_SCALES, _PROJECTION] if self.coarse else [_VECTORS, _SCALES]
+        search_bytes = sum(self._file_size(name) for name in scanned)
+        return {
+            **self.manifest,
+            "search": ("hnsw" if self.graph is not None else "exact") + ("+rescore" if self.coarse else ""),
+            "rescore_factor": self.rescore_factor if self.coarse else None,
+            "size_bytes": sum(f.stat().st_size for f in self.directory.iterdir() if f.is_file()),
+            "search_bytes": search_bytes,
+            "search_bytes_per_vector": round(search_bytes / self.count, 1) if self.count else None,
+        }
@@ -0,0 +1,164 @@
+import os
+import re
+import json
+import uuid
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+POINTERS_FILE = "active_collections.json"
+WRITE_STAMPS_DIR = "write_stamps"
+
+_VERSION_RE = re.compile(r"\.v(\d+)$")
+
+
+def version_name(base: str, version: int) -> str:
+    """
+    Physical collection name of a version of a logical collection.
+
+    Tenant ids never contain ".", so a version name can't collide with
+    another tenant's collection.
+    """
+    return f"{base}.v{version}"
+
+
+def version_of(name: str) -> int:
+    """Version number of a physical collection name (0 for the unversioned original)."""
+    match = _VERSION_RE.search(name)
+    return int(match.group(1)) if match else 0
+
+
+def base_of(name: str) -> str:
+    """Logical collection name of a physical one."""
+    return _VERSION_RE.sub("", name)
+
+
+class CollectionPointers:
+    """
+    Which physical collection is active for each logical collection.
+
+    Kept in a small JSON file under CHROMA_DIR that every worker reads:
+    a swap writes a new file and renames it over the old one (atomic on
+    POSIX), and readers stat the file on each lookup and reload it when it
+    changed, so all workers switch on their next request. Each entry keeps
+    the previously active collection for rollback.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._lock = threading.RLock()
+
+    def _current(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            stat = self.path.stat()
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stamp = None
+        if stamp != self._stamp:
+            with self._lock:
+                entries = {}
+                if stamp is not None:
+                    try:
+                        with open(self.path, "r", encoding="utf-8") as f:
+                            entries = json.load(f)
+                    except (OSError, ValueError) as e:
+                        logger.error(f"Could not read {self.path}: {str(e)}")
+                        return self._entries
+                self._entries, self._stamp = entries, stamp
+        return self._entries
+
+    def active(self, base: str) -> str:
+        """Physical name of the active collection (the base name until a version was swapped in)."""
+        return self._current().get(base, {}).get("active", base)
+
+    def entry(self, base: str) -> Dict[str, Any]:
+        return dict(self._current().get(base, {"active": base}))
+
+    def _write(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.path)
+
+    def set_active(self, base: str, name: str, **info: Any) -> Dict[str, Any]:
+        """Make `name` active for `base`, keeping the current one as previous."""
+        with self._lock:
+            entries = dict(self._current())
+            current = entries.get(base, {}).get("active", base)
+            entry = {
+                "active": name,
+                "previous": current if current != name else entries.get(base, {}).get("previous"),
+                "swapped_at": datetime.now().isoformat(),
+                **info,
+            }
+            entries[base] = entry
+            self._write(entries)
+        logger.info(f"Active collection for {base}: {current} -> {name}")
+        return entry
+
+    def rollback(self, base: str) -> Dict[str, Any]:
+        """Swap the active and previous collections."""
+        entry = self.entry(base)
+        previous = entry.get("previous")
+        if not previous:
+            raise ValueError(f"No previous version of {base} to roll back to")
+        info = {k: v for k, v in entry.items() if k not in ("active", "previous", "swapped_at")}
+        info.update(version=version_of(previous), rolled_back_from=entry["active"])
+        return self.set_active(base, previous, **info)
+
+
+class WriteStamps:
+    """
+    A token per physical collection that changes on every write.
+
+    Shared by all workers through small files under CHROMA_DIR: a write
+    renames a file with a new random token over <collection>.stamp, and
+    readers stat the file and only re-read it after it was replaced, so a
+    check costs one stat. Anything derived from a collection (a search
+    index, cached results) records the token it was built from and is
+    stale once the token differs. Collections not written to since stamps
+    were introduced have no token (None).
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self._tokens: Dict[str, Tuple[Tuple[int, int], str]] = {}
+
+    def _path(self, name: str) -> Path:
+        return self.directory / f"{name}.stamp"
+
+    def bump(self, name: str) -> str:
+        """Record a write to a collection; returns the new token."""
+        token = uuid.uuid4().hex
+        path = self._path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temp, "w", encoding="utf-8") as f:
+            f.write(token)
+        os.replace(temp, path)
+        return token
+
+    def current(self, name: str) -> Optional[str]:
+        path = self._path(name)
+        try:
+            stat = path.stat()
+            stamp = (stat.st_ino, stat.st_mtime_ns)
+            cached = self._tokens.get(name)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            with open(path, "r", encoding="utf-8") as f:
+                token = f.read().strip()
+        except FileNotFoundError:
+            return None
+        self._tokens[name] = (stamp, token)
+        return token
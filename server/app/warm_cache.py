@@ -0,0 +1,187 @@
+import os
+import zlib
+import time
+import pickle
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from .cache import TTLCache
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+# Snapshot runtime caches so restarted workers start warm ("false" disables)
+WARM_CACHE = os.getenv("WARM_CACHE", "true").lower() == "true"
+WARM_CACHE_FILE = Path(os.getenv("WARM_CACHE_FILE", "./warm_cache.bin"))
+WARM_CACHE_INTERVAL = float(os.getenv("WARM_CACHE_INTERVAL", "300"))
+
+_FORMAT = 1
+
+
+class _Registered:
+    def __init__(self, cache: TTLCache, signature: Callable[[], Any],
+                 collection_of: Optional[Callable[[Hashable], Optional[str]]],
+                 encode: Optional[Callable[[Any], Any]], decode: Optional[Callable[[Any], Any]]):
+        self.cache = cache
+        self.signature = signature
+        self.collection_of = collection_of
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+
+
+class WarmCaches:
+    """
+    Periodic snapshots of the runtime caches, reloaded at startup.
+
+    Each cache registers a signature (model names and settings its values
+    depend on) and, if its entries belong to a collection, how to find the
+    collection in a key. A snapshot records the signatures and a content
+    version of every collection its entries refer to; on load, a cache whose
+    signature changed is skipped and entries of collections that changed
+    since are dropped. Snapshots are one pickled, zlib-compressed file
+    written with a rename, so only load files this server wrote. Workers
+    share the file: each writes its own caches, the last write wins, and all
+    of them start from it.
+    """
+
+    def __init__(self, path: Path = WARM_CACHE_FILE, interval: float = WARM_CACHE_INTERVAL):
+        self.path = Path(path)
+        self.interval = interval
+        self._caches: Dict[str, _Registered] = {}
+        self._collection_version: Optional[Callable[[str], Optional[str]]] = None
+        self._saved_writes: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.last_saved: Optional[Dict[str, Any]] = None
+        self.last_loaded: Optional[Dict[str, Any]] = None
+
+    def register(self, name: str, cache: TTLCache, signature: Callable[[], Any],
+                 collection_of: Optional[Callable[[Hashable], Optional[str]]] = None,
+                 encode: Optional[Callable[[Any], Any]] = None, decode: Optional[Callable[[Any], Any]] = None) -> None:
+        self._caches[name] = _Registered(cache, signature, collection_of, encode, decode)
+
+    def set_collection_version(self, version: Callable[[str], Optional[str]]) -> None:
+        """Content version of a physical collection (None if it no longer exists)."""
+        self._collection_version = version
+
+    def _versions(self, names) -> Dict[str, Optional[str]]:
+        if self._collection_version is None:
+            return {}
+        versions = {}
+        for name in names:
+            try:
+                versions[name] = self._collection_version(name)
+            except Exception as e:
+                logger.warning(f"Could not read the version of collection {name}: {str(e)}")
+                versions[name] = None
+        return versions
+
+    def save(self, force: bool = False) -> Dict[str, Any]:
+        """Write a snapshot (skipped when nothing was cached since the last one, unless forced)."""
+        with self._lock:
+            writes = {name: registered.cache.writes for name, registered in self._caches.items()}
+            if not force and writes == self._saved_writes:
+                return {"saved": False, "reason": "unchanged"}
+            started = time.perf_counter()
+            caches, counts = {}, {}
+            for name, registered in self._caches.items():
+                entries = registered.cache.dump()
+                collections = set()
+                if registered.collection_of is not None:
+                    collections = {registered.collection_of(key) for key, _, _ in entries} - {None}
+                caches[name] = {
+                    "signature": registered.signature(),
+                    "versions": self._versions(collections),
+                    "entries": [(key, registered.encode(value), stored_at) for key, value, stored_at in entries],
+                }
+                counts[name] = len(entries)
+            payload = {"format": _FORMAT, "saved_at": datetime.now().isoformat(), "caches": caches}
+            data = zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL), 6)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+            with open(temp, "wb") as f:
+                f.write(data)
+            os.replace(temp, self.path)
+            self._saved_writes = writes
+            self.last_saved = {"saved": True, "at": payload["saved_at"], "bytes": len(data), "entries": counts,
+                               "duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+        logger.info(f"Saved warm cache snapshot: {counts} ({len(data)} bytes)")
+        return self.last_saved
+
+    def load(self) -> Dict[str, Any]:
+        """Restore the registered caches from the snapshot file, keeping only entries still valid."""
+        report: Dict[str, Any] = {}
+        try:
+            with open(self.path, "rb") as f:
+                payload = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Could not read warm cache snapshot {self.path}: {str(e)}")
+            return {"error": str(e)}
+        if payload.get("format") != _FORMAT:
+            return {"error": f"unsupported format {payload.get('format')}"}
+
+        for name, registered in self._caches.items():
+            snapshot = payload["caches"].get(name)
+            if snapshot is None:
+                continue
+            if snapshot["signature"] != registered.signature():
+                report[name] = {"restored": 0, "skipped": "models or settings changed"}
+                continue
+            current = self._versions(snapshot["versions"])
+            changed = {c for c, version in snapshot["versions"].items() if version is None or current[c] != version}
+            entries = []
+            for key, value, stored_at in snapshot["entries"]:
+                if registered.collection_of is not None and registered.collection_of(key) in changed:
+                    continue
+                entries.append((key, registered.decode(value), stored_at))
+            restored = registered.cache.restore(entries)
+            report[name] = {"restored": restored, "dropped": len(snapshot["entries"]) - len(entries)}
+            # What was just restored needs no saving
+            self._saved_writes[name] = registered.cache.writes
+        self.last_loaded = {"from": payload.get("saved_at"), "caches": report}
+        logger.info(f"Warm caches restored from {self.path}: {report}")
+        return self.last_loaded
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                logger.error(f"Error saving warm cache snapshot: {str(e)}")
+
+    def start(self) -> None:
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="warm-cache", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the periodic snapshots and write a final one."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        try:
+            self.save()
+        except Exception as e:
+            logger.error(f"Error saving warm cache snapshot: {str(e)}")
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "enabled": WARM_CACHE,
+            "file": str(self.path),
+            "interval_s": self.interval,
+            "caches": {name: registered.cache.snapshot() for name, registered in self._caches.items()},
+            "last_saved": self.last_saved,
+            "last_loaded": self.last_loaded,
+        }
+
+
+warm_caches = WarmCaches()
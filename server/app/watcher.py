@@ -0,0 +1,442 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    # Optional: native file events (inotify on Linux) for watch mode; polling otherwise
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .rag import (
+    CHROMA_DIR, maintenance_lock, source_store, collection_name_for, get_vectorstore, current_embeddings,
+    delete_by_source, notify_collection_changed
+)
+from .ingest import (
+    LOADERS, DEFAULT_CHUNKER, DEFAULT_CHUNK_SIZE, DEFAULT_OVERLAP, DEFAULT_CHUNK_TOKENS, DEFAULT_OVERLAP_TOKENS,
+    _load_file, chunk_documents, new_ingest_batch
+)
+from .sources import SourceRegistry
+from .inference import embed_pool
+from .tenants import DEFAULT_TENANT, use_tenant
+
+# Get logger from package
+logger = logging.getLogger(__name__)
+
+# Directories kept in sync with their collections: "path" or "path=tenant", comma-separated
+WATCH_DIRS = os.getenv("WATCH_DIRS", "")
+# "auto" (native events when watchdog is installed), "inotify" or "poll"
+WATCH_BACKEND = os.getenv("WATCH_BACKEND", "auto").lower()
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "5"))
+# A file is processed once it has had no events for this long
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", "2"))
+WATCH_BATCH_FILES = int(os.getenv("WATCH_BATCH_FILES", "20"))
+# Embedding budget for watched-folder updates, and the batch size they embed in
+WATCH_EMBED_CHUNKS_PER_MINUTE = int(os.getenv("WATCH_EMBED_CHUNKS_PER_MINUTE", "600"))
+WATCH_EMBED_BATCH = int(os.getenv("WATCH_EMBED_BATCH", "16"))
+# Source tag of watched-folder documents (retrieval filters can select them)
+WATCH_SOURCE_TAG = "watch"
+# Longest an embedding batch defers to queued live queries
+WATCH_MAX_YIELD_SECONDS = 5.0
+# Failed files are retried with doubling delays (from the debounce time) up to this many times
+WATCH_MAX_RETRIES = 5
+WATCH_MAX_RETRY_DELAY = 300.0
+
+# Content hash of every file last indexed, next to the collections it describes
+WATCH_STATE_FILE = "watch_state.json"
+_LOCK_FILE = "watch.lock"
+
+
+def parse_watch_dirs(value: str) -> List[Tuple[Path, str]]:
+    """Parse WATCH_DIRS into (directory, tenant) pairs."""
+    dirs = []
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        path, _, tenant = item.partition("=")
+        dirs.append((Path(path.strip()), tenant.strip() or DEFAULT_TENANT))
+    return dirs
+
+
+def _file_digest(path: Path) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class _RateLimiter:
+    """Token bucket over embedded chunks (bursts up to ten seconds' worth)."""
+
+    def __init__(self, per_minute: int):
+        self.rate = max(per_minute, 1) / 60.0
+        self.capacity = max(self.rate * 10, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def acquire(self, count: int, stop: threading.Event) -> float:
+        """Take `count` tokens, waiting for them if needed; returns the seconds waited."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0.0, (count - self.tokens) / self.rate)
+        if wait:
+            stop.wait(wait)
+        self.tokens -= count
+        return wait
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher: "FolderWatcher", tenant: str):
+        self.watcher = watcher
+        self.tenant = tenant
+
+    def on_any_event(self, event) -> None:
+        if event.is_directory:
+            return
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if path:
+                self.watcher.touch(Path(os.fsdecode(path)), self.tenant)
+
+
+class FolderWatcher:
+    """
+    Keep collections in sync with watched directories.
+
+    File events (native, or a periodic mtime/size scan) only mark a file
+    pending. Once a file has been quiet for WATCH_DEBOUNCE_SECONDS it is
+    processed with up to WATCH_BATCH_FILES others: unchanged content (by
+    hash) is skipped, changed files are re-chunked with the normal loaders
+    and replace their previous chunks, deleted files lose theirs. Chunks
+    are embedded in small batches under a chunks-per-minute budget, and
+    each batch first defers to live queries waiting on the embedder. A
+    file that fails is retried with backoff; when the state file is
+    replaced (a snapshot restore), it is reloaded and everything rescanned.
+
+    Only one worker process watches (an flock on CHROMA_DIR/watch.lock).
+    """
+
+    def __init__(self, dirs: List[Tuple[Path, str]], on_change: Optional[Callable[[], None]] = None):
+        self.dirs = dirs
+        self.on_change = on_change
+        self.backend: Optional[str] = None
+        self._state_path = Path(CHROMA_DIR) / WATCH_STATE_FILE
+        self._state: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # (inode, mtime) of the state file as last read or written, to notice a store restore
+        self._state_stamp: Optional[Tuple[int, int]] = None
+        self._pending: Dict[Tuple[Path, str], float] = {}
+        self._failures: Dict[Tuple[Path, str], int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._observer = None
+        self._lock_file = None
+        self._limiter = _RateLimiter(WATCH_EMBED_CHUNKS_PER_MINUTE)
+        self.stats = {"files_updated": 0, "files_deleted": 0, "files_unchanged": 0, "chunks_embedded": 0,
+                      "errors": 0, "throttled_s": 0.0, "yielded_s": 0.0, "last_update_at": None,
+                      "last_error": None}
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def _acquire_lock(self) -> bool:
+        if fcntl is None:
+            return True
+        Path(CHROMA_DIR).mkdir(parents=True, exist_ok=True)
+        self._lock_file = open(Path(CHROMA_DIR) / _LOCK_FILE, "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            return False
+
+    def start(self) -> bool:
+        """Start watching; False if another worker process already does."""
+        if not self.dirs or self._threads:
+            return False
+        if not self._acquire_lock():
+            logger.info("Watched folders are handled by another worker")
+            return False
+        self._load_state()
+        # Reconcile what changed while nothing was watching
+        self._reconcile()
+
+        use_events = Observer is not None and WATCH_BACKEND in ("auto", "inotify")
+        if WATCH_BACKEND == "inotify" and Observer is None:
+            logger.warning("WATCH_BACKEND=inotify but watchdog is not installed; polling instead")
+        if use_events:
+            self._observer = Observer()
+            for directory, tenant in self.dirs:
+                directory.mkdir(parents=True, exist_ok=True)
+                self._observer.schedule(_EventHandler(self, tenant), str(directory), recursive=True)
+            self._observer.start()
+            self.backend = "events"
+        else:
+            self._threads.append(threading.Thread(target=self._poll_loop, name="watch-poll", daemon=True))
+            self.backend = "poll"
+        self._threads.append(threading.Thread(target=self._run, name="watch-ingest", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Watching {', '.join(f'{d} ({t})' for d, t in self.dirs)} with {self.backend}")
+        return True
+
+    def _reconcile(self) -> None:
+        """Queue every watched file and every file the state knows, so differences get processed."""
+        for directory, tenant in self.dirs:
+            for path in self._scan(directory):
+                self.touch(path, tenant)
+            for source in list(self._state.get(tenant, {})):
+                if directory in Path(source).parents:
+                    self.touch(Path(source), tenant)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    # -- events ------------------------------------------------------------
+
+    def touch(self, path: Path, tenant: str) -> None:
+        """Mark a file as changed (its debounce window restarts)."""
+        if path.suffix.lower() not in LOADERS or any(part.startswith(".") for part in path.parts[-1:]):
+            return
+        with self._lock:
+            self._pending[(path, tenant)] = time.monotonic()
+
+    @staticmethod
+    def _scan(directory: Path) -> List[Path]:
+        if not directory.exists():
+            return []
+        return [path for path in directory.rglob("*") if path.is_file() and path.suffix.lower() in LOADERS]
+
+    def _poll_loop(self) -> None:
+        seen: Dict[Tuple[Path, str], Tuple[int, int]] = {}
+        first = True
+        while not self._stop.is_set():
+            current = {}
+            for directory, tenant in self.dirs:
+                for path in self._scan(directory):
+                    try:
+                        stat = path.stat()
+                    except OSError:
+                        continue
+                    current[(path, tenant)] = (stat.st_mtime_ns, stat.st_size)
+            if not first:
+                for key in set(current) | set(seen):
+                    if current.get(key) != seen.get(key):
+                        self.touch(*key)
+            seen, first = current, False
+            self._stop.wait(WATCH_POLL_INTERVAL)
+
+    def _due(self) -> List[Tuple[Path, str]]:
+        now = time.monotonic()
+        with self._lock:
+            due = [key for key, last in self._pending.items() if now - last >= WATCH_DEBOUNCE_SECONDS]
+            due = due[:WATCH_BATCH_FILES]
+            for key in due:
+                del self._pending[key]
+        return due
+
+    def _retry(self, key: Tuple[Path, str]) -> None:
+        """Queue a failed file again after a backoff, unless it failed too often."""
+        attempts = self._failures.get(key, 0) + 1
+        if attempts > WATCH_MAX_RETRIES:
+            self._failures.pop(key, None)
+            logger.error(f"Giving up on watched file {key[0]} until it changes again")
+            return
+        self._failures[key] = attempts
+        delay = min(WATCH_DEBOUNCE_SECONDS * 2 ** attempts, WATCH_MAX_RETRY_DELAY)
+        with self._lock:
+            # Due once `delay` has passed (a new event for the file makes it due sooner)
+            self._pending.setdefault(key, time.monotonic() + delay - WATCH_DEBOUNCE_SECONDS)
+
+    def _run(self) -> None:
+        while not self._stop.wait(0.5):
+            if self._state_replaced():
+                # The store was restored from a snapshot: start over from its state
+                logger.info("Watch state changed on disk; reloading it and rescanning watched folders")
+                self._load_state()
+                self._reconcile()
+            due = self._due()
+            if not due:
+                continue
+            changed = False
+            for path, tenant in due:
+                if self._stop.is_set():
+                    break
+                try:
+                    with use_tenant(tenant):
+                        changed |= self._process(path, tenant)
+                    self._failures.pop((path, tenant), None)
+                except Exception as e:
+                    logger.error(f"Error updating watched file {path}: {str(e)}")
+                    self.stats["errors"] += 1
+                    self.stats["last_error"] = f"{path}: {str(e)}"
+                    self._retry((path, tenant))
+            self._save_state()
+            if changed and self.on_change is not None:
+                self.on_change()
+
+    # -- updates -----------------------------------------------------------
+
+    def _process(self, path: Path, tenant: str) -> bool:
+        """Bring one file's chunks up to date; returns whether the collection changed."""
+        source = str(path)
+        known = self._state.setdefault(tenant, {})
+        if not path.is_file():
+            if source not in known:
+                return False
+            result = delete_by_source(source)
+            if not result.get("success"):
+                raise RuntimeError(result.get("error", "delete failed"))
+            del known[source]
+            self.stats["files_deleted"] += 1
+            logger.info(f"Removed {result.get('deleted', 0)} chunks of deleted file {source}")
+            return True
+
+        stat = path.stat()
+        digest = _file_digest(path)
+        if known.get(source, {}).get("sha1") == digest:
+            known[source].update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            self.stats["files_unchanged"] += 1
+            return False
+        chunks = self._replace(path, source)
+        known[source] = {"sha1": digest, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "chunks": chunks,
+                         "indexed_at": datetime.now().isoformat()}
+        self.stats["files_updated"] += 1
+        self.stats["last_update_at"] = known[source]["indexed_at"]
+        return True
+
+    def _embed(self, texts: List[str], model) -> List[List[float]]:
+        """Embed in small batches, within the rate limit and after queued live queries."""
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), WATCH_EMBED_BATCH):
+            batch = texts[start:start + WATCH_EMBED_BATCH]
+            yielded = 0.0
+            while embed_pool.queued > 0 and yielded < WATCH_MAX_YIELD_SECONDS and not self._stop.is_set():
+                self._stop.wait(0.05)
+                yielded += 0.05
+            self.stats["yielded_s"] = round(self.stats["yielded_s"] + yielded, 2)
+            self.stats["throttled_s"] = round(self.stats["throttled_s"] + self._limiter.acquire(len(batch), self._stop), 2)
+            if self._stop.is_set():
+                raise RuntimeError("Watcher stopped")
+            vectors.extend(model.embed_documents(batch))
+        self.stats["chunks_embedded"] += len(texts)
+        return vectors
+
+    def _replace(self, path: Path, source: str) -> int:
+        """
+        Re-chunk a file and swap its chunks in for the previous ones.
+
+        The new chunks are added before the previous ones are deleted, so a
+        failed update leaves the file's earlier version searchable.
+        """
+        documents = _load_file(path)
+        if not documents:
+            # Unreadable (or still being written): keep the indexed version until the next change
+            raise RuntimeError("file could not be loaded")
+        for doc in documents:
+            doc.metadata["source"] = source
+        registry = SourceRegistry()
+        docs = chunk_documents(
+            documents, WATCH_SOURCE_TAG, DEFAULT_CHUNK_SIZE, DEFAULT_OVERLAP, DEFAULT_CHUNKER, DEFAULT_CHUNK_TOKENS,
+            DEFAULT_OVERLAP_TOKENS, new_ingest_batch(), datetime.now().isoformat(), registry
+        )
+        # Embed outside the lock; searches keep finding the old chunks meanwhile
+        texts = [doc.page_content for doc in docs]
+        model = current_embeddings()
+        vectors = self._embed(texts, model) if texts else []
+        with maintenance_lock:
+            store = get_vectorstore()
+            if texts and store.embeddings is not model:
+                # A version built with another model was swapped in meanwhile
+                vectors = store.embeddings.embed_documents(texts)
+            previous = source_store.ids_for(collection_name_for(), source=source)
+            if docs:
+                source_store.add(collection_name_for(), registry.rows)
+                try:
+                    store._collection.add(
+                        ids=[uuid.uuid4().hex for _ in docs], documents=texts,
+                        metadatas=[doc.metadata for doc in docs], embeddings=vectors
+                    )
+                except Exception:
+                    source_store.delete([row["source_id"] for row in registry.rows])
+                    raise
+                notify_collection_changed()
+            result = delete_by_source(source, source_ids=previous)
+            if not result.get("success"):
+                raise RuntimeError(result.get("error", "delete failed"))
+        logger.info(f"Indexed {len(docs)} chunks of {source} (replaced {result.get('deleted', 0)})")
+        return len(docs)
+
+    # -- state -------------------------------------------------------------
+
+    def _stat_state(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self._state_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _state_replaced(self) -> bool:
+        """True when the state file is no longer the one last read or written here."""
+        return self._stat_state() != self._state_stamp
+
+    def _load_state(self) -> None:
+        self._state_stamp = self._stat_state()
+        try:
+            with open(self._state_path, "r", encoding="utf-8") as f:
+                self._state = json.load(f)
+        except FileNotFoundError:
+            self._state = {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read {self._state_path}: {str(e)}")
+            self._state = {}
+
+    def _save_state(self) -> None:
+        if self._state_replaced():
+            # Restored meanwhile; the next round reloads it instead of overwriting it
+            return
+        temp = self._state_path.with_name(self._state_path.name + ".tmp")
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(self._state, f, indent=2)
+        os.replace(temp, self._state_path)
+        self._state_stamp = self._stat_state()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "enabled": bool(self._threads),
+            "backend": self.backend,
+            "dirs": [{"path": str(directory), "tenant": tenant,
+                      "files": len(self._state.get(tenant, {}))} for directory, tenant in self.dirs],
+            "pending": pending,
+            "debounce_s": WATCH_DEBOUNCE_SECONDS,
+            "embed_chunks_per_minute": WATCH_EMBED_CHUNKS_PER_MINUTE,
+            **self.stats,
+        }
+
+
+folder_watcher = FolderWatcher(parse_watch_dirs(WATCH_DIRS))
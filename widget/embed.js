@@ -3,7 +3,16 @@
 
   // Configuration
   const WIDGET_HOST = new URL(document.currentScript.src).origin;
-  const PANEL_URL = WIDGET_HOST + "/widget/chat.html";
+  // Optional tenant key: <script src=".../embed.js" data-key="pk_...">
+  const WIDGET_KEY = document.currentScript.dataset.key || "";
+  // The server stamps the chat.html content hash in; unknown versions still work
+  const CHAT_VERSION = "__CHAT_HTML_VERSION__";
+  const PANEL_URL =
+    WIDGET_HOST +
+    "/widget/v/" +
+    CHAT_VERSION +
+    "/chat.html" +
+    (WIDGET_KEY ? "?key=" + encodeURIComponent(WIDGET_KEY) : "");
   const API_BASE = WIDGET_HOST;
 
   // Widget state